@@ -0,0 +1,544 @@
+import os
+import sys
+import json
+import time
+import random
+import logging
+import argparse
+import platform
+import resource
+import datetime
+import threading
+import socket
+import subprocess
+import urllib.request
+from multiprocessing import Pool, cpu_count
+from typing import Callable, Optional
+
+from PIL import Image, ImageDraw, ImageEnhance, ImageFilter
+import pillow_heif
+
+import main_func
+from image_processor import ImageProcessor
+from image_payload import ImagePayloadPreparer
+from image_dedup import SlideDeduplicator
+from image_filter import SlidePhotoFilter
+from image_sessions import SessionSegmenter
+from image_batching import ImageBatcher
+from llm_client import LLMHttpClientPool
+from llm_metrics import RunMetrics, percentile
+
+# 注册HEIC编码器
+pillow_heif.register_heif_opener()
+
+# 设置日志记录
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+# 合成语料的规模
+CORPUS_SIZES = (10, 100, 1000, 10000)
+# 合成照片的尺寸及其权重：常见的手机照片和截图尺寸
+PHOTO_SIZES = [((1600, 1200), 3), ((1920, 1080), 2), ((4032, 3024), 2), ((3024, 4032), 1)]
+# 全部阶段，按流水线顺序排列
+STAGES = ('convert', 'sort', 'filter', 'dedup', 'encode', 'payload', 'extract', 'summarize')
+# 合成语料的生成参数，参数变化时重新生成
+CORPUS_VERSION = 1
+
+
+def _slide_image(seed: int, size: tuple[int, int]) -> Image.Image:
+    """绘制一张投影幻灯片的照片：深色会场背景中的浅色幻灯片，包含标题栏、文字行和柱状图"""
+    rng = random.Random(seed)
+    width, height = size
+    image = Image.new('RGB', size, (40, 40, 45))
+    draw = ImageDraw.Draw(image)
+    # 幻灯片区域占画面的大部分
+    left, top = int(width * 0.06), int(height * 0.08)
+    right, bottom = int(width * 0.94), int(height * 0.9)
+    background = rng.choice([(250, 250, 250), (236, 240, 246), (245, 242, 232)])
+    draw.rectangle([left, top, right, bottom], fill=background)
+    slide_w, slide_h = right - left, bottom - top
+    accent = rng.choice([(30, 60, 140), (140, 30, 40), (20, 110, 70)])
+    draw.rectangle([left, top, right, top + slide_h // 8], fill=accent)
+    line_h = max(4, slide_h // 40)
+    y = top + slide_h // 6
+    chart = rng.random() < 0.4
+    text_right = left + slide_w // 2 if chart else right - slide_w // 12
+    while y < bottom - slide_h // 10:
+        indent = left + slide_w // 12 + (slide_w // 30 if rng.random() < 0.3 else 0)
+        length = int((text_right - indent) * rng.uniform(0.4, 1.0))
+        draw.rectangle([indent, y, indent + length, y + line_h], fill=(50, 50, 50))
+        y += line_h * rng.choice([2, 2, 3])
+    if chart:
+        bars = rng.randint(3, 7)
+        chart_left, chart_right = left + slide_w * 11 // 20, right - slide_w // 20
+        base = bottom - slide_h // 8
+        bar_w = (chart_right - chart_left) // (bars * 2)
+        for i in range(bars):
+            bar_top = base - int(slide_h * rng.uniform(0.1, 0.55))
+            x = chart_left + i * bar_w * 2
+            draw.rectangle([x, bar_top, x + bar_w, base], fill=accent)
+        draw.line([chart_left, base, chart_right, base], fill=(0, 0, 0), width=max(2, line_h // 3))
+    draw.text((left + slide_w // 20, top + slide_h // 32), f"Slide {seed}", fill=(255, 255, 255))
+    return image
+
+
+def _scene_image(seed: int, size: tuple[int, int]) -> Image.Image:
+    """绘制一张非幻灯片的照片：渐变背景上的大量彩色圆形，边缘方向分散"""
+    rng = random.Random(seed)
+    gradient = Image.linear_gradient('L').resize(size).convert('RGB')
+    tint = Image.new('RGB', size, tuple(rng.randint(60, 200) for _ in range(3)))
+    image = Image.blend(gradient, tint, 0.5)
+    draw = ImageDraw.Draw(image)
+    width, height = size
+    for _ in range(120):
+        x, y = rng.randint(0, width), rng.randint(0, height)
+        r = rng.randint(min(size) // 60, min(size) // 8)
+        draw.ellipse([x - r, y - r, x + r, y + r], fill=tuple(rng.randint(0, 255) for _ in range(3)))
+    return image
+
+
+def _generate_one(spec: dict) -> str:
+    """按规格生成一张照片，写入EXIF拍摄时间"""
+    if spec['kind'] == 'scene':
+        image = _scene_image(spec['seed'], spec['size'])
+    else:
+        image = _slide_image(spec['seed'], spec['size'])
+    if spec.get('shift'):
+        # 连拍的同一张幻灯片：轻微平移和亮度变化
+        dx, dy, brightness = spec['shift']
+        image = image.transform(image.size, Image.AFFINE, (1, 0, dx, 0, 1, dy), fillcolor=(40, 40, 45))
+        image = ImageEnhance.Brightness(image).enhance(brightness)
+    if spec.get('blur'):
+        image = image.filter(ImageFilter.GaussianBlur(spec['blur']))
+    exif = Image.Exif()
+    exif.get_ifd(0x8769)[36867] = spec['timestamp']
+    if spec['format'] == 'HEIF':
+        image.save(spec['path'], format='HEIF', quality=80, exif=exif.tobytes())
+    else:
+        image.save(spec['path'], format='JPEG', quality=88, exif=exif)
+    return spec['path']
+
+
+def plan_corpus(corpus_dir: str, count: int, seed: int = 0, heic_ratio: float = 0.2, duplicate_ratio: float = 0.15,
+                blur_ratio: float = 0.08, scene_ratio: float = 0.05) -> list[dict]:
+    """规划合成语料中每张照片的内容、尺寸、格式和拍摄时间
+
+    照片按报告分组，报告之间间隔10到20分钟；每场报告中相邻照片间隔20到90秒，连拍的重复照片间隔2到8秒。
+    """
+    rng = random.Random(seed)
+    sizes, weights = zip(*PHOTO_SIZES)
+    timestamp = datetime.datetime(2024, 5, 1, 9, 0, 0)
+    session_left = rng.randint(20, 60)
+    specs = []
+    previous = None
+    for i in range(count):
+        roll = rng.random()
+        if previous is not None and roll < duplicate_ratio:
+            spec = dict(previous, kind='duplicate', blur=None,
+                        shift=(rng.randint(-6, 6), rng.randint(-6, 6), rng.uniform(0.96, 1.04)))
+            timestamp += datetime.timedelta(seconds=rng.randint(2, 8))
+        else:
+            session_left -= 1
+            if session_left <= 0:
+                timestamp += datetime.timedelta(minutes=rng.randint(10, 20))
+                session_left = rng.randint(20, 60)
+            else:
+                timestamp += datetime.timedelta(seconds=rng.randint(20, 90))
+            roll = rng.random()
+            kind = 'scene' if roll < scene_ratio else 'blurry' if roll < scene_ratio + blur_ratio else 'slide'
+            size = rng.choices(sizes, weights)[0]
+            # 模糊半径按照片尺寸缩放，缩略图上的模糊程度与尺寸无关
+            spec = {'kind': kind, 'seed': seed * 1000003 + i, 'size': size,
+                    'format': 'HEIF' if rng.random() < heic_ratio else 'JPEG',
+                    'blur': rng.uniform(6, 12) * max(size) / 1600 if kind == 'blurry' else None, 'shift': None}
+            if kind == 'slide':
+                previous = spec
+        ext = '.heic' if spec['format'] == 'HEIF' else '.jpg'
+        spec = dict(spec, timestamp=timestamp.strftime('%Y:%m:%d %H:%M:%S'),
+                    path=os.path.join(corpus_dir, f"IMG_{i:05d}{ext}"))
+        specs.append(spec)
+    return specs
+
+
+def generate_corpus(corpus_dir: str, count: int, seed: int = 0, workers: int = None, **ratios) -> list[str]:
+    """生成合成语料，目录中已有参数相同的语料时直接复用，返回照片的绝对路径"""
+    corpus_dir = os.path.abspath(corpus_dir)
+    manifest_path = os.path.join(corpus_dir, 'manifest.json')
+    params = {'version': CORPUS_VERSION, 'count': count, 'seed': seed, **ratios}
+    if os.path.exists(manifest_path):
+        with open(manifest_path, 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+        if manifest['params'] == params and all(os.path.exists(path) for path in manifest['files']):
+            return manifest['files']
+    os.makedirs(corpus_dir, exist_ok=True)
+    specs = plan_corpus(corpus_dir, count, seed, **ratios)
+    started = time.perf_counter()
+    with Pool(workers or cpu_count()) as pool:
+        files = pool.map(_generate_one, specs, chunksize=max(1, count // (8 * (workers or cpu_count()))))
+    kinds = {}
+    for spec in specs:
+        kinds[spec['kind']] = kinds.get(spec['kind'], 0) + 1
+    logging.info(f"生成{count}张合成照片用时{time.perf_counter() - started:.1f}秒: {kinds}")
+    with open(manifest_path, 'w', encoding='utf-8') as f:
+        json.dump({'params': params, 'kinds': kinds, 'files': files}, f, ensure_ascii=False)
+    return files
+
+
+def current_rss() -> Optional[int]:
+    """当前进程的常驻内存字节数，无法读取时返回None"""
+    try:
+        with open('/proc/self/statm', 'r') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        return None
+
+
+def max_rss_bytes(who=resource.RUSAGE_SELF) -> int:
+    """进程启动以来的峰值常驻内存，Linux上ru_maxrss单位为KB，macOS上为字节"""
+    value = resource.getrusage(who).ru_maxrss
+    return value if sys.platform == 'darwin' else value * 1024
+
+
+class RSSSampler:
+    """在阶段执行期间定期采样常驻内存，记录该阶段的峰值
+
+    无法读取/proc时退回到进程级的ru_maxrss，此时峰值包含之前阶段的内存占用。
+    """
+    def __init__(self, interval: float = 0.02):
+        self.interval = interval
+        self.peak = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def __enter__(self) -> 'RSSSampler':
+        self.peak = current_rss() or 0
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.peak = max(self.peak, current_rss() or 0)
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        if current_rss() is None:
+            self.peak = max_rss_bytes()
+        return False
+
+
+def timed(func: Callable, samples: list) -> Callable:
+    """包装函数，把每次调用的耗时追加到samples中"""
+    def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            samples.append(time.perf_counter() - started)
+    return wrapper
+
+
+def stage_result(items: int, seconds: float, latencies: list[float], sampler: RSSSampler) -> dict:
+    """整理单个阶段的结果：吞吐量（条/秒）、单条耗时的p50/p95和峰值内存"""
+    return {
+        'items': items,
+        'seconds': round(seconds, 3),
+        'throughput': round(items / seconds, 2) if seconds > 0 else None,
+        'latency_p50': round(percentile(latencies, 50), 4) if latencies else None,
+        'latency_p95': round(percentile(latencies, 95), 4) if latencies else None,
+        'peak_rss_mb': round(sampler.peak / 1024 / 1024, 1),
+    }
+
+
+class MockServerProcess:
+    """在子进程中运行模拟LLM服务，避免服务解析请求占用的内存计入流水线的峰值内存"""
+    def __init__(self, settings: dict, host: str = '127.0.0.1'):
+        self.settings = settings
+        self.host = host
+        self.port = None
+        self._process = None
+
+    def start(self, timeout: float = 10.0) -> 'MockServerProcess':
+        with socket.socket() as sock:
+            sock.bind((self.host, 0))
+            self.port = sock.getsockname()[1]
+        script = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'mock_llm_server.py')
+        self._process = subprocess.Popen([sys.executable, script, '--host', self.host, '--port', str(self.port),
+                                          '--settings', json.dumps(self.settings)])
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                self.stats()
+                return self
+            except OSError:
+                if time.monotonic() > deadline or self._process.poll() is not None:
+                    self.stop()
+                    raise RuntimeError("模拟LLM服务启动失败")
+                time.sleep(0.1)
+
+    def stats(self) -> dict:
+        with urllib.request.urlopen(f"http://{self.host}:{self.port}/stats", timeout=5) as response:
+            return json.load(response)
+
+    def stop(self):
+        if self._process is not None:
+            self._process.terminate()
+            self._process.wait()
+            self._process = None
+
+
+class PipelineBenchmark:
+    """在合成语料上逐阶段运行参会报告流水线，LLM请求发往本地模拟服务
+
+    每个语料在单独的工作目录中运行，目录中生成指向模拟服务的config.json，
+    overrides中的配置项会合并进去，用于比较不同配置（例如合并请求、预处理参数）的效果。
+    """
+    def __init__(self, work_dir: str, server: MockServerProcess, overrides: dict = None, stages=STAGES):
+        self.work_dir = os.path.abspath(work_dir)
+        self.server = server
+        self.overrides = overrides or {}
+        self.stages = [stage for stage in STAGES if stage in stages]
+
+    def write_config(self, run_dir: str) -> dict:
+        config = {
+            'api_type': '本地大模型',
+            'local_llm': {'llm_address': self.server.host, 'llm_port': self.server.port, 'model_name': 'mock'},
+            'image_cache': {'dir': os.path.join(run_dir, 'image_cache')},
+            'vlm_payload': {'cache': False},
+            'response_cache': {'enabled': False},
+        }
+        for key, value in self.overrides.items():
+            if isinstance(value, dict) and isinstance(config.get(key), dict):
+                config[key].update(value)
+            else:
+                config[key] = value
+        with open(os.path.join(run_dir, 'config.json'), 'w', encoding='utf-8') as f:
+            json.dump(config, f, ensure_ascii=False, indent=2)
+        return config
+
+    def run(self, name: str, images: list[str]) -> dict:
+        """在工作目录中运行全部阶段，返回每个阶段的结果"""
+        run_dir = os.path.join(self.work_dir, name)
+        os.makedirs(run_dir, exist_ok=True)
+        cwd = os.getcwd()
+        os.chdir(run_dir)
+        try:
+            return self._run(run_dir, images)
+        finally:
+            os.chdir(cwd)
+
+    def _run(self, run_dir: str, images: list[str]) -> dict:
+        config = self.write_config(run_dir)
+        metrics = RunMetrics.start(config)
+        server_before = self.server.stats()
+        processor = ImageProcessor()
+        stages = {}
+        started = time.perf_counter()
+
+        def measure(stage: str, func: Callable, items: Callable = len, latencies: list = None):
+            samples = latencies if latencies is not None else []
+            with RSSSampler() as sampler:
+                stage_started = time.perf_counter()
+                result = func(samples)
+                seconds = time.perf_counter() - stage_started
+            stages[stage] = stage_result(items(result), seconds, samples, sampler)
+            logging.info(f"阶段{stage}: {stages[stage]}")
+            return result
+
+        # 转换：HEIC等格式转换为JPEG，在进程池中执行，无法统计单张耗时
+        if 'convert' in self.stages:
+            os.makedirs(os.path.join(run_dir, 'converted'), exist_ok=True)
+            images = measure('convert', lambda samples: processor.process_images(
+                images, os.path.join(run_dir, 'converted')))
+        if 'sort' in self.stages:
+            def sort(samples):
+                processor.get_image_timestamp = timed(processor.get_image_timestamp, samples)
+                return processor.sort_images_by_timestamp(images)
+            images = measure('sort', sort)
+            del processor.get_image_timestamp
+        if 'filter' in self.stages:
+            photo_filter = SlidePhotoFilter.from_config(config) or SlidePhotoFilter()
+
+            def run_filter(samples):
+                photo_filter.evaluate = timed(photo_filter.evaluate, samples)
+                return photo_filter.filter(images)[0]
+            total = len(images)
+            images = measure('filter', run_filter, items=lambda _: total)
+            stages['filter']['kept'] = len(images)
+        duplicate_of = {}
+        if 'dedup' in self.stages:
+            deduplicator = SlideDeduplicator.from_config(config) or SlideDeduplicator()
+
+            def run_dedup(samples):
+                deduplicator.analyze = timed(deduplicator.analyze, samples)
+                return deduplicator.find_duplicates(images, processor.get_image_timestamp)
+            duplicate_of = measure('dedup', run_dedup, items=lambda _: len(images))
+            stages['dedup']['duplicates'] = len(duplicate_of)
+        unique = [image for image in images if image not in duplicate_of]
+        # 编码：不做预处理时直接对原图做base64编码
+        if 'encode' in self.stages:
+            def encode(samples):
+                encode_one = timed(main_func.encode_image, samples)
+                return sum(len(encode_one(image, processor)) for image in unique)
+            total_chars = measure('encode', encode, items=lambda _: len(unique))
+            stages['encode']['payload_mb'] = round(total_chars / 1024 / 1024, 1)
+        payload_preparer = ImagePayloadPreparer.from_config(config, processor)
+        if 'payload' in self.stages and payload_preparer is not None:
+            def prepare(samples):
+                prepare_one = timed(payload_preparer.to_data_url, samples)
+                return sum(len(prepare_one(image)) for image in unique)
+            total_chars = measure('payload', prepare, items=lambda _: len(unique))
+            stages['payload']['payload_mb'] = round(total_chars / 1024 / 1024, 1)
+
+        def image_data_url(image):
+            if payload_preparer is None:
+                return f"data:image/jpeg;base64,{main_func.encode_image(image, processor)}"
+            return payload_preparer.to_data_url(image)
+
+        extractions = {}
+        llm_client = None
+        if 'extract' in self.stages or 'summarize' in self.stages:
+            llm_client = main_func.create_llm_client('local_llm')
+        if 'extract' in self.stages:
+            max_threads = llm_client.concurrency_ceiling('vlm')
+            LLMHttpClientPool.configure(max_connections=max_threads, max_keepalive_connections=max_threads)
+            tasks = [(idx + 1, image) for idx, image in enumerate(images) if image not in duplicate_of]
+            batcher = ImageBatcher.from_config(config, llm_client.service_types())
+
+            def extract(samples):
+                results = main_func.extract_images(llm_client, tasks, image_data_url, max_threads, batcher)
+                samples.extend(call['latency'] for call in metrics.calls if call['task'] == 'vlm' and call['success'])
+                return results
+            results = measure('extract', extract)
+            extractions = {idx - 1: result for idx, result in results}
+        if 'summarize' in self.stages:
+            segmenter = SessionSegmenter.from_config(config)
+
+            def summarize(samples):
+                sessions = segmenter.segment(images, processor.get_image_timestamp)
+                texts = extractions or {idx: f"第{idx + 1}张图片的内容" for idx, image in enumerate(images)
+                                        if image not in duplicate_of}
+                segments = segmenter.build_segments(sessions, texts)
+                summaries = main_func.summarize_segments(llm_client, segments)
+                samples.extend(call['latency'] for call in metrics.calls if call['task'] == 'llm' and call['success'])
+                return summaries
+            measure('summarize', summarize)
+
+        server_after = self.server.stats()
+        return {
+            'images': len(images),
+            'seconds': round(time.perf_counter() - started, 3),
+            'peak_rss_mb': round(max_rss_bytes() / 1024 / 1024, 1),
+            # 已结束的子进程（例如图片转换的进程池）中最大的峰值内存
+            'children_peak_rss_mb': round(max_rss_bytes(resource.RUSAGE_CHILDREN) / 1024 / 1024, 1),
+            'stages': stages,
+            'llm': metrics.summary(),
+            'mock_server': {key: server_after[key] - server_before.get(key, 0) for key in server_after
+                            if key != 'peak_in_flight'},
+        }
+
+
+def compare_results(baseline: dict, current: dict, tolerance: float = 0.1) -> list[str]:
+    """与基准结果比较，返回吞吐量下降、p95耗时或峰值内存上升超过tolerance比例的阶段"""
+    regressions = []
+    baseline_runs = {run['size']: run for run in baseline.get('corpora', [])}
+    for run in current.get('corpora', []):
+        base = baseline_runs.get(run['size'])
+        if base is None:
+            continue
+        for stage, result in run['stages'].items():
+            old = base['stages'].get(stage)
+            if old is None:
+                continue
+            checks = [('throughput', -1), ('latency_p95', 1), ('peak_rss_mb', 1)]
+            for key, direction in checks:
+                if not old.get(key) or result.get(key) is None:
+                    continue
+                change = (result[key] - old[key]) / old[key]
+                if change * direction > tolerance:
+                    regressions.append(f"{run['size']}张/{stage}/{key}: {old[key]} -> {result[key]} ({change:+.1%})")
+    return regressions
+
+
+def git_revision() -> Optional[str]:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description='在合成会议照片语料上运行端到端基准测试')
+    parser.add_argument('--sizes', default=','.join(str(size) for size in CORPUS_SIZES),
+                        help='语料规模，逗号分隔')
+    parser.add_argument('--stages', default=','.join(STAGES), help='运行的阶段，逗号分隔')
+    parser.add_argument('--corpus-dir', default='bench_corpus', help='合成语料目录，参数相同的语料会被复用')
+    parser.add_argument('--work-dir', default='bench_work', help='运行流水线的工作目录')
+    parser.add_argument('--output', default=None, help='结果JSON文件，默认为bench_results_<时间戳>.json')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--heic-ratio', type=float, default=0.2)
+    parser.add_argument('--duplicate-ratio', type=float, default=0.15)
+    parser.add_argument('--blur-ratio', type=float, default=0.08)
+    parser.add_argument('--scene-ratio', type=float, default=0.05)
+    parser.add_argument('--latency', default='lognormal:0.3,0.4', help='模拟服务的延迟分布')
+    parser.add_argument('--mock-config', help='模拟服务的JSON配置文件，键与MockLLMServer的参数一致')
+    parser.add_argument('--config', help='合并到流水线config.json中的JSON配置文件')
+    parser.add_argument('--compare', help='基准结果JSON文件，与之比较并报告性能回退')
+    parser.add_argument('--tolerance', type=float, default=0.1, help='判定回退的相对变化阈值')
+    args = parser.parse_args()
+
+    mock_settings = {'latency': args.latency, 'seed': args.seed}
+    if args.mock_config:
+        with open(args.mock_config, 'r', encoding='utf-8') as f:
+            mock_settings.update(json.load(f))
+    overrides = {}
+    if args.config:
+        with open(args.config, 'r', encoding='utf-8') as f:
+            overrides = json.load(f)
+    server = MockServerProcess(mock_settings).start()
+    benchmark = PipelineBenchmark(args.work_dir, server, overrides, stages=args.stages.split(','))
+    ratios = {'heic_ratio': args.heic_ratio, 'duplicate_ratio': args.duplicate_ratio,
+              'blur_ratio': args.blur_ratio, 'scene_ratio': args.scene_ratio}
+    results = {
+        'meta': {
+            'revision': git_revision(),
+            'timestamp': int(time.time()),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': cpu_count(),
+            'mock_server': mock_settings,
+            'config_overrides': overrides,
+            'corpus': {'seed': args.seed, **ratios},
+        },
+        'corpora': [],
+    }
+    try:
+        for size in (int(value) for value in args.sizes.split(',')):
+            images = generate_corpus(os.path.join(args.corpus_dir, str(size)), size, args.seed, **ratios)
+            run = benchmark.run(f"{size}_{results['meta']['timestamp']}", images)
+            results['corpora'].append({'size': size, **run})
+    finally:
+        server.stop()
+
+    output = args.output or f"bench_results_{results['meta']['timestamp']}.json"
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(results, f, ensure_ascii=False, indent=2)
+    print(f"基准测试结果已写入{output}")
+    for run in results['corpora']:
+        print(f"\n{run['size']}张照片，总耗时{run['seconds']}秒，峰值内存{run['peak_rss_mb']}MB")
+        for stage, result in run['stages'].items():
+            print(f"  {stage:<10} {result['throughput'] or '-':>10}张/秒  p50={result['latency_p50']}  "
+                  f"p95={result['latency_p95']}  峰值内存={result['peak_rss_mb']}MB")
+
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            regressions = compare_results(json.load(f), results, args.tolerance)
+        if regressions:
+            print("\n性能回退：\n" + '\n'.join(regressions))
+            sys.exit(1)
+        print("\n未发现超过阈值的性能回退")
+
+
+if __name__ == "__main__":
+    main()
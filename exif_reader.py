@@ -0,0 +1,224 @@
+import struct
+import logging
+from typing import Optional
+
+# 设置日志
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+# EXIF标签
+TAG_EXIF_IFD_POINTER = 0x8769
+TAG_DATETIME_ORIGINAL = 0x9003  # 36867
+
+# 读取元数据时的最大字节数，避免异常文件导致读取整幅图片
+MAX_METADATA_BYTES = 1024 * 1024
+
+
+class UnsupportedFormatError(ValueError):
+    """文件格式不是JPEG或HEIC，无法只读取元数据"""
+    pass
+
+
+def read_datetime_original(file_path: str) -> Optional[str]:
+    """只解析文件头中的元数据读取拍摄时间，不解码像素数据
+
+    支持JPEG（APP1段）和HEIC（meta盒中的Exif条目）。
+
+    Returns:
+        'YYYY:MM:DD HH:MM:SS'格式的拍摄时间，没有该字段时返回None
+
+    Raises:
+        UnsupportedFormatError: 文件既不是JPEG也不是HEIC
+    """
+    with open(file_path, 'rb') as f:
+        head = f.read(12)
+        if head[:2] == b'\xff\xd8':
+            tiff = _read_jpeg_exif(f)
+        elif head[4:8] == b'ftyp':
+            tiff = _read_heif_exif(f)
+        else:
+            raise UnsupportedFormatError(f"不支持只读取元数据的文件格式: {file_path}")
+    if not tiff:
+        return None
+    return _parse_datetime_original(tiff)
+
+
+def _read_jpeg_exif(f) -> Optional[bytes]:
+    """遍历JPEG标记段，返回APP1中的TIFF数据"""
+    f.seek(2)
+    while True:
+        marker = f.read(2)
+        if len(marker) < 2 or marker[0] != 0xFF:
+            return None
+        # 跳过填充字节
+        while marker[1] == 0xFF:
+            marker = marker[1:] + f.read(1)
+        # 到达图像数据或结束标记，说明没有EXIF
+        if marker[1] in (0xDA, 0xD9):
+            return None
+        length_bytes = f.read(2)
+        if len(length_bytes) < 2:
+            return None
+        length = struct.unpack('>H', length_bytes)[0] - 2
+        if marker[1] == 0xE1:
+            data = f.read(length)
+            if data[:6] == b'Exif\x00\x00':
+                return data[6:]
+        else:
+            f.seek(length, 1)
+
+
+def _iter_boxes(data: bytes, start: int = 0, end: int = None):
+    """遍历ISO BMFF盒结构，产出(类型, 内容起始位置, 内容结束位置)"""
+    end = len(data) if end is None else end
+    pos = start
+    while pos + 8 <= end:
+        size, box_type = struct.unpack('>I4s', data[pos:pos + 8])
+        header = 8
+        if size == 1:
+            size = struct.unpack('>Q', data[pos + 8:pos + 16])[0]
+            header = 16
+        elif size == 0:
+            size = end - pos
+        if size < header:
+            return
+        yield box_type, pos + header, min(pos + size, end)
+        pos += size
+
+
+def _read_uint(data: bytes, pos: int, size: int) -> tuple[int, int]:
+    """读取指定字节数的大端无符号整数，返回(数值, 新位置)"""
+    if size == 0:
+        return 0, pos
+    return int.from_bytes(data[pos:pos + size], 'big'), pos + size
+
+
+def _read_heif_exif(f) -> Optional[bytes]:
+    """解析HEIC的meta盒，根据iinf和iloc定位Exif条目并只读取该条目"""
+    f.seek(0)
+    # 顶层盒：找到meta盒，只读取盒头，跳过mdat等大块数据
+    meta = None
+    while meta is None:
+        header = f.read(8)
+        if len(header) < 8:
+            return None
+        size, box_type = struct.unpack('>I4s', header)
+        header_size = 8
+        if size == 1:
+            size = struct.unpack('>Q', f.read(8))[0]
+            header_size = 16
+        if box_type == b'meta':
+            if size - header_size > MAX_METADATA_BYTES:
+                return None
+            meta = f.read(size - header_size)
+        elif size == 0:
+            return None
+        else:
+            f.seek(size - header_size, 1)
+
+    # meta是FullBox，跳过version和flags
+    exif_item_id = None
+    locations = {}
+    for box_type, start, end in _iter_boxes(meta, 4):
+        if box_type == b'iinf':
+            version = meta[start]
+            pos = start + 4 + (2 if version == 0 else 4)
+            for child_type, child_start, child_end in _iter_boxes(meta, pos, end):
+                if child_type != b'infe':
+                    continue
+                infe_version = meta[child_start]
+                if infe_version < 2:
+                    continue
+                pos = child_start + 4
+                item_id, pos = _read_uint(meta, pos, 2 if infe_version == 2 else 4)
+                item_type = meta[pos + 2:pos + 6]
+                if item_type == b'Exif':
+                    exif_item_id = item_id
+        elif box_type == b'iloc':
+            locations = _parse_iloc(meta, start)
+    if exif_item_id is None or exif_item_id not in locations:
+        return None
+
+    offset, length = locations[exif_item_id]
+    if length > MAX_METADATA_BYTES:
+        return None
+    f.seek(offset)
+    data = f.read(length)
+    if len(data) < 4:
+        return None
+    # Exif条目以4字节的TIFF头偏移开头
+    tiff_offset = struct.unpack('>I', data[:4])[0]
+    return data[4 + tiff_offset:]
+
+
+def _parse_iloc(data: bytes, pos: int) -> dict[int, tuple[int, int]]:
+    """解析iloc盒，返回条目ID到(文件偏移, 长度)的映射，只处理单一区段且位于文件内的条目"""
+    version = data[pos]
+    pos += 4
+    offset_size = data[pos] >> 4
+    length_size = data[pos] & 0x0F
+    base_offset_size = data[pos + 1] >> 4
+    index_size = data[pos + 1] & 0x0F if version in (1, 2) else 0
+    pos += 2
+    item_count, pos = _read_uint(data, pos, 2 if version < 2 else 4)
+    locations = {}
+    for _ in range(item_count):
+        item_id, pos = _read_uint(data, pos, 2 if version < 2 else 4)
+        construction_method = 0
+        if version in (1, 2):
+            construction_method, pos = _read_uint(data, pos, 2)
+            construction_method &= 0x0F
+        pos += 2  # data_reference_index
+        base_offset, pos = _read_uint(data, pos, base_offset_size)
+        extent_count, pos = _read_uint(data, pos, 2)
+        extents = []
+        for _ in range(extent_count):
+            _, pos = _read_uint(data, pos, index_size)
+            extent_offset, pos = _read_uint(data, pos, offset_size)
+            extent_length, pos = _read_uint(data, pos, length_size)
+            extents.append((extent_offset, extent_length))
+        if construction_method == 0 and len(extents) == 1:
+            locations[item_id] = (base_offset + extents[0][0], extents[0][1])
+    return locations
+
+
+def _parse_datetime_original(tiff: bytes) -> Optional[str]:
+    """在TIFF结构的Exif子IFD中查找DateTimeOriginal"""
+    if len(tiff) < 8:
+        return None
+    if tiff[:2] == b'II':
+        endian = '<'
+    elif tiff[:2] == b'MM':
+        endian = '>'
+    else:
+        return None
+    ifd0 = struct.unpack(endian + 'I', tiff[4:8])[0]
+    exif_ifd = _find_tag(tiff, endian, ifd0, TAG_EXIF_IFD_POINTER)
+    if exif_ifd is None:
+        return None
+    exif_offset = struct.unpack(endian + 'I', exif_ifd[2])[0]
+    entry = _find_tag(tiff, endian, exif_offset, TAG_DATETIME_ORIGINAL)
+    if entry is None:
+        return None
+    _, count, value = entry
+    if count <= 4:
+        raw = value[:count]
+    else:
+        value_offset = struct.unpack(endian + 'I', value)[0]
+        raw = tiff[value_offset:value_offset + count]
+    text = raw.split(b'\x00', 1)[0].decode('ascii', errors='ignore').strip()
+    return text or None
+
+
+def _find_tag(tiff: bytes, endian: str, ifd_offset: int, tag: int) -> Optional[tuple[int, int, bytes]]:
+    """在IFD中查找标签，返回(类型, 数量, 4字节值或偏移)"""
+    if ifd_offset + 2 > len(tiff):
+        return None
+    count = struct.unpack(endian + 'H', tiff[ifd_offset:ifd_offset + 2])[0]
+    for i in range(count):
+        entry = ifd_offset + 2 + i * 12
+        if entry + 12 > len(tiff):
+            return None
+        entry_tag, entry_type, entry_count = struct.unpack(endian + 'HHI', tiff[entry:entry + 8])
+        if entry_tag == tag:
+            return entry_type, entry_count, tiff[entry + 8:entry + 12]
+    return None
@@ -9,13 +9,13 @@ import main_func
 from image_processor import ImageProcessor
 import logging
 import threading
+import multiprocessing
 import time
 from PIL import Image, ImageTk
-import shutil
 import json
 import datetime  # 添加导入以支持自动模式根据时间切换
 # 导入LLM客户端注册中心
-from llm_client import LLMClientRegistry
+from llm_client import LLMClientRegistry, LLMHttpClientPool
 # 导入HTML渲染组件
 from tkhtmlview import HTMLLabel
 
@@ -30,9 +30,6 @@ class ACPReportGenerator:
         self.root.geometry("1000x700")
         self.root.minsize(800, 600)
         
-        # 跟踪临时目录
-        self.temp_dirs = []
-        
         # 加载配置
         self.load_config()
         
@@ -209,6 +206,8 @@ class ACPReportGenerator:
         self.selected_paths = []
         self.report_content = ""
         self.html_content = ""
+        # 最终总结是否正在流式显示
+        self.report_streaming = False
         # 加载配置
         self.load_config()
         
@@ -225,7 +224,7 @@ class ACPReportGenerator:
         file_path = filedialog.askopenfilename(
             title="选择图片文件",
             filetypes=[
-                ("图片文件", "*.jpeg *.jpg *.png *.heic"),
+                ("图片文件", "*.jpeg *.jpg *.png *.heic *.heif *.webp *.tif *.tiff"),
                 ("所有文件", "*.*")
             ]
         )
@@ -259,62 +258,34 @@ class ACPReportGenerator:
             self.select_file_btn.config(state=tk.DISABLED)
             self.progress_var.set(0)
 
-            # 创建临时目录
-            import tempfile
-            temp_dir = tempfile.mkdtemp(prefix="acp_temp_")
-            # 跟踪临时目录
-            self.temp_dirs.append(temp_dir)
-            self.status_var.set(f"创建临时目录: {temp_dir}")
-
-            # 检查路径类型并处理
+            # 直接读取原始图片，非JPEG图片在发送前于内存中转换，不复制目录也不写入中间文件
+            self.status_var.set("正在查找图片...")
+            image_processor = ImageProcessor()
             if os.path.isdir(self.selected_paths[0]):
-                # 处理文件夹: 复制整个目录到临时目录
-                folder_path = self.selected_paths[0]
-                dest_path = os.path.join(temp_dir, os.path.basename(folder_path))
-                shutil.copytree(folder_path, dest_path)
-                self.status_var.set(f"已复制目录到临时位置: {dest_path}")
+                processed_files = [
+                    file_path for file_path in image_processor.scan_images(self.selected_paths[0])
+                    if image_processor.is_supported(file_path)
+                ]
             else:
-                # 处理单个文件: 创建目录并复制文件
-                file_path = self.selected_paths[0]
-                dest_dir = os.path.join(temp_dir, "single_file")
-                os.makedirs(dest_dir, exist_ok=True)
-                shutil.copy(file_path, dest_dir)
-                self.status_var.set(f"已复制文件到临时位置: {dest_dir}")
-
-            # 更新进度
-            self.progress_var.set(20)
-
-            # 使用图像处理器处理图片
-            self.status_var.set("正在处理图片...")
-            image_processor = ImageProcessor()
+                processed_files = [self.selected_paths[0]]
 
-            # 处理所有非JPEG文件
-            processed_files = []
-            for root, dirs, files in os.walk(temp_dir):
-                for file in files:
-                    file_path = os.path.join(root, file)
-                    # 处理图片
-                    processed_file = image_processor.process_image(file_path, root)
-                    if processed_file:
-                        processed_files.append(processed_file)
-
-            self.status_var.set(f"已处理 {len(processed_files)} 张图片")
+            self.status_var.set(f"找到 {len(processed_files)} 张图片")
             self.progress_var.set(50)
 
-            # 按照文件创建时间从远到近排序图片
+            # 按照拍摄时间从远到近排序图片
             self.status_var.set("正在排序图片...")
-            # 定义按创建时间排序的函数
-            def sort_by_creation_time(file_path):
-                return os.path.getctime(file_path)
-            
-            # 排序图片
-            sorted_images = sorted(processed_files, key=sort_by_creation_time)
+            sorted_images = image_processor.sort_images_by_timestamp(processed_files, reverse=False)
             self.status_var.set(f"已排序 {len(sorted_images)} 张图片")
             self.progress_var.set(70)
 
-            # 调用主函数处理
+            # 调用主函数处理，最终总结以流式方式显示在Markdown标签页中
             self.status_var.set("正在生成总结报告...")
-            main_func.main(images=sorted_images)
+            self.report_streaming = False
+            main_func.main(
+                images=sorted_images,
+                on_summary_delta=self.append_report_delta,
+                on_summary_reset=self.reset_report_stream,
+            )
 
             # 读取生成的总结报告
             # 查找最新生成的final_summary_custom_*报告文件
@@ -358,14 +329,25 @@ class ACPReportGenerator:
             self.root.after(0, lambda: self.process_btn.config(state=tk.NORMAL))
             self.root.after(0, lambda: self.select_folder_btn.config(state=tk.NORMAL))
             self.root.after(0, lambda: self.select_file_btn.config(state=tk.NORMAL))
-        finally:
-            # 清理当前临时目录
-            if 'temp_dir' in locals() and os.path.exists(temp_dir):
-                shutil.rmtree(temp_dir, ignore_errors=True)
-                # 从跟踪列表中移除
-                if temp_dir in self.temp_dirs:
-                    self.temp_dirs.remove(temp_dir)
     
+    def append_report_delta(self, delta):
+        """在处理线程中调用，把最终总结的增量追加到Markdown文本框"""
+        self.root.after(0, self._append_report_text, delta)
+
+    def reset_report_stream(self):
+        """在处理线程中调用，丢弃已显示的流式内容"""
+        self.root.after(0, lambda: self.report_text.delete(1.0, tk.END))
+
+    def _append_report_text(self, delta):
+        if not self.report_streaming:
+            # 收到第一段内容时清空旧报告并切换到Markdown标签页
+            self.report_streaming = True
+            self.report_text.delete(1.0, tk.END)
+            self.tab_control.select(self.raw_report_tab)
+            self.status_var.set("正在生成最终总结...")
+        self.report_text.insert(tk.END, delta)
+        self.report_text.see(tk.END)
+
     def update_report_display(self):
         """更新报告显示"""
         # 更新Markdown文本框
@@ -555,10 +537,8 @@ class ACPReportGenerator:
     
     def on_closing(self):
         """窗口关闭事件处理"""
-        # 清理所有临时目录
-        for temp_dir in self.temp_dirs:
-            if os.path.exists(temp_dir):
-                shutil.rmtree(temp_dir, ignore_errors=True)
+        # 释放LLM长连接
+        LLMHttpClientPool.close_all()
         # 关闭窗口
         self.root.destroy()
 
@@ -1186,4 +1166,6 @@ def main():
     root.mainloop()
 
 if __name__ == "__main__":
+    # 打包后的程序使用进程池转换图片时需要
+    multiprocessing.freeze_support()
     main()
\ No newline at end of file
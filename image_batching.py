@@ -0,0 +1,134 @@
+import re
+import logging
+import threading
+from typing import Optional
+
+from llm_ratelimit import estimate_image_tokens
+
+# 设置日志记录
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+# 各服务单次请求允许的图片数，未列出的服务按DEFAULT_MAX_IMAGES处理
+# vLLM等本地服务默认每个请求只接受1张图片，需要启动时设置--limit-mm-per-prompt后在配置中调大
+PROVIDER_MAX_IMAGES = {
+    'ark': 10,
+    'silicon_flow': 8,
+    'local_llm': 1,
+}
+DEFAULT_MAX_IMAGES = 4
+
+# 每张图片的提取结果以该标记开头，序号从1开始
+IMAGE_MARKER = '【图片{}】'
+IMAGE_MARKER_PATTERN = re.compile(r'【\s*图片\s*(\d+)\s*】')
+
+BATCH_EXTRACTION_PROMPT = (
+    "你是一个专业学者，以上依次给出了{count}张幻灯片照片，请分别从每张图片中找到slide内容，并且提取其中的信息。"
+    "按图片顺序逐张输出，每张图片的结果以单独一行的【图片k】开头（k为图片序号，从1到{count}），"
+    "共{count}段，不要合并或遗漏图片，无法识别的图片也要输出对应的标记并简要说明。"
+)
+
+
+class ImageBatcher:
+    """把多张相邻的幻灯片照片合并为一个多模态请求，分摊每次调用的提示词和请求开销
+
+    模型按图片序号分段输出，解析失败（段数不符、标记缺失或某段为空）时由调用方改为逐张请求。
+    """
+    def __init__(self, batch_size: int = 4, max_images: int = DEFAULT_MAX_IMAGES, max_image_tokens: int = 24000,
+                 patch_size: int = 28):
+        # 单次请求的图片数，不超过服务允许的上限
+        self.batch_size = max(1, min(batch_size, max_images))
+        # 单次请求中图片的估计token数上限，避免超出模型上下文
+        self.max_image_tokens = max_image_tokens
+        self.patch_size = patch_size
+        self._lock = threading.Lock()
+        self._stats = {'requests': 0, 'batched_images': 0, 'fallback_requests': 0, 'fallback_images': 0}
+
+    @classmethod
+    def from_config(cls, config: dict, services: list[str]) -> Optional['ImageBatcher']:
+        """根据配置文件中的vlm_batching项创建批处理器，未启用或服务每次只接受1张图片时返回None
+
+        vlm_batching项中的设置对全部服务生效，以服务类型为键的子项覆盖对应服务的设置，例如
+        {"vlm_batching": {"enabled": true, "batch_size": 4, "local_llm": {"max_images": 4}}}
+        组合客户端的请求可能发往其中任意一个服务，各项上限取全部服务中的最小值。
+
+        Args:
+            services: 客户端的service_types()，即各服务的类型而不是显示名称
+        """
+        batch_config = config.get('vlm_batching', {})
+        common = {key: value for key, value in batch_config.items() if not isinstance(value, dict)}
+        settings = [(service, {**common, **batch_config.get(service, {})}) for service in services]
+        if not all(service_settings.get('enabled', False) for _, service_settings in settings):
+            return None
+        batcher = cls(
+            batch_size=min(int(service_settings.get('batch_size', 4)) for _, service_settings in settings),
+            max_images=min(int(service_settings.get('max_images', PROVIDER_MAX_IMAGES.get(service, DEFAULT_MAX_IMAGES)))
+                           for service, service_settings in settings),
+            max_image_tokens=min(int(service_settings.get('max_image_tokens', 24000))
+                                 for _, service_settings in settings),
+            patch_size=int(settings[0][1].get('image_patch_size', 28)),
+        )
+        if batcher.batch_size < 2:
+            logging.info(f"{'+'.join(services)}每次请求只接受1张图片，不合并图片请求")
+            return None
+        return batcher
+
+    def group(self, tasks: list[tuple[int, str]]) -> list[list[tuple[int, str]]]:
+        """把按顺序排列的(图片索引, 图片路径)列表按batch_size切分为相邻图片组"""
+        return [tasks[i:i + self.batch_size] for i in range(0, len(tasks), self.batch_size)]
+
+    def split(self, image_urls: list[str]) -> list[list[int]]:
+        """按估计的图片token数把一组图片继续拆分，返回每个请求包含的图片下标"""
+        batches = []
+        current, tokens = [], 0
+        for i, url in enumerate(image_urls):
+            image_tokens = estimate_image_tokens(url, self.patch_size)
+            if current and tokens + image_tokens > self.max_image_tokens:
+                batches.append(current)
+                current, tokens = [], 0
+            current.append(i)
+            tokens += image_tokens
+        if current:
+            batches.append(current)
+        return batches
+
+    @staticmethod
+    def build_message(image_urls: list[str]) -> list[dict]:
+        """构造多张图片的内容提取请求，每张图片前加上序号标记"""
+        content = []
+        for i, url in enumerate(image_urls):
+            content.append({"type": "text", "text": IMAGE_MARKER.format(i + 1)})
+            content.append({"type": "image_url", "image_url": {"url": url}})
+        content.append({"type": "text", "text": BATCH_EXTRACTION_PROMPT.format(count=len(image_urls))})
+        return [{"role": "user", "content": content}]
+
+    @staticmethod
+    def parse(response: str, count: int) -> Optional[list[str]]:
+        """按序号标记拆分模型输出，返回每张图片的提取结果，无法可靠拆分时返回None"""
+        text = response.split('</think>')[-1]
+        matches = list(IMAGE_MARKER_PATTERN.finditer(text))
+        if [int(match.group(1)) for match in matches] != list(range(1, count + 1)):
+            return None
+        parts = []
+        for match, following in zip(matches, matches[1:] + [None]):
+            end = following.start() if following is not None else len(text)
+            part = text[match.end():end].strip()
+            if not part:
+                return None
+            parts.append(part)
+        return parts
+
+    def record(self, images: int, fallback: bool):
+        """记录一次合并请求，fallback为True表示解析失败后改为逐张请求"""
+        with self._lock:
+            self._stats['requests'] += 1
+            self._stats['batched_images'] += images
+            if fallback:
+                self._stats['fallback_requests'] += 1
+                self._stats['fallback_images'] += images
+
+    def stats(self) -> dict:
+        with self._lock:
+            return dict(self._stats)
+
+    def log_stats(self):
+        logging.info(f"VLM合并请求情况: {self.stats()}")
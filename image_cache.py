@@ -0,0 +1,168 @@
+import os
+import shutil
+import hashlib
+import logging
+import threading
+from typing import Optional
+
+# 设置日志
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+# 默认缓存目录和容量上限
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.acp_summary_tool', 'image_cache')
+DEFAULT_MAX_BYTES = 2 * 1024 * 1024 * 1024  # 2GB
+
+
+def file_digest(file_path: str, chunk_size: int = 1024 * 1024) -> str:
+    """计算文件内容的SHA-256摘要"""
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class ConvertedImageCache:
+    """基于内容寻址的转换结果磁盘缓存，按字节容量上限进行LRU淘汰
+
+    缓存键由源文件内容摘要和转换器设置共同决定，缓存文件的修改时间记录最近一次使用时间，
+    因此LRU顺序在多次运行之间保持有效。
+    """
+    def __init__(self, cache_dir: str = DEFAULT_CACHE_DIR, max_bytes: int = DEFAULT_MAX_BYTES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        # 缓存键到缓存文件路径的索引
+        self._entries = {}
+        # 源文件摘要的内存缓存，键为(路径, 大小, 修改时间)
+        self._digests = {}
+        # 本次运行中已返回给调用方的缓存文件，淘汰时跳过，避免返回的路径失效
+        self._in_use = set()
+        os.makedirs(cache_dir, exist_ok=True)
+        for entry in os.scandir(cache_dir):
+            if entry.is_file() and not entry.name.startswith('.'):
+                self._entries[os.path.splitext(entry.name)[0]] = entry.path
+
+    @classmethod
+    def from_config(cls, config: dict) -> Optional['ConvertedImageCache']:
+        """根据配置文件中的image_cache项创建缓存，未启用时返回None"""
+        cache_config = config.get('image_cache', {})
+        if not cache_config.get('enabled', True):
+            return None
+        cache_dir = cache_config.get('dir', DEFAULT_CACHE_DIR)
+        max_bytes = int(cache_config.get('max_mb', DEFAULT_MAX_BYTES // (1024 * 1024))) * 1024 * 1024
+        try:
+            return cls(cache_dir, max_bytes)
+        except OSError as e:
+            logging.error(f"创建图片缓存目录{cache_dir}失败: {e}")
+            return None
+
+    def make_key(self, file_path: str, converter) -> str:
+        """根据源文件内容和转换器设置生成缓存键"""
+        stat = os.stat(file_path)
+        stat_key = (os.path.abspath(file_path), stat.st_size, stat.st_mtime_ns)
+        with self._lock:
+            digest = self._digests.get(stat_key)
+        if digest is None:
+            # 在锁外计算摘要，不阻塞其他线程的缓存查询
+            digest = file_digest(file_path)
+            with self._lock:
+                self._digests[stat_key] = digest
+        settings = sorted((k, repr(v)) for k, v in vars(converter).items() if not k.startswith('_'))
+        fingerprint = f"{type(converter).__module__}.{type(converter).__qualname__}:{settings}"
+        return hashlib.sha256(f"{digest}|{fingerprint}".encode('utf-8')).hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        """查找缓存，命中时刷新其使用时间并返回缓存文件路径"""
+        with self._lock:
+            path = self._entries.get(key)
+            if path is None:
+                return None
+            if not os.path.exists(path):
+                del self._entries[key]
+                return None
+            try:
+                os.utime(path)
+            except OSError:
+                pass
+            self._in_use.add(path)
+            return path
+
+    def put(self, key: str, file_path: str) -> str:
+        """将转换结果存入缓存，返回缓存文件路径"""
+        ext = os.path.splitext(file_path)[1]
+        cache_path = os.path.join(self.cache_dir, f"{key}{ext}")
+        tmp_path = f"{cache_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            shutil.copyfile(file_path, tmp_path)
+            os.replace(tmp_path, cache_path)
+        except OSError as e:
+            logging.error(f"写入图片缓存{cache_path}失败: {e}")
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            return file_path
+        with self._lock:
+            self._entries[key] = cache_path
+            self._in_use.add(cache_path)
+        self.evict()
+        return cache_path
+
+    def put_bytes(self, key: str, data: bytes, ext: str) -> str:
+        """将内存中的编码结果存入缓存，返回缓存文件路径"""
+        cache_path = os.path.join(self.cache_dir, f"{key}{ext}")
+        tmp_path = f"{cache_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp_path, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, cache_path)
+        except OSError as e:
+            logging.error(f"写入缓存{cache_path}失败: {e}")
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            return None
+        with self._lock:
+            self._entries[key] = cache_path
+            self._in_use.add(cache_path)
+        self.evict()
+        return cache_path
+
+    def size(self) -> int:
+        """当前缓存占用的字节数"""
+        total = 0
+        for path in list(self._entries.values()):
+            try:
+                total += os.path.getsize(path)
+            except OSError:
+                pass
+        return total
+
+    def evict(self):
+        """按最近使用时间从旧到新淘汰缓存，直到占用不超过容量上限"""
+        with self._lock:
+            entries = []
+            total = 0
+            for key, path in self._entries.items():
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, key, path))
+                total += stat.st_size
+            if total <= self.max_bytes:
+                return
+            entries.sort()
+            for _, size, key, path in entries:
+                if total <= self.max_bytes:
+                    break
+                if path in self._in_use:
+                    continue
+                try:
+                    os.remove(path)
+                except OSError as e:
+                    logging.error(f"淘汰图片缓存{path}失败: {e}")
+                    continue
+                del self._entries[key]
+                total -= size
+                logging.info(f"已淘汰图片缓存: {path}")
+            if total > self.max_bytes:
+                logging.warning(f"图片缓存占用{total}字节，本次运行使用中的缓存无法淘汰，超出上限{self.max_bytes}字节")
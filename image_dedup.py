@@ -0,0 +1,169 @@
+import math
+import time
+import logging
+import concurrent.futures
+from typing import Callable, Optional
+
+import numpy as np
+from PIL import Image, ImageOps
+import pillow_heif
+
+# 注册HEIC打开器
+pillow_heif.register_heif_opener()
+
+# 设置日志
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+def load_gray_thumbnail(image_path: str, max_edge: int = 256) -> Image.Image:
+    """以灰度模式加载缩小后的图片，JPEG可利用draft模式跳过全尺寸解码"""
+    with Image.open(image_path) as image:
+        image.draft('L', (max_edge, max_edge))
+        image = ImageOps.exif_transpose(image)
+        image = image.convert('L')
+        image.thumbnail((max_edge, max_edge))
+        return image.copy()
+
+
+def dhash(image: Image.Image, hash_size: int = 8) -> int:
+    """计算差异哈希(dHash)：比较相邻像素的亮度梯度"""
+    pixels = list(image.resize((hash_size + 1, hash_size), Image.LANCZOS).getdata())
+    value = 0
+    for row in range(hash_size):
+        for col in range(hash_size):
+            left = pixels[row * (hash_size + 1) + col]
+            right = pixels[row * (hash_size + 1) + col + 1]
+            value = (value << 1) | int(left > right)
+    return value
+
+
+def _dct_1d(values: list[float]) -> list[float]:
+    """一维DCT-II变换"""
+    n = len(values)
+    return [
+        sum(values[x] * math.cos(math.pi * (2 * x + 1) * u / (2 * n)) for x in range(n))
+        for u in range(n)
+    ]
+
+
+def phash(image: Image.Image, hash_size: int = 8, highfreq_factor: int = 4) -> int:
+    """计算感知哈希(pHash)：取低频DCT系数与其中位数比较"""
+    size = hash_size * highfreq_factor
+    pixels = list(image.resize((size, size), Image.LANCZOS).getdata())
+    rows = [_dct_1d([float(p) for p in pixels[r * size:(r + 1) * size]]) for r in range(size)]
+    # 只需要左上角低频部分的列变换
+    cols = [_dct_1d([rows[r][c] for r in range(size)])[:hash_size] for c in range(hash_size)]
+    low_freq = [cols[c][r] for r in range(hash_size) for c in range(hash_size)]
+    median = sorted(low_freq)[len(low_freq) // 2]
+    value = 0
+    for coefficient in low_freq:
+        value = (value << 1) | int(coefficient > median)
+    return value
+
+
+def hamming_distance(a: int, b: int) -> int:
+    """两个哈希值之间的汉明距离"""
+    return bin(a ^ b).count('1')
+
+
+def laplacian_variance(pixels: np.ndarray) -> float:
+    """计算拉普拉斯响应的方差，数值越大越清晰，照片过滤和去重使用同一清晰度指标"""
+    laplacian = (pixels[1:-1, :-2] + pixels[1:-1, 2:] + pixels[:-2, 1:-1] + pixels[2:, 1:-1]
+                 - 4 * pixels[1:-1, 1:-1])
+    return float(laplacian.var())
+
+
+def parse_timestamp(timestamp: str) -> Optional[float]:
+    """将'YYYY:MM:DD HH:MM:SS'格式的拍摄时间转换为时间戳，失败时返回None"""
+    try:
+        return time.mktime(time.strptime(timestamp.strip(), '%Y:%m:%d %H:%M:%S'))
+    except (ValueError, AttributeError):
+        return None
+
+
+HASH_FUNCTIONS = {
+    'dhash': dhash,
+    'phash': phash,
+}
+
+
+class SlideDeduplicator:
+    """近重复幻灯片去重：同一张幻灯片被连拍多次时，只保留最清晰的一张送入VLM"""
+    def __init__(self, max_distance: int = 6, time_window: float = 120, hash_method: str = 'dhash',
+                 max_workers: int = 8):
+        if hash_method not in HASH_FUNCTIONS:
+            raise ValueError(f"不支持的哈希算法: {hash_method}")
+        # 汉明距离不超过max_distance的两张图片视为同一张幻灯片
+        self.max_distance = max_distance
+        # 一组图片从第一张起的拍摄时间跨度不超过time_window秒
+        self.time_window = time_window
+        self.hash_method = hash_method
+        self.max_workers = max_workers
+
+    @classmethod
+    def from_config(cls, config: dict) -> Optional['SlideDeduplicator']:
+        """根据配置文件中的dedup项创建去重器，未启用时返回None
+
+        去重会把图片从总结中移除，阈值需要针对实际的拍摄情况验证，因此默认不启用，例如
+        {"dedup": {"enabled": true, "max_distance": 6, "time_window": 120}}
+        """
+        dedup_config = config.get('dedup', {})
+        if not dedup_config.get('enabled', False):
+            return None
+        return cls(
+            max_distance=int(dedup_config.get('max_distance', 6)),
+            time_window=float(dedup_config.get('time_window', 120)),
+            hash_method=dedup_config.get('hash_method', 'dhash'),
+        )
+
+    def analyze(self, image_path: str) -> tuple[Optional[int], float]:
+        """计算单张图片的(感知哈希, 清晰度)，读取失败时哈希为None"""
+        try:
+            image = load_gray_thumbnail(image_path)
+            return HASH_FUNCTIONS[self.hash_method](image), laplacian_variance(np.asarray(image, dtype=np.float32))
+        except Exception as e:
+            logging.error(f"计算图片{image_path}感知哈希失败: {e}")
+            return None, 0.0
+
+    def find_duplicates(self, image_paths: list[str],
+                        timestamp_func: Callable[[str], str] = None) -> dict[str, str]:
+        """在按时间排序的图片列表中查找近重复图片
+
+        Args:
+            image_paths: 按拍摄时间排序的图片路径列表
+            timestamp_func: 返回图片拍摄时间字符串的函数，为None时不限制时间窗口
+
+        Returns:
+            被跳过的图片到其代表图片的映射，代表图片是每组中最清晰的一张
+        """
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            features = list(executor.map(self.analyze, image_paths))
+        timestamps = [parse_timestamp(timestamp_func(path)) if timestamp_func else None for path in image_paths]
+
+        # 相邻的近重复图片归为一组，新图片只与组内第一张比较，避免A≈B≈C时把不同的A和C连在一起
+        groups = []
+        for idx, (hash_value, _) in enumerate(features):
+            group = groups[-1] if groups else None
+            if group is not None and hash_value is not None and self._matches(group, idx, features, timestamps):
+                group.append(idx)
+            else:
+                groups.append([idx])
+
+        duplicate_of = {}
+        for group in groups:
+            if len(group) < 2:
+                continue
+            representative = max(group, key=lambda i: features[i][1])
+            for idx in group:
+                if idx != representative:
+                    duplicate_of[image_paths[idx]] = image_paths[representative]
+        logging.info(f"去重: {len(image_paths)}张图片中有{len(duplicate_of)}张为近重复图片")
+        return duplicate_of
+
+    def _matches(self, group: list[int], idx: int, features: list, timestamps: list) -> bool:
+        """判断图片是否与组内第一张图片为同一张幻灯片，且加入后组的时间跨度不超过时间窗口"""
+        first = group[0]
+        if timestamps[idx] is not None and timestamps[first] is not None:
+            if abs(timestamps[idx] - timestamps[first]) > self.time_window:
+                return False
+        anchor = features[first][0]
+        return anchor is not None and hamming_distance(anchor, features[idx][0]) <= self.max_distance
@@ -0,0 +1,125 @@
+import json
+import logging
+import concurrent.futures
+from typing import Optional
+
+import numpy as np
+
+from image_dedup import load_gray_thumbnail, laplacian_variance
+
+# 设置日志
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+# 过滤模式：drop直接丢弃不合格图片，flag只在报告中标记
+FILTER_MODES = ('drop', 'flag')
+
+
+def slide_score(pixels: np.ndarray, edge_threshold: float = 30.0) -> float:
+    """估计图片是投影幻灯片的可能性，取值0到1
+
+    幻灯片有大面积平坦的背景，且文字和版式边缘以水平、竖直方向为主；
+    人像、海报和食物照片纹理丰富、边缘方向分散。
+    """
+    # 背景平坦度：亮度直方图中最集中的三个相邻区间占全部像素的比例
+    histogram, _ = np.histogram(pixels, bins=32, range=(0, 256))
+    window = np.convolve(histogram, np.ones(3), mode='same')
+    flat_fraction = float(window.max() / pixels.size)
+
+    # 边缘方向：强边缘中接近水平或竖直方向的比例
+    gx = pixels[1:-1, 2:] - pixels[1:-1, :-2]
+    gy = pixels[2:, 1:-1] - pixels[:-2, 1:-1]
+    magnitude = np.hypot(gx, gy)
+    strong = magnitude > edge_threshold
+    if not strong.any():
+        return flat_fraction * 0.5
+    ax, ay = np.abs(gx[strong]), np.abs(gy[strong])
+    # tan(22.5°)≈0.414，梯度方向与坐标轴夹角小于22.5°视为轴向边缘
+    axis_aligned = float(np.mean((np.minimum(ax, ay) / np.maximum(ax, ay)) < 0.414))
+    return 0.5 * flat_fraction + 0.5 * axis_aligned
+
+
+class SlidePhotoFilter:
+    """本地预过滤：在送入VLM前识别模糊照片和非幻灯片照片"""
+    def __init__(self, blur_threshold: float = 50.0, slide_threshold: float = 0.45,
+                 mode: str = 'drop', max_edge: int = 512, max_workers: int = 8):
+        if mode not in FILTER_MODES:
+            raise ValueError(f"不支持的过滤模式: {mode}")
+        # 拉普拉斯方差低于blur_threshold的图片视为模糊
+        self.blur_threshold = blur_threshold
+        # 幻灯片得分低于slide_threshold的图片视为非幻灯片
+        self.slide_threshold = slide_threshold
+        self.mode = mode
+        self.max_edge = max_edge
+        self.max_workers = max_workers
+
+    @classmethod
+    def from_config(cls, config: dict) -> Optional['SlidePhotoFilter']:
+        """根据配置文件中的photo_filter项创建过滤器，未启用时返回None
+
+        模糊和幻灯片得分的阈值是经验值，drop模式会直接丢弃图片，因此默认不启用，例如
+        {"photo_filter": {"enabled": true, "mode": "flag", "blur_threshold": 50}}
+        """
+        filter_config = config.get('photo_filter', {})
+        if not filter_config.get('enabled', False):
+            return None
+        return cls(
+            blur_threshold=float(filter_config.get('blur_threshold', 50.0)),
+            slide_threshold=float(filter_config.get('slide_threshold', 0.45)),
+            mode=filter_config.get('mode', 'drop'),
+        )
+
+    def evaluate(self, image_path: str) -> dict:
+        """评估单张图片，返回包含得分和判定结果的记录"""
+        record = {'image': image_path, 'sharpness': None, 'slide_score': None, 'passed': True, 'reasons': []}
+        try:
+            pixels = np.asarray(load_gray_thumbnail(image_path, self.max_edge), dtype=np.float32)
+        except Exception as e:
+            # 读取失败的图片交给后续流程处理
+            logging.error(f"评估图片{image_path}失败: {e}")
+            record['reasons'].append(f"读取失败: {e}")
+            return record
+        record['sharpness'] = round(laplacian_variance(pixels), 2)
+        record['slide_score'] = round(slide_score(pixels), 3)
+        if record['sharpness'] < self.blur_threshold:
+            record['reasons'].append('blurry')
+        if record['slide_score'] < self.slide_threshold:
+            record['reasons'].append('not_slide')
+        record['passed'] = not (record['sharpness'] < self.blur_threshold
+                                or record['slide_score'] < self.slide_threshold)
+        return record
+
+    def filter(self, image_paths: list[str]) -> tuple[list[str], list[dict]]:
+        """过滤图片列表
+
+        Returns:
+            (保留的图片列表, 每张图片的判定记录)，flag模式下保留全部图片
+        """
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            records = list(executor.map(self.evaluate, image_paths))
+        if self.mode == 'drop':
+            kept = [record['image'] for record in records if record['passed']]
+        else:
+            kept = list(image_paths)
+        rejected = [record for record in records if not record['passed']]
+        action = '丢弃' if self.mode == 'drop' else '标记'
+        logging.info(f"预过滤: {len(image_paths)}张图片中{action}了{len(rejected)}张模糊或非幻灯片图片")
+        for record in rejected:
+            logging.info(f"预过滤{action}: {record['image']}（{', '.join(record['reasons'])}，"
+                         f"清晰度{record['sharpness']}，幻灯片得分{record['slide_score']}）")
+        return kept, records
+
+    def write_report(self, records: list[dict], report_file: str):
+        """将本次运行的过滤判定写入JSON报告"""
+        report = {
+            'mode': self.mode,
+            'blur_threshold': self.blur_threshold,
+            'slide_threshold': self.slide_threshold,
+            'total': len(records),
+            'rejected': sum(1 for record in records if not record['passed']),
+            'images': records,
+        }
+        try:
+            with open(report_file, 'w', encoding='utf-8') as f:
+                json.dump(report, f, ensure_ascii=False, indent=2)
+        except OSError as e:
+            logging.error(f"写入过滤报告{report_file}失败: {e}")
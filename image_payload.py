@@ -0,0 +1,162 @@
+import io
+import os
+import base64
+import logging
+import threading
+from typing import Optional
+
+from PIL import Image, ImageOps
+import pillow_heif
+
+from image_cache import ConvertedImageCache, DEFAULT_CACHE_DIR
+
+# 注册HEIC打开器
+pillow_heif.register_heif_opener()
+
+# 设置日志
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+# 支持的输出格式及对应的MIME类型和扩展名
+PAYLOAD_FORMATS = {
+    'JPEG': ('image/jpeg', '.jpeg'),
+    'WEBP': ('image/webp', '.webp'),
+}
+
+# 可以不经预处理直接发送的原图格式
+ORIGINAL_MIME_TYPES = {
+    '.jpeg': 'image/jpeg',
+    '.jpg': 'image/jpeg',
+    '.png': 'image/png',
+    '.webp': 'image/webp',
+}
+
+# 预处理结果的默认缓存目录
+DEFAULT_PAYLOAD_CACHE_DIR = os.path.join(os.path.dirname(DEFAULT_CACHE_DIR), 'payload_cache')
+
+
+class ImagePayloadPreparer:
+    """VLM请求负载预处理器：在base64编码前缩放并重新压缩图片
+
+    幻灯片在1600像素的长边下已足够清晰，发送手机原图只会增加上传时间和服务端延迟。
+    预处理结果按源文件内容和预处理设置缓存，重复运行时直接读取。
+    传入图像处理器时，HEIC等无法直接发送的格式通过其转换器在内存中解码，与未启用预处理时的路径一致。
+    """
+    def __init__(self, max_edge: int = 1600, quality: int = 85, fmt: str = 'JPEG',
+                 cache: ConvertedImageCache = None, image_processor=None):
+        fmt = fmt.upper()
+        if fmt not in PAYLOAD_FORMATS:
+            raise ValueError(f"不支持的负载格式: {fmt}")
+        self.max_edge = max_edge
+        self.quality = quality
+        self.fmt = fmt
+        self._cache = cache
+        self._image_processor = image_processor
+        self._lock = threading.Lock()
+        # 本次运行的统计信息
+        self._stats = {'images': 0, 'cache_hits': 0, 'original_bytes': 0, 'payload_bytes': 0}
+
+    @classmethod
+    def from_config(cls, config: dict, image_processor=None) -> Optional['ImagePayloadPreparer']:
+        """根据配置文件中的vlm_payload项创建预处理器，未启用时返回None"""
+        payload_config = config.get('vlm_payload', {})
+        if not payload_config.get('enabled', True):
+            return None
+        cache = None
+        if payload_config.get('cache', True):
+            cache = ConvertedImageCache.from_config(
+                {'image_cache': {'dir': payload_config.get('cache_dir', DEFAULT_PAYLOAD_CACHE_DIR),
+                                 'max_mb': payload_config.get('cache_max_mb', 512)}})
+        return cls(
+            max_edge=int(payload_config.get('max_edge', 1600)),
+            quality=int(payload_config.get('quality', 85)),
+            fmt=payload_config.get('format', 'JPEG'),
+            cache=cache,
+            image_processor=image_processor,
+        )
+
+    @property
+    def mime_type(self) -> str:
+        return PAYLOAD_FORMATS[self.fmt][0]
+
+    def encode(self, image: Image.Image) -> bytes:
+        """将已解码的图片缩放并编码为负载字节"""
+        # 手机照片的方向信息保存在EXIF中，缩放后EXIF会丢失，需要先应用方向
+        image = ImageOps.exif_transpose(image)
+        if max(image.size) > self.max_edge:
+            image.thumbnail((self.max_edge, self.max_edge), Image.LANCZOS)
+        if image.mode not in ('RGB', 'L'):
+            image = image.convert('RGB')
+        buffer = io.BytesIO()
+        image.save(buffer, self.fmt, quality=self.quality)
+        return buffer.getvalue()
+
+    def open_image(self, image_path: str) -> Image.Image:
+        """打开源图片，无法直接发送的格式由图像处理器在内存中转换后解码"""
+        if self._image_processor is None or os.path.splitext(image_path)[1].lower() in ORIGINAL_MIME_TYPES:
+            return Image.open(image_path)
+        data = self._image_processor.load_image_bytes(image_path)
+        if data is None:
+            raise ValueError(f"无法读取图片: {image_path}")
+        return Image.open(io.BytesIO(data))
+
+    def prepare(self, image_path: str) -> tuple[str, bytes]:
+        """预处理单张图片，返回(MIME类型, 负载字节)"""
+        original_bytes = os.path.getsize(image_path)
+        cache_key = None
+        data = None
+        cache_hit = False
+        mime_type = self.mime_type
+        if self._cache is not None:
+            cache_key = self._cache.make_key(image_path, self)
+            cached_path = self._cache.get(cache_key)
+            if cached_path:
+                with open(cached_path, 'rb') as f:
+                    data = f.read()
+                mime_type = ORIGINAL_MIME_TYPES.get(os.path.splitext(cached_path)[1], mime_type)
+                cache_hit = True
+        if data is None:
+            with self.open_image(image_path) as image:
+                data = self.encode(image)
+            ext = PAYLOAD_FORMATS[self.fmt][1]
+            # 原图本身已足够小时（例如截图或已压缩的图片），重新编码反而更大，直接发送原图
+            original_ext = os.path.splitext(image_path)[1].lower()
+            if original_ext in ORIGINAL_MIME_TYPES and original_bytes <= len(data):
+                with open(image_path, 'rb') as f:
+                    data = f.read()
+                mime_type = ORIGINAL_MIME_TYPES[original_ext]
+                ext = original_ext
+            if cache_key:
+                self._cache.put_bytes(cache_key, data, ext)
+        self._record(original_bytes, len(data), cache_hit)
+        return mime_type, data
+
+    def to_data_url(self, image_path: str) -> str:
+        """预处理图片并返回可直接放入image_url的data URL"""
+        mime_type, data = self.prepare(image_path)
+        return f"data:{mime_type};base64,{base64.b64encode(data).decode('utf-8')}"
+
+    def _record(self, original_bytes: int, payload_bytes: int, cache_hit: bool):
+        with self._lock:
+            self._stats['images'] += 1
+            self._stats['cache_hits'] += int(cache_hit)
+            self._stats['original_bytes'] += original_bytes
+            self._stats['payload_bytes'] += payload_bytes
+
+    def stats(self) -> dict:
+        """返回本次运行的统计信息，包括节省的字节数"""
+        with self._lock:
+            stats = dict(self._stats)
+        stats['saved_bytes'] = stats['original_bytes'] - stats['payload_bytes']
+        return stats
+
+    def log_stats(self):
+        """输出本次运行的负载统计"""
+        stats = self.stats()
+        if not stats['images']:
+            return
+        ratio = stats['payload_bytes'] / stats['original_bytes'] if stats['original_bytes'] else 1.0
+        logging.info(
+            f"负载预处理: {stats['images']}张图片（缓存命中{stats['cache_hits']}张），"
+            f"原始{stats['original_bytes'] / 1024 / 1024:.1f}MB -> 负载{stats['payload_bytes'] / 1024 / 1024:.1f}MB，"
+            f"节省{stats['saved_bytes'] / 1024 / 1024:.1f}MB（{(1 - ratio) * 100:.0f}%）"
+        )
@@ -1,142 +1,488 @@
 import os
+import io
 import logging
+import tempfile
 import time
+import threading
+import concurrent.futures
 from abc import ABC, abstractmethod
+from collections import deque
+from typing import Callable, Iterable, Iterator, Optional
 from PIL import Image
 import pillow_heif
 
+from image_cache import ConvertedImageCache
+from exif_reader import read_datetime_original, UnsupportedFormatError
+
 # 注册HEIC打开器
 pillow_heif.register_heif_opener()
 
 # 设置日志
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
+# 图片扩展名注册表，扫描目录时只返回这些扩展名的文件
+# 注册转换器时会自动加入转换器声明的扩展名
+IMAGE_EXTENSIONS = {'.jpeg', '.jpg', '.png'}
+# 大模型可以直接读取、无需转换的图片格式
+PASSTHROUGH_EXTENSIONS = ('.jpeg', '.jpg', '.png')
+
+
+def register_image_extension(extension: str):
+    """注册新的图片扩展名，使扫描目录时包含该类型的文件"""
+    IMAGE_EXTENSIONS.add(extension.lower() if extension.startswith('.') else f".{extension.lower()}")
+
+
+def scan_images(input_dir: str, recursive: bool = True, extensions: Iterable[str] = None,
+                accept: Callable[[str], bool] = None) -> Iterator[str]:
+    """使用os.scandir流式扫描目录下的图片，边扫描边产出文件路径
+
+    Args:
+        input_dir: 要扫描的目录
+        recursive: 是否递归扫描子目录
+        extensions: 要包含的扩展名，默认使用IMAGE_EXTENSIONS注册表
+        accept: 扩展名不在注册表中时调用，返回True的文件也会产出，例如未声明扩展名的转换器可以处理的文件
+
+    Yields:
+        图片文件路径
+    """
+    extensions = IMAGE_EXTENSIONS if extensions is None else {ext.lower() for ext in extensions}
+    pending_dirs = [input_dir]
+    while pending_dirs:
+        current_dir = pending_dirs.pop()
+        try:
+            entries = os.scandir(current_dir)
+        except OSError as e:
+            logging.error(f"扫描目录{current_dir}失败: {e}")
+            continue
+        subdirs = []
+        with entries:
+            for entry in entries:
+                # 跳过隐藏文件，例如macOS生成的._元数据文件
+                if entry.name.startswith('.'):
+                    continue
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        if recursive:
+                            subdirs.append(entry.path)
+                    elif entry.is_file() and (os.path.splitext(entry.name)[1].lower() in extensions
+                                              or (accept is not None and accept(entry.path))):
+                        yield entry.path
+                except OSError as e:
+                    logging.error(f"读取{entry.path}失败: {e}")
+        # 逆序入栈，使子目录按扫描顺序处理
+        pending_dirs.extend(reversed(subdirs))
+
 
 class ImageConverter(ABC):
     """图片转换器抽象基类，定义插件接口"""
-    @abstractmethod
+    # 转换器可处理的扩展名，用于按扩展名直接分派；为空时退回到逐个调用can_convert
+    extensions: tuple[str, ...] = ()
+
     def can_convert(self, file_path: str) -> bool:
         """检查文件是否可以被当前转换器处理"""
-        pass
+        return os.path.splitext(file_path)[1].lower() in self.extensions
 
     @abstractmethod
     def convert(self, file_path: str, output_dir: str) -> str:
         """转换图片并返回转换后的文件路径"""
         pass
 
+    def convert_many(self, file_paths: list[str], output_dir: str) -> list[Optional[str]]:
+        """批量转换图片，返回与输入一一对应的转换结果路径
 
-class HEICToJPEGConverter(ImageConverter):
-    """HEIC到JPEG格式的转换器"""
-    def can_convert(self, file_path: str) -> bool:
-        return file_path.lower().endswith('.heic')
+        子类可重写该方法，在多张图片之间复用解码器等初始化开销。
+        """
+        return [self.convert(file_path, output_dir) for file_path in file_paths]
 
-    def convert(self, file_path: str, output_dir: str) -> str:
-        try:
-            # 读取HEIC图片
-            image = Image.open(file_path)
-            # 准备输出路径
-            file_name = os.path.basename(file_path)
-            base_name = os.path.splitext(file_name)[0]
-            output_path = os.path.join(output_dir, f"{base_name}.jpeg")
-            # 保留EXIF数据
+    def convert_to_bytes(self, file_path: str) -> Optional[bytes]:
+        """在内存中转换图片并返回编码后的字节，返回None表示该转换器不支持内存转换"""
+        return None
+
+
+class PillowToJPEGConverter(ImageConverter):
+    """基于Pillow的JPEG转换器，子类声明扩展名即可支持新的格式"""
+    def __init__(self, quality: int = 90, max_edge: int = None):
+        # JPEG编码质量，过高的质量只会增加编码时间和文件体积
+        self.quality = quality
+        # 长边超过max_edge像素时先缩小，None表示保持原尺寸
+        self.max_edge = max_edge
+
+    def _save_jpeg(self, file_path: str, output):
+        """读取图片并以JPEG格式写入文件路径或缓冲区，保留EXIF数据"""
+        with Image.open(file_path) as image:
             exif_data = image.info.get('exif', None)
+            if self.max_edge and max(image.size) > self.max_edge:
+                image.thumbnail((self.max_edge, self.max_edge), Image.LANCZOS)
+            image = self._to_rgb(image)
             if exif_data:
-                image.save(output_path, 'JPEG', exif=exif_data)
+                image.save(output, 'JPEG', quality=self.quality, exif=exif_data)
             else:
-                image.save(output_path, 'JPEG')
+                image.save(output, 'JPEG', quality=self.quality)
+
+    @staticmethod
+    def _to_rgb(image: Image.Image) -> Image.Image:
+        """JPEG不支持透明通道，透明图片合成到白色背景上"""
+        if image.mode in ('RGB', 'L'):
+            return image
+        if image.mode in ('RGBA', 'LA') or (image.mode == 'P' and 'transparency' in image.info):
+            image = image.convert('RGBA')
+            background = Image.new('RGB', image.size, (255, 255, 255))
+            background.paste(image, mask=image.getchannel('A'))
+            return background
+        return image.convert('RGB')
+
+    def convert(self, file_path: str, output_dir: str) -> str:
+        try:
+            # 准备输出路径，保留源扩展名，避免slide.heic和slide.webp（或已有的slide.jpeg）写入同一个文件
+            file_name = os.path.basename(file_path)
+            output_path = os.path.join(output_dir, f"{file_name}.jpeg")
+            self._save_jpeg(file_path, output_path)
             logging.info(f"已将{file_path}转换为JPEG格式，保存为{output_path}")
             return output_path
         except Exception as e:
             logging.error(f"转换图片{file_path}失败: {e}")
             return None
 
+    def convert_to_bytes(self, file_path: str) -> Optional[bytes]:
+        try:
+            buffer = io.BytesIO()
+            self._save_jpeg(file_path, buffer)
+            return buffer.getvalue()
+        except Exception as e:
+            logging.error(f"转换图片{file_path}失败: {e}")
+            return None
+
+
+class HEICToJPEGConverter(PillowToJPEGConverter):
+    """HEIC到JPEG格式的转换器"""
+    extensions = ('.heic', '.heif')
+
+
+class WebPToJPEGConverter(PillowToJPEGConverter):
+    """WebP到JPEG格式的转换器"""
+    extensions = ('.webp',)
+
+
+class TIFFToJPEGConverter(PillowToJPEGConverter):
+    """TIFF到JPEG格式的转换器，扫描件通常尺寸很大，默认缩小到长边4096像素"""
+    extensions = ('.tif', '.tiff')
+
+    def __init__(self, quality: int = 90, max_edge: int = 4096):
+        super().__init__(quality, max_edge)
+
+
+# 批次尚未提交时的占位标记
+_QUEUED = object()
+
+# 拍摄时间的内存缓存，键为(路径, 大小, 修改时间)，在所有ImageProcessor实例间共享
+_timestamp_cache = {}
+_timestamp_cache_lock = threading.Lock()
+
+
+def _run_converter_batch(converter: ImageConverter, file_paths: list[str], output_dir: str) -> list[Optional[str]]:
+    """进程池工作函数，在子进程中执行一批转换任务（需为模块级函数以便序列化）"""
+    return converter.convert_many(file_paths, output_dir)
+
 
 class ImageProcessor:
     """图像处理类，支持插件式架构"""
-    def __init__(self):
+    def __init__(self, max_workers: int = None, cache: ConvertedImageCache = None, batch_size: int = 8,
+                 parallel_threshold: int = 4):
+        # 并行转换的进程数，None表示使用全部CPU核心，1表示串行转换
+        self.max_workers = max_workers or os.cpu_count() or 1
+        # 需要转换的图片少于该数量时串行转换，省去启动进程池的开销
+        self.parallel_threshold = parallel_threshold
+        # 转换结果缓存，为None时每次都重新转换
+        self.cache = cache
+        # 每次交给转换器convert_many的图片数量
+        self.batch_size = max(1, batch_size)
         self.converters = []
+        # 扩展名到转换器的索引，以及未声明扩展名、需逐个调用can_convert的转换器
+        self._converter_index = {}
+        self._fallback_converters = []
         # 注册默认转换器
         self.register_converter(HEICToJPEGConverter())
+        self.register_converter(WebPToJPEGConverter())
+        self.register_converter(TIFFToJPEGConverter())
 
     def register_converter(self, converter: ImageConverter):
         """注册新的图片转换器插件"""
         self.converters.append(converter)
+        if converter.extensions:
+            for extension in converter.extensions:
+                # 同一扩展名以先注册的转换器为准
+                self._converter_index.setdefault(extension.lower(), converter)
+                register_image_extension(extension)
+        else:
+            self._fallback_converters.append(converter)
         logging.info(f"已注册图片转换器: {converter.__class__.__name__}")
 
+    def find_converter(self, file_path: str) -> Optional[ImageConverter]:
+        """查找可以处理该文件的转换器，找不到时返回None"""
+        converter = self._converter_index.get(os.path.splitext(file_path)[1].lower())
+        if converter is not None and converter.can_convert(file_path):
+            return converter
+        for converter in self._fallback_converters:
+            if converter.can_convert(file_path):
+                return converter
+        return None
+
     def process_image(self, file_path: str, output_dir: str) -> str:
         """处理单张图片，根据文件类型选择合适的转换器"""
-        # 如果已经是JPEG格式，直接返回
-        if file_path.lower().endswith(('.jpeg', '.jpg')):
-            logging.info(f"文件{file_path}已是JPEG格式，无需转换")
+        # 如果已经是大模型可直接读取的格式，直接返回
+        if file_path.lower().endswith(PASSTHROUGH_EXTENSIONS):
+            logging.info(f"文件{file_path}无需转换")
             return file_path
 
         # 尝试使用已注册的转换器
-        for converter in self.converters:
-            if converter.can_convert(file_path):
-                return converter.convert(file_path, output_dir)
+        converter = self.find_converter(file_path)
+        if converter is None:
+            logging.warning(f"没有找到适合处理{file_path}的转换器")
+            return None
 
-        logging.warning(f"没有找到适合处理{file_path}的转换器")
-        return None
+        # 优先使用缓存中的转换结果
+        cache_key, cached_path = self._lookup_cache(file_path, converter)
+        if cached_path:
+            return cached_path
+        return self._store_cache(cache_key, converter.convert(file_path, output_dir))
+
+    def scan_images(self, input_dir: str, recursive: bool = True) -> Iterator[str]:
+        """扫描目录下的图片，包括只实现了can_convert、未声明扩展名的转换器可以处理的文件"""
+        accept = None
+        if self._fallback_converters:
+            accept = lambda file_path: any(converter.can_convert(file_path)
+                                           for converter in self._fallback_converters)
+        return scan_images(input_dir, recursive, accept=accept)
+
+    def is_supported(self, file_path: str) -> bool:
+        """检查文件是否为可处理的图片（无需转换或有对应的转换器）"""
+        return file_path.lower().endswith(PASSTHROUGH_EXTENSIONS) or self.find_converter(file_path) is not None
+
+    def is_converted_copy(self, file_path: str) -> bool:
+        """检查文件是否为输出到源文件所在目录的转换结果，例如IMG_0001.heic旁的IMG_0001.heic.jpeg"""
+        source_path, extension = os.path.splitext(file_path)
+        return (extension.lower() == '.jpeg' and os.path.isfile(source_path)
+                and self.find_converter(source_path) is not None)
+
+    def load_image_bytes(self, file_path: str) -> Optional[bytes]:
+        """在内存中获取可发送给大模型的图片字节，不写入中间文件
+
+        无需转换的格式直接读取原文件；其他格式优先使用转换器的内存转换，
+        转换器不支持内存转换时退回到临时目录中转换后读取。
+        """
+        if file_path.lower().endswith(PASSTHROUGH_EXTENSIONS):
+            with open(file_path, 'rb') as f:
+                return f.read()
+
+        converter = self.find_converter(file_path)
+        if converter is None:
+            logging.warning(f"没有找到适合处理{file_path}的转换器")
+            return None
+
+        data = converter.convert_to_bytes(file_path)
+        if data is not None:
+            return data
+        with tempfile.TemporaryDirectory(prefix="acp_convert_") as temp_dir:
+            output_path = converter.convert(file_path, temp_dir)
+            if not output_path:
+                return None
+            with open(output_path, 'rb') as f:
+                return f.read()
+
+    def _lookup_cache(self, file_path: str, converter: ImageConverter) -> tuple[Optional[str], Optional[str]]:
+        """查询转换结果缓存，返回(缓存键, 命中的缓存文件路径)"""
+        if self.cache is None:
+            return None, None
+        try:
+            cache_key = self.cache.make_key(file_path, converter)
+        except OSError as e:
+            logging.error(f"计算图片{file_path}缓存键失败: {e}")
+            return None, None
+        cached_path = self.cache.get(cache_key)
+        if cached_path:
+            logging.info(f"命中转换缓存: {file_path} -> {cached_path}")
+        return cache_key, cached_path
+
+    def _store_cache(self, cache_key: Optional[str], output_path: Optional[str]) -> Optional[str]:
+        """将转换结果写入缓存，返回应交给调用方的文件路径"""
+        if self.cache is not None and cache_key and output_path:
+            self.cache.put(cache_key, output_path)
+        return output_path
+
+    def iter_process_images(self, image_files: Iterable[str], output_dir: str = None,
+                            progress_callback: Callable[[int, Optional[int], str], None] = None) -> Iterator[str]:
+        """流式批量处理图片，边读取输入边提交转换，按输入顺序产出处理结果
+
+        需要转换的图片按转换器和输出目录分批，每批交给转换器的convert_many，
+        并在进程池中并行执行。image_files可以是生成器，转换在凑满第一批时即开始，无需等待输入全部就绪。
+        进程池在第一次提交批次时才启动；输入结束时尚未启动进程池、且剩余的图片少于parallel_threshold张
+        或只有一批时直接串行转换，全部图片都无需转换或命中缓存时不会启动进程池。
+
+        Args:
+            image_files: 待处理的图片路径，可以是列表或生成器
+            output_dir: 转换结果的输出目录，为None时输出到源文件所在目录
+            progress_callback: 进度回调，参数为(已完成数量, 总数量, 当前文件路径)，输入为生成器时总数量为None
+
+        Yields:
+            处理成功的图片路径，顺序与image_files一致
+        """
+        total = len(image_files) if hasattr(image_files, '__len__') else None
+        done = 0
 
-    def process_directory(self, input_dir: str, output_dir: str = None) -> list[str]:
-        """处理目录下的所有图片"""
-        # 如果未指定输出目录，则使用输入目录
-        if output_dir is None:
-            output_dir = input_dir
-
-        # 确保输出目录存在
-        os.makedirs(output_dir, exist_ok=True)
-
-        # 遍历目录下的所有文件
-        image_files = []
-        for file_name in os.listdir(input_dir):
-            file_path = os.path.join(input_dir, file_name)
-            if os.path.isfile(file_path):
-                # 检查文件是否为图片
-                if file_name.lower().endswith(('.heic', '.jpeg', '.jpg')):
-                    image_files.append(file_path)
-
-        logging.info(f"找到{len(image_files)}张图片文件")
-
-        # 处理所有图片
-        processed_files = []
-        for file_path in image_files:
-            processed_path = self.process_image(file_path, output_dir)
-            if processed_path:
-                processed_files.append(processed_path)
+        def report(file_path):
+            nonlocal done
+            done += 1
+            if progress_callback:
+                progress_callback(done, total, file_path)
 
+        executor = None
+        # 待产出的结果队列，元素为[文件路径, 结果, 缓存键]，
+        # 结果可以是路径、None、尚未提交的批次标记_QUEUED，或已提交批次的(Future, 批内下标)
+        pending = deque()
+        # 尚未提交的批次，键为(转换器id, 输出目录)
+        batches = {}
+
+        def submit(batch_key, serial=False):
+            nonlocal executor
+            converter, target_dir, entries = batches.pop(batch_key)
+            file_paths = [entry[0] for entry in entries]
+            if serial or self.max_workers <= 1:
+                try:
+                    outputs = converter.convert_many(file_paths, target_dir)
+                except Exception as e:
+                    logging.error(f"批量转换图片失败: {e}")
+                    outputs = [None] * len(entries)
+                for entry, output in zip(entries, outputs):
+                    entry[1] = self._store_cache(entry[2], output)
+            else:
+                if executor is None:
+                    executor = concurrent.futures.ProcessPoolExecutor(max_workers=self.max_workers)
+                future = executor.submit(_run_converter_batch, converter, file_paths, target_dir)
+                for position, entry in enumerate(entries):
+                    entry[1] = (future, position)
+
+        def ready(entry):
+            result = entry[1]
+            if result is _QUEUED:
+                return False
+            return not isinstance(result, tuple) or result[0].done()
+
+        def finish(entry):
+            file_path, result, cache_key = entry
+            if isinstance(result, tuple):
+                future, position = result
+                try:
+                    result = self._store_cache(cache_key, future.result()[position])
+                except Exception as e:
+                    logging.error(f"转换图片{file_path}失败: {e}")
+                    result = None
+            report(file_path)
+            return result
+
+        try:
+            for file_path in image_files:
+                target_dir = output_dir if output_dir is not None else os.path.dirname(file_path)
+                converter = None
+                if not file_path.lower().endswith(PASSTHROUGH_EXTENSIONS):
+                    converter = self.find_converter(file_path)
+                if converter is None:
+                    pending.append([file_path, self.process_image(file_path, target_dir), None])
+                else:
+                    cache_key, cached_path = self._lookup_cache(file_path, converter)
+                    if cached_path:
+                        pending.append([file_path, cached_path, cache_key])
+                    else:
+                        entry = [file_path, _QUEUED, cache_key]
+                        pending.append(entry)
+                        batch_key = (id(converter), target_dir)
+                        batches.setdefault(batch_key, (converter, target_dir, []))[2].append(entry)
+                        if len(batches[batch_key][2]) >= self.batch_size:
+                            submit(batch_key)
+                # 产出队首已完成的结果，保持输入顺序
+                while pending and ready(pending[0]):
+                    result = finish(pending.popleft())
+                    if result:
+                        yield result
+            # 输入结束，提交剩余未满的批次，转换量很小时不值得启动进程池
+            remaining = sum(len(entries) for _, _, entries in batches.values())
+            serial = executor is None and (remaining < self.parallel_threshold or len(batches) == 1)
+            for batch_key in list(batches):
+                submit(batch_key, serial)
+            while pending:
+                result = finish(pending.popleft())
+                if result:
+                    yield result
+        finally:
+            if executor is not None:
+                executor.shutdown(wait=True, cancel_futures=True)
+
+    def process_images(self, image_files: Iterable[str], output_dir: str = None,
+                       progress_callback: Callable[[int, Optional[int], str], None] = None) -> list[str]:
+        """批量处理图片，返回处理成功的图片路径列表，顺序与image_files一致"""
+        return list(self.iter_process_images(image_files, output_dir, progress_callback))
+
+    def process_directory(self, input_dir: str, output_dir: str = None,
+                          progress_callback: Callable[[int, Optional[int], str], None] = None,
+                          recursive: bool = True) -> list[str]:
+        """递归处理目录下的所有图片，扫描与转换同时进行
+
+        如果未指定输出目录，转换结果保存在源文件所在目录。
+        """
+        if output_dir is not None:
+            # 确保输出目录存在
+            os.makedirs(output_dir, exist_ok=True)
+
+        processed_files = self.process_images(self.scan_images(input_dir, recursive), output_dir, progress_callback)
+        logging.info(f"在{input_dir}中处理了{len(processed_files)}张图片文件")
         return processed_files
 
     def get_image_timestamp(self, image_path: str) -> str:
-        """获取图片的拍摄时间"""
+        """获取图片的拍摄时间，结果按(路径, 大小, 修改时间)缓存"""
         try:
-            image = Image.open(image_path)
-            exif_data = image._getexif()
-            if exif_data:
-                timestamp = exif_data.get(36867)
-                if timestamp:
-                    timestamp = timestamp.strip()
-                else:
-                    timestamp = os.path.getmtime(image_path)
-                    timestamp = time.strftime('%Y:%m:%d %H:%M:%S', time.localtime(timestamp))
-                return timestamp
-            else:
-                # 如果没有EXIF数据，使用文件修改时间
-                timestamp = os.path.getmtime(image_path)
-                return time.strftime('%Y:%m:%d %H:%M:%S', time.localtime(timestamp))
+            stat = os.stat(image_path)
+        except OSError as e:
+            logging.error(f"读取图片{image_path}文件信息失败: {e}")
+            return time.strftime('%Y:%m:%d %H:%M:%S', time.localtime(0))
+        cache_key = (os.path.abspath(image_path), stat.st_size, stat.st_mtime_ns)
+        with _timestamp_cache_lock:
+            timestamp = _timestamp_cache.get(cache_key)
+        if timestamp is None:
+            timestamp = self._read_image_timestamp(image_path, stat.st_mtime)
+            with _timestamp_cache_lock:
+                _timestamp_cache[cache_key] = timestamp
+        return timestamp
+
+    def _read_image_timestamp(self, image_path: str, mtime: float) -> str:
+        """读取图片的拍摄时间，没有EXIF拍摄时间时使用文件修改时间"""
+        try:
+            # 优先只解析文件头中的元数据，避免读取像素数据
+            timestamp = read_datetime_original(image_path)
+        except UnsupportedFormatError:
+            timestamp = self._read_image_timestamp_with_pil(image_path)
         except Exception as e:
             logging.error(f"读取图片{image_path}时间戳失败: {e}")
-            # 出错时使用文件修改时间
-            timestamp = os.path.getmtime(image_path)
-            return time.strftime('%Y:%m:%d %H:%M:%S', time.localtime(timestamp))
+            timestamp = None
+        if timestamp:
+            return timestamp.strip()
+        return time.strftime('%Y:%m:%d %H:%M:%S', time.localtime(mtime))
+
+    def _read_image_timestamp_with_pil(self, image_path: str) -> Optional[str]:
+        """使用PIL读取其他格式图片的EXIF拍摄时间"""
+        try:
+            with Image.open(image_path) as image:
+                exif_data = image.getexif()
+                return exif_data.get_ifd(0x8769).get(36867) or exif_data.get(36867)
+        except Exception as e:
+            logging.error(f"读取图片{image_path}时间戳失败: {e}")
+            return None
 
     def sort_images_by_timestamp(self, image_paths: list[str], reverse: bool = False) -> list[str]:
         """按照拍摄时间排序图片"""
-        # 添加时间戳信息
-        image_with_timestamp = []
-        for image_path in image_paths:
-            timestamp = self.get_image_timestamp(image_path)
-            image_with_timestamp.append((image_path, timestamp))
+        # 并行读取时间戳，网络挂载目录下主要耗时在文件访问延迟上
+        workers = min(32, max(1, len(image_paths)))
+        with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+            timestamps = list(executor.map(self.get_image_timestamp, image_paths))
+        image_with_timestamp = list(zip(image_paths, timestamps))
 
         # 排序
         sorted_images = sorted(image_with_timestamp, key=lambda x: x[1], reverse=reverse)
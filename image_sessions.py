@@ -0,0 +1,136 @@
+import logging
+import statistics
+from typing import Callable, Iterable, Optional
+
+from image_dedup import parse_timestamp
+
+# 设置日志
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+
+class SessionSegmenter:
+    """按拍摄时间间隔把照片划分为报告/专场，作为分段总结的单位
+
+    同一场报告中的照片间隔较短，两场报告之间通常有明显的空档。
+    """
+    def __init__(self, gap_seconds: float = 300, adaptive_factor: float = 0, max_chars: int = 10 * 1024):
+        # 相邻照片间隔超过gap_seconds秒视为新的一场报告
+        self.gap_seconds = gap_seconds
+        # 大于0时，阈值取gap_seconds与adaptive_factor倍间隔中位数的较大值，适应拍摄节奏不同的会议
+        self.adaptive_factor = adaptive_factor
+        # 单场报告的内容超过max_chars个字符时，在图片边界处继续拆分，避免超出模型上下文
+        self.max_chars = max_chars
+
+    @classmethod
+    def from_config(cls, config: dict) -> 'SessionSegmenter':
+        """根据配置文件中的sessions项创建分段器"""
+        session_config = config.get('sessions', {})
+        return cls(
+            gap_seconds=float(session_config.get('gap_seconds', 300)),
+            adaptive_factor=float(session_config.get('adaptive_factor', 0)),
+            max_chars=int(session_config.get('max_chars', 10 * 1024)),
+        )
+
+    def threshold(self, timestamps: list[Optional[float]]) -> float:
+        """计算划分报告的时间间隔阈值"""
+        if self.adaptive_factor <= 0:
+            return self.gap_seconds
+        known = [t for t in timestamps if t is not None]
+        gaps = [b - a for a, b in zip(known, known[1:]) if b >= a]
+        if not gaps:
+            return self.gap_seconds
+        return max(self.gap_seconds, self.adaptive_factor * statistics.median(gaps))
+
+    def segment(self, image_paths: list[str], timestamp_func: Callable[[str], str]) -> list[list[int]]:
+        """将按时间排序的图片划分为报告
+
+        Args:
+            image_paths: 按拍摄时间排序的图片路径列表
+            timestamp_func: 返回图片拍摄时间字符串的函数
+
+        Returns:
+            每场报告包含的图片下标列表（从0开始）
+        """
+        timestamps = [parse_timestamp(timestamp_func(path)) for path in image_paths]
+        threshold = self.threshold(timestamps)
+        sessions = []
+        last_timestamp = None
+        for idx, timestamp in enumerate(timestamps):
+            # 没有拍摄时间的图片归入当前报告
+            new_session = not sessions or (
+                timestamp is not None and last_timestamp is not None and timestamp - last_timestamp > threshold
+            )
+            if new_session:
+                sessions.append([])
+            sessions[-1].append(idx)
+            if timestamp is not None:
+                last_timestamp = timestamp
+        logging.info(f"按{threshold:.0f}秒的时间间隔将{len(image_paths)}张图片划分为{len(sessions)}场报告")
+        return sessions
+
+    def build_segments(self, sessions: list[list[int]], texts: dict[int, str]) -> list[str]:
+        """把每场报告的图片内容拼接为总结单元，过长的报告在图片边界处拆分
+
+        Args:
+            sessions: segment返回的报告划分
+            texts: 图片下标到提取内容的映射
+
+        Returns:
+            总结单元列表，每个单元只包含同一场报告的内容
+        """
+        segments = []
+        for session in sessions:
+            current = ""
+            for idx in session:
+                text = texts.get(idx, "").strip()
+                if not text:
+                    continue
+                if current and len(current) + len(text) + 1 > self.max_chars:
+                    segments.append(current)
+                    current = ""
+                current = f"{current}\n{text}" if current else text
+            if current:
+                segments.append(current)
+        return segments
+
+
+class SegmentTracker:
+    """跟踪各场报告的提取进度，用于提取和分段总结重叠进行
+
+    一场报告及其之前的全部报告都提取完成时产出该报告的总结单元。按报告顺序产出保证分段序号
+    与先提取、后总结时一致，分段总结的提示词和响应缓存不受是否重叠影响。
+    """
+    def __init__(self, segmenter: SessionSegmenter, sessions: list[list[int]], pending: Iterable[int]):
+        """
+        Args:
+            segmenter: 用于拼接总结单元的分段器
+            sessions: segment返回的报告划分
+            pending: 需要等待提取结果的图片下标（从0开始），不在其中的图片（例如近重复图片）不参与总结
+        """
+        pending = set(pending)
+        self.segmenter = segmenter
+        self.sessions = sessions
+        self.remaining = [sum(1 for idx in session if idx in pending) for session in sessions]
+        self.session_of = {idx: n for n, session in enumerate(sessions) for idx in session if idx in pending}
+        self.texts = {}
+        self.next_session = 0
+        self.next_segment = 0
+
+    def add(self, idx: int, text: str) -> list[tuple[int, str]]:
+        """记录图片的提取结果，返回因此可以开始总结的(分段序号, 总结单元)列表"""
+        session = self.session_of.pop(idx, None)
+        if session is None:
+            return []
+        self.texts[idx] = text
+        self.remaining[session] -= 1
+        return self.ready()
+
+    def ready(self) -> list[tuple[int, str]]:
+        """返回已经可以开始总结、尚未产出的(分段序号, 总结单元)列表"""
+        ready = []
+        while self.next_session < len(self.sessions) and self.remaining[self.next_session] == 0:
+            for segment in self.segmenter.build_segments([self.sessions[self.next_session]], self.texts):
+                ready.append((self.next_segment, segment))
+                self.next_segment += 1
+            self.next_session += 1
+        return ready
@@ -0,0 +1,339 @@
+import time
+import random
+import logging
+import threading
+from typing import Callable, Iterator
+
+from llm_client import LLMClientRegistry, load_config
+from llm_retry import classify_error, CLIENT_ERROR, CONNECTION, SERVER_ERROR, TIMEOUT
+
+# 设置日志记录
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+# 断路器状态
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+# 计入断路器的错误类型，说明服务本身不可用；限流由限速器和重试处理，客户端错误换服务也不会成功
+BREAKER_ERRORS = (TIMEOUT, CONNECTION, SERVER_ERROR)
+
+
+def failure_kind(error: Exception) -> str:
+    """归类服务客户端抛出的异常，服务客户端把原始异常包装在RuntimeError中"""
+    return classify_error(error.__cause__ or error)
+
+
+class CircuitBreaker:
+    """断路器：连续失败达到阈值后在一段时间内不再向该服务发送请求
+
+    冷却时间结束后进入半开状态，只放行一个试探请求，成功则恢复，失败则再次断开并加倍冷却时间。
+    """
+    def __init__(self, failure_threshold: int = 3, recovery_seconds: float = 30.0, max_recovery_seconds: float = 600.0):
+        self.failure_threshold = failure_threshold
+        self.recovery_seconds = recovery_seconds
+        self.max_recovery_seconds = max_recovery_seconds
+        self.state = CLOSED
+        self._failures = 0
+        self._cooldown = recovery_seconds
+        self._opened_at = 0.0
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    def available(self) -> bool:
+        """判断当前是否可能放行请求，不占用半开状态的试探名额"""
+        with self._lock:
+            if self.state == OPEN:
+                return time.monotonic() - self._opened_at >= self._cooldown
+            return self.state == CLOSED or not self._trial_in_flight
+
+    def allow(self) -> bool:
+        """判断当前是否可以向该服务发送请求，半开状态下只放行一个试探请求"""
+        with self._lock:
+            if self.state == CLOSED:
+                return True
+            if self.state == OPEN and time.monotonic() - self._opened_at >= self._cooldown:
+                self.state = HALF_OPEN
+                self._trial_in_flight = False
+            if self.state == HALF_OPEN and not self._trial_in_flight:
+                self._trial_in_flight = True
+                return True
+            return False
+
+    def retry_in(self) -> float:
+        """距离下一次允许试探的秒数"""
+        with self._lock:
+            if self.state != OPEN:
+                return 0.0
+            return max(0.0, self._cooldown - (time.monotonic() - self._opened_at))
+
+    def record_success(self):
+        with self._lock:
+            self.state = CLOSED
+            self._failures = 0
+            self._cooldown = self.recovery_seconds
+            self._trial_in_flight = False
+
+    def record_failure(self) -> bool:
+        """记录一次失败，返回断路器是否因此断开"""
+        with self._lock:
+            self._failures += 1
+            if self.state == HALF_OPEN:
+                self._cooldown = min(self.max_recovery_seconds, self._cooldown * 2)
+            elif self._failures < self.failure_threshold or self.state == OPEN:
+                return False
+            self.state = OPEN
+            self._opened_at = time.monotonic()
+            self._trial_in_flight = False
+            return True
+
+    def release(self):
+        """请求以不计入断路器的错误结束时归还半开状态的试探名额"""
+        with self._lock:
+            self._trial_in_flight = False
+
+
+class _Backend:
+    """组合客户端中的一个服务及其健康状况"""
+    def __init__(self, name: str, client, weight: float, breaker: CircuitBreaker):
+        self.name = name
+        self.client = client
+        self.weight = weight
+        self.breaker = breaker
+        # 成功请求耗时的指数滑动平均
+        self.latency = None
+        self.lock = threading.Lock()
+        self.stats = {'requests': 0, 'successes': 0, 'failures': 0, 'other_errors': 0, 'circuit_opened': 0}
+
+    def record(self, latency: float = None, failed: bool = False):
+        with self.lock:
+            self.stats['requests'] += 1
+            if failed:
+                self.stats['failures'] += 1
+            else:
+                self.stats['successes'] += 1
+                self.latency = latency if self.latency is None else 0.8 * self.latency + 0.2 * latency
+        if failed:
+            if self.breaker.record_failure():
+                with self.lock:
+                    self.stats['circuit_opened'] += 1
+                logging.warning(f"服务{self.name}连续失败，断路器断开")
+        else:
+            self.breaker.record_success()
+
+    def record_error(self, error: Exception) -> str:
+        """记录一次失败的请求，只有超时、连接错误和服务端错误计入断路器，返回错误类型"""
+        kind = failure_kind(error)
+        if kind in BREAKER_ERRORS:
+            self.record(failed=True)
+            return kind
+        with self.lock:
+            self.stats['requests'] += 1
+            self.stats['other_errors'] += 1
+        self.breaker.release()
+        return kind
+
+
+class LoadBalancedClientBase:
+    """多服务组合客户端的公共逻辑：按权重和观测延迟选择服务，失败时切换到其他服务
+
+    配置文件中的load_balancing项示例：
+    {"load_balancing": {"enabled": true, "providers": [{"service": "ark", "weight": 2}, {"service": "local_llm"}],
+                        "tasks": ["vlm"], "failure_threshold": 3, "recovery_seconds": 30}}
+    服务项中的name用于区分同一类型的多个服务，例如
+    {"service": "local_llm", "name": "gpu2", "config": {"llm_address": "10.0.0.2"}}
+    tasks中的任务在服务间分摊，其他任务优先使用第一个服务，只在失败时切换。
+    """
+    # 服务在注册中心中的类型后缀，异步组合客户端使用异步服务客户端
+    client_suffix = ''
+
+    def __init__(self, api_key=None, config=None) -> None:
+        balance_config = config or load_config().get('load_balancing', {})
+        providers = balance_config.get('providers', [])
+        if not providers:
+            raise ValueError("load_balancing.providers中至少需要配置一个服务")
+        self.balanced_tasks = set(balance_config.get('tasks', ['vlm']))
+        # 切换服务前，每个服务的最大尝试次数，默认不在单个服务上重试，失败后直接切换
+        self.attempts_per_backend = int(balance_config.get('attempts_per_backend', 1))
+        self.backends = []
+        for provider in providers:
+            service = provider['service'] if isinstance(provider, dict) else provider
+            settings = provider if isinstance(provider, dict) else {}
+            breaker = CircuitBreaker(
+                failure_threshold=int(balance_config.get('failure_threshold', 3)),
+                recovery_seconds=float(balance_config.get('recovery_seconds', 30)),
+            )
+            # 服务项中可以单独指定API密钥和额外配置，例如多台本地大模型服务器
+            client = LLMClientRegistry.get_client(service + self.client_suffix, settings.get('api_key'),
+                                                  settings.get('config'))
+            self.backends.append(_Backend(settings.get('name', service), client, float(settings.get('weight', 1.0)),
+                                          breaker))
+        self.provider_name = '+'.join(backend.name for backend in self.backends)
+        self.models = self.backends[0].client.models
+
+    def candidates(self, task: str) -> Iterator[_Backend]:
+        """依次返回本次请求尝试的服务
+
+        分摊的任务按 权重/平均延迟 加权随机排序，其他任务按配置顺序；
+        只有全部服务的断路器都断开时，才按最快恢复的顺序尝试断开的服务，而不是直接失败。
+        """
+        available = [backend for backend in self.backends if backend.breaker.available()]
+        allowed = False
+        for backend in self._order(task, available):
+            # 半开状态的服务只放行一个试探请求
+            if backend.breaker.allow():
+                allowed = True
+                yield backend
+        if not allowed:
+            yield from sorted(self.backends, key=lambda backend: backend.breaker.retry_in())
+
+    def _order(self, task: str, available: list[_Backend]) -> list[_Backend]:
+        if task not in self.balanced_tasks or len(available) < 2:
+            return available
+        known = [backend.latency for backend in available if backend.latency]
+        default_latency = sum(known) / len(known) if known else 1.0
+        ordered = []
+        pool = list(available)
+        while pool:
+            scores = [backend.weight / (backend.latency or default_latency) for backend in pool]
+            chosen = random.choices(pool, weights=scores)[0]
+            ordered.append(chosen)
+            pool.remove(chosen)
+        return ordered
+
+    def service_types(self) -> list[str]:
+        """各服务的类型，服务项中的name只用于显示，不能用于查找服务能力"""
+        return [service for backend in self.backends for service in backend.client.service_types()]
+
+    def concurrency_ceiling(self, task: str = 'llm') -> int:
+        """各服务并发上限之和"""
+        return sum(backend.client.concurrency_ceiling(task) for backend in self.backends)
+
+    def concurrency_limit(self, task: str = 'llm') -> int:
+        """各服务当前并发上限之和"""
+        return sum(backend.client.concurrency_limit(task) for backend in self.backends)
+
+    def stats(self) -> dict:
+        """返回每个服务的请求数、失败次数、平均延迟和断路器状态"""
+        result = {}
+        for backend in self.backends:
+            with backend.lock:
+                result[backend.name] = {
+                    **backend.stats,
+                    'avg_latency': round(backend.latency, 3) if backend.latency is not None else None,
+                    'state': backend.breaker.state,
+                }
+        return result
+
+    def log_stats(self):
+        logging.info(f"多服务负载均衡情况: {self.stats()}")
+
+
+class LoadBalancedClient(LoadBalancedClientBase):
+    """同步的多服务组合客户端，接口与LLMClient一致"""
+
+    def get_response(self, messages: list[dict[str, str]], task='llm', max_retry=None, use_cache=True,
+                     hedge=True) -> str:
+        """依次尝试候选服务，直到有一个服务返回响应
+
+        参数与LLMClient.get_response一致，max_retry为每个服务的最大尝试次数，默认使用attempts_per_backend，
+        hedge传给各服务的客户端，为False时各服务都不对冲。
+        """
+        last_error = None
+        for backend in self.candidates(task):
+            started = time.monotonic()
+            try:
+                response = backend.client.get_response(messages, task=task,
+                                                       max_retry=max_retry or self.attempts_per_backend,
+                                                       use_cache=use_cache, hedge=hedge)
+            except Exception as e:
+                # 客户端错误（参数错误、内容审核、超出上下文等）换服务也不会成功，直接抛出
+                if backend.record_error(e) == CLIENT_ERROR:
+                    raise
+                last_error = e
+                logging.warning(f"服务{backend.name}请求失败，切换到下一个服务: {str(e)}")
+                continue
+            backend.record(time.monotonic() - started)
+            return response
+        raise RuntimeError(f"Failed to get response from {task} model on all providers.") from last_error
+
+    def stream_response(self, messages: list[dict[str, str]], task='llm', max_retry=None, use_cache=True,
+                        on_reset: Callable[[], None] = None) -> Iterator[str]:
+        """流式请求，开始输出之前失败时切换到下一个服务"""
+        last_error = None
+        for backend in self.candidates(task):
+            started = time.monotonic()
+            yielded = False
+            try:
+                for delta in backend.client.stream_response(messages, task=task,
+                                                            max_retry=max_retry or self.attempts_per_backend,
+                                                            use_cache=use_cache, on_reset=on_reset):
+                    yielded = True
+                    yield delta
+            except Exception as e:
+                if backend.record_error(e) == CLIENT_ERROR or yielded:
+                    raise
+                last_error = e
+                logging.warning(f"服务{backend.name}流式请求失败，切换到下一个服务: {str(e)}")
+                continue
+            backend.record(time.monotonic() - started)
+            return
+        raise RuntimeError(f"Failed to get response from {task} model on all providers.") from last_error
+
+    def concurrency_controller(self, task: str = 'llm'):
+        """组合客户端没有统一的并发控制器，各服务使用自己的控制器"""
+        return None
+
+    def test_connection(self) -> tuple[bool, str]:
+        """测试所有服务的连接"""
+        results = [(backend.name, *backend.client.test_connection()) for backend in self.backends]
+        ok = all(success for _, success, _ in results)
+        return ok, '；'.join(f"{name}: {message}" for name, _, message in results)
+
+
+class AsyncLoadBalancedClient(LoadBalancedClientBase):
+    """异步的多服务组合客户端，接口与AsyncLLMClient一致"""
+    client_suffix = '_async'
+
+    def __init__(self, api_key=None, config=None) -> None:
+        super().__init__(api_key, config)
+        # 流式请求使用同步的组合客户端
+        self.sync_client = LoadBalancedClient(api_key, config)
+
+    async def get_response(self, messages: list[dict[str, str]], task='llm', max_retry=None, use_cache=True,
+                           hedge=True) -> str:
+        """依次尝试候选服务，直到有一个服务返回响应，参数与AsyncLLMClient.get_response一致"""
+        last_error = None
+        for backend in self.candidates(task):
+            started = time.monotonic()
+            try:
+                response = await backend.client.get_response(messages, task=task,
+                                                             max_retry=max_retry or self.attempts_per_backend,
+                                                             use_cache=use_cache, hedge=hedge)
+            except Exception as e:
+                # 客户端错误（参数错误、内容审核、超出上下文等）换服务也不会成功，直接抛出
+                if backend.record_error(e) == CLIENT_ERROR:
+                    raise
+                last_error = e
+                logging.warning(f"服务{backend.name}请求失败，切换到下一个服务: {str(e)}")
+                continue
+            backend.record(time.monotonic() - started)
+            return response
+        raise RuntimeError(f"Failed to get response from {task} model on all providers.") from last_error
+
+    def concurrency_controller(self, task: str = 'llm'):
+        return None
+
+    async def aclose(self):
+        for backend in self.backends:
+            await backend.client.aclose()
+
+    async def test_connection(self) -> tuple[bool, str]:
+        results = [(backend.name, *(await backend.client.test_connection())) for backend in self.backends]
+        ok = all(success for _, success, _ in results)
+        return ok, '；'.join(f"{name}: {message}" for name, _, message in results)
+
+
+# 注册组合客户端
+LLMClientRegistry.register_client('balanced', LoadBalancedClient)
+LLMClientRegistry.register_client('balanced_async', AsyncLoadBalancedClient)
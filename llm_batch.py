@@ -0,0 +1,412 @@
+import os
+import json
+import time
+import uuid
+import hashlib
+import logging
+import threading
+import concurrent.futures
+from abc import ABC, abstractmethod
+from typing import Iterable, Optional
+
+from llm_client import count_images
+from llm_metrics import RunMetrics
+
+# 设置日志记录
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+# 批处理任务的终止状态，与OpenAI Batch API一致
+TERMINAL_STATUSES = {'completed', 'failed', 'expired', 'cancelled'}
+DEFAULT_JOB_DIR = 'batch_jobs'
+
+
+class BatchBackend(ABC):
+    """离线批处理后端：提交JSONL任务文件、查询进度并取回结果
+
+    任务文件每行是一个请求：{"custom_id": ..., "method": "POST", "url": "/v1/chat/completions", "body": {...}}，
+    结果每行为{"custom_id": ..., "response": {"status_code": 200, "body": {...}}, "error": null}，
+    与OpenAI Batch API的格式一致。
+    """
+    name = 'batch'
+
+    @abstractmethod
+    def submit(self, input_path: str) -> str:
+        """提交任务文件，返回任务ID"""
+        pass
+
+    @abstractmethod
+    def poll(self, job_id: str) -> dict:
+        """查询任务状态，返回{"status": ..., "completed": 已完成请求数, "total": 请求总数}"""
+        pass
+
+    @abstractmethod
+    def fetch_results(self, job_id: str) -> list[dict]:
+        """取回已结束任务的全部结果行，包括失败的请求"""
+        pass
+
+
+class BatchBackendRegistry:
+    """批处理后端注册中心"""
+    _backends = {}
+
+    @classmethod
+    def register_backend(cls, backend_type: str, backend_class):
+        """注册后端类"""
+        cls._backends[backend_type] = backend_class
+
+    @classmethod
+    def get_backend(cls, backend_type: str, settings: dict, llm_client) -> BatchBackend:
+        """根据类型创建后端实例，llm_client为提交请求的服务对应的同步客户端"""
+        if backend_type not in cls._backends:
+            raise ValueError(f"不支持的批处理后端: {backend_type}")
+        return cls._backends[backend_type].from_config(settings, llm_client)
+
+    @classmethod
+    def get_supported_types(cls):
+        return list(cls._backends.keys())
+
+
+class OpenAIBatchBackend(BatchBackend):
+    """OpenAI兼容的Batch API（/v1/files和/v1/batches），SiliconFlow等平台提供，价格通常低于实时调用"""
+    name = 'openai'
+
+    def __init__(self, client, completion_window: str = '24h'):
+        self.client = client
+        self.completion_window = completion_window
+
+    @classmethod
+    def from_config(cls, settings: dict, llm_client) -> 'OpenAIBatchBackend':
+        return cls(llm_client.get_client(settings.get('task', 'vlm')), settings.get('completion_window', '24h'))
+
+    def submit(self, input_path: str) -> str:
+        with open(input_path, 'rb') as f:
+            uploaded = self.client.files.create(file=f, purpose='batch')
+        batch = self.client.batches.create(input_file_id=uploaded.id, endpoint='/v1/chat/completions',
+                                           completion_window=self.completion_window)
+        return batch.id
+
+    def poll(self, job_id: str) -> dict:
+        batch = self.client.batches.retrieve(job_id)
+        counts = batch.request_counts
+        return {
+            'status': batch.status,
+            'completed': (counts.completed + counts.failed) if counts is not None else 0,
+            'total': counts.total if counts is not None else 0,
+        }
+
+    def fetch_results(self, job_id: str) -> list[dict]:
+        batch = self.client.batches.retrieve(job_id)
+        lines = []
+        for file_id in (batch.output_file_id, batch.error_file_id):
+            if file_id:
+                text = self.client.files.content(file_id).text
+                lines.extend(json.loads(line) for line in text.splitlines() if line.strip())
+        return lines
+
+
+class LocalFileBatchBackend(BatchBackend):
+    """基于本地文件的批处理后端，用于测试离线批处理流程
+
+    任务保存在job_dir下，后台线程逐条处理请求并把结果追加到output.jsonl，进程中断后再次查询时从断点继续。
+    提供llm_client时把请求发给该客户端对应的服务（例如本地大模型），否则返回占位结果。
+    """
+    name = 'local'
+
+    def __init__(self, job_dir: str = os.path.join(DEFAULT_JOB_DIR, 'local'), llm_client=None, task: str = 'vlm',
+                 max_workers: int = 4):
+        self.job_dir = job_dir
+        self.client = llm_client.get_client(task) if llm_client is not None else None
+        self.max_workers = max_workers
+        self._workers = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, settings: dict, llm_client) -> 'LocalFileBatchBackend':
+        return cls(
+            job_dir=settings.get('local_job_dir', os.path.join(settings.get('job_dir', DEFAULT_JOB_DIR), 'local')),
+            llm_client=llm_client if settings.get('local_use_llm', True) else None,
+            task=settings.get('task', 'vlm'),
+            max_workers=int(settings.get('local_workers', 4)),
+        )
+
+    def _path(self, job_id: str, name: str) -> str:
+        return os.path.join(self.job_dir, job_id, name)
+
+    def _read_state(self, job_id: str) -> dict:
+        with open(self._path(job_id, 'state.json'), 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    def _write_state(self, job_id: str, state: dict):
+        tmp_path = self._path(job_id, 'state.json.tmp')
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(state, f)
+        os.replace(tmp_path, self._path(job_id, 'state.json'))
+
+    def submit(self, input_path: str) -> str:
+        job_id = f"local_batch_{uuid.uuid4().hex[:12]}"
+        os.makedirs(os.path.join(self.job_dir, job_id), exist_ok=True)
+        with open(input_path, 'rb') as src, open(self._path(job_id, 'input.jsonl'), 'wb') as dst:
+            total = 0
+            for line in src:
+                dst.write(line)
+                total += bool(line.strip())
+        self._write_state(job_id, {'status': 'in_progress', 'total': total, 'created': time.time()})
+        self._start(job_id)
+        return job_id
+
+    def _start(self, job_id: str):
+        with self._lock:
+            worker = self._workers.get(job_id)
+            if worker is not None and worker.is_alive():
+                return
+            worker = threading.Thread(target=self._process, args=(job_id,), daemon=True)
+            self._workers[job_id] = worker
+        worker.start()
+
+    def _process(self, job_id: str):
+        """处理任务中尚无结果的请求"""
+        done = {line['custom_id'] for line in self._read_output(job_id)}
+        with open(self._path(job_id, 'input.jsonl'), 'r', encoding='utf-8') as f:
+            requests = [json.loads(line) for line in f if line.strip()]
+        write_lock = threading.Lock()
+        with open(self._path(job_id, 'output.jsonl'), 'a+', encoding='utf-8') as out, \
+                concurrent.futures.ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            # 中断时写了一半的行单独成行，之后作为无效行跳过
+            if out.tell() > 0:
+                out.seek(out.tell() - 1)
+                if out.read(1) != '\n':
+                    out.write('\n')
+            def handle(request):
+                result = self._execute(request)
+                with write_lock:
+                    out.write(json.dumps(result, ensure_ascii=False) + '\n')
+                    out.flush()
+            list(executor.map(handle, [request for request in requests if request['custom_id'] not in done]))
+        state = self._read_state(job_id)
+        state['status'] = 'completed'
+        self._write_state(job_id, state)
+
+    def _execute(self, request: dict) -> dict:
+        if self.client is None:
+            body = {'object': 'chat.completion', 'model': request['body'].get('model'),
+                    'choices': [{'index': 0, 'finish_reason': 'stop',
+                                 'message': {'role': 'assistant', 'content': f"（本地批处理占位结果：{request['custom_id']}）"}}]}
+            return {'custom_id': request['custom_id'], 'response': {'status_code': 200, 'body': body}, 'error': None}
+        try:
+            response = self.client.chat.completions.create(**request['body'])
+        except Exception as e:
+            return {'custom_id': request['custom_id'], 'response': None, 'error': {'message': str(e)}}
+        return {'custom_id': request['custom_id'], 'response': {'status_code': 200, 'body': response.model_dump()},
+                'error': None}
+
+    def _read_output(self, job_id: str) -> list[dict]:
+        path = self._path(job_id, 'output.jsonl')
+        if not os.path.exists(path):
+            return []
+        lines = []
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    lines.append(json.loads(line))
+                except json.JSONDecodeError:
+                    # 进程中断时最后一行可能不完整，该请求会重新处理
+                    pass
+        return lines
+
+    def poll(self, job_id: str) -> dict:
+        state = self._read_state(job_id)
+        if state['status'] == 'in_progress':
+            # 提交任务的进程已经退出时，在当前进程中继续处理
+            self._start(job_id)
+        return {'status': state['status'], 'completed': len(self._read_output(job_id)), 'total': state['total']}
+
+    def fetch_results(self, job_id: str) -> list[dict]:
+        return self._read_output(job_id)
+
+
+BatchBackendRegistry.register_backend('openai', OpenAIBatchBackend)
+BatchBackendRegistry.register_backend('local', LocalFileBatchBackend)
+
+
+class BatchInferenceRunner:
+    """离线批处理：把请求写入JSONL任务文件，通过批处理后端提交并轮询，取回每个请求的结果
+
+    已提交的任务记录在job_dir/jobs.json中，以任务文件内容的哈希为键，重新运行时继续等待同一任务而不是重复提交。
+    """
+    def __init__(self, backend: BatchBackend, llm_client, job_dir: str = DEFAULT_JOB_DIR, poll_interval: float = 30,
+                 timeout: float = 48 * 3600, max_requests: int = 50000, max_file_mb: float = 100):
+        self.backend = backend
+        self.llm_client = llm_client
+        self.job_dir = job_dir
+        self.poll_interval = poll_interval
+        self.timeout = timeout
+        # Batch API对单个任务文件的请求数和大小有限制，超出时拆分为多个任务
+        self.max_requests = max_requests
+        self.max_file_bytes = int(max_file_mb * 1024 * 1024)
+
+    @classmethod
+    def from_config(cls, config: dict, llm_client) -> Optional['BatchInferenceRunner']:
+        """根据配置文件中的batch_inference项创建批处理器，未启用时返回None
+
+        例如{"batch_inference": {"enabled": true, "backend": "openai", "poll_interval": 60}}
+        """
+        settings = config.get('batch_inference', {})
+        if not settings.get('enabled', False):
+            return None
+        # 异步客户端使用其对应的同步客户端，组合客户端使用其中的第一个服务
+        llm_client = getattr(llm_client, 'sync_client', llm_client)
+        if getattr(llm_client, 'backends', None):
+            llm_client = llm_client.backends[0].client
+        backend = BatchBackendRegistry.get_backend(settings.get('backend', 'openai'), settings, llm_client)
+        return cls(
+            backend,
+            llm_client,
+            job_dir=settings.get('job_dir', DEFAULT_JOB_DIR),
+            poll_interval=float(settings.get('poll_interval', 30)),
+            timeout=float(settings.get('timeout', 48 * 3600)),
+            max_requests=int(settings.get('max_requests', 50000)),
+            max_file_mb=float(settings.get('max_file_mb', 100)),
+        )
+
+    def write_files(self, requests: Iterable[tuple[str, list[dict]]],
+                    task: str = 'vlm') -> tuple[list[tuple[str, str]], dict[str, int]]:
+        """把(custom_id, messages)请求逐条写入一个或多个任务文件
+
+        requests可以是生成器，每条请求写入后即可释放，内存中不保留图片的base64数据。
+
+        Returns:
+            ((文件路径, 内容哈希)列表, custom_id到请求中图片数的映射)
+        """
+        os.makedirs(self.job_dir, exist_ok=True)
+        files = []
+        images = {}
+        f, tmp_path, digest, count = None, None, None, 0
+        try:
+            for custom_id, messages in requests:
+                line = (json.dumps({'custom_id': custom_id, 'method': 'POST', 'url': '/v1/chat/completions',
+                                    'body': {'model': self.llm_client.models[task], 'messages': messages}},
+                                   ensure_ascii=False) + '\n').encode('utf-8')
+                images[custom_id] = count_images(messages)
+                if f is not None and (count >= self.max_requests or f.tell() + len(line) > self.max_file_bytes):
+                    files.append(self._finish_file(f, tmp_path, digest, task))
+                    f = None
+                if f is None:
+                    # 内容哈希在写完之后才能确定，先写入临时文件
+                    tmp_path = os.path.join(self.job_dir, f"{task}_{uuid.uuid4().hex}.tmp")
+                    f, digest, count = open(tmp_path, 'wb'), hashlib.sha256(), 0
+                f.write(line)
+                digest.update(line)
+                count += 1
+            if f is not None:
+                files.append(self._finish_file(f, tmp_path, digest, task))
+                f = None
+        finally:
+            if f is not None:
+                f.close()
+                os.remove(tmp_path)
+        return files, images
+
+    def _finish_file(self, f, tmp_path: str, digest, task: str) -> tuple[str, str]:
+        """关闭临时文件并按内容哈希命名，返回(文件路径, 内容哈希)"""
+        f.close()
+        digest = digest.hexdigest()
+        path = os.path.join(self.job_dir, f"{task}_{digest[:16]}.jsonl")
+        if os.path.exists(path):
+            os.remove(tmp_path)
+        else:
+            os.replace(tmp_path, path)
+        return path, digest
+
+    def _load_jobs(self) -> dict:
+        path = os.path.join(self.job_dir, 'jobs.json')
+        if not os.path.exists(path):
+            return {}
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    def _save_jobs(self, jobs: dict):
+        path = os.path.join(self.job_dir, 'jobs.json')
+        with open(path + '.tmp', 'w', encoding='utf-8') as f:
+            json.dump(jobs, f, ensure_ascii=False, indent=2)
+        os.replace(path + '.tmp', path)
+
+    def run(self, requests: Iterable[tuple[str, list[dict]]], task: str = 'vlm') -> dict[str, str]:
+        """提交请求并等待完成，返回custom_id到回复内容的映射，失败或超时的请求不在结果中
+
+        requests可以是生成器，请求写入任务文件后不再保留在内存中。
+        """
+        files, images = self.write_files(requests, task)
+        if not images:
+            return {}
+        jobs = self._load_jobs()
+        job_ids = []
+        # 之前的运行中已经完成的任务不再计入本次运行的费用
+        finished_before = set()
+        for path, digest in files:
+            key = f"{self.backend.name}:{digest}"
+            job = jobs.get(key)
+            if job is None or job['status'] in {'failed', 'expired', 'cancelled'}:
+                job = {'job_id': self.backend.submit(path), 'input': path, 'status': 'submitted',
+                       'submitted': time.time()}
+                jobs[key] = job
+                self._save_jobs(jobs)
+                logging.info(f"已提交批处理任务{job['job_id']}: {path}")
+            elif job['status'] in TERMINAL_STATUSES:
+                finished_before.add(key)
+                logging.info(f"使用之前完成的批处理任务{job['job_id']}的结果")
+            else:
+                logging.info(f"继续等待已提交的批处理任务{job['job_id']}")
+            job_ids.append((key, job['job_id']))
+
+        started = time.monotonic()
+        pending = dict(job_ids)
+        while pending:
+            for key, job_id in list(pending.items()):
+                progress = self.backend.poll(job_id)
+                if progress['status'] in TERMINAL_STATUSES:
+                    jobs[key]['status'] = progress['status']
+                    self._save_jobs(jobs)
+                    del pending[key]
+                    logging.info(f"批处理任务{job_id}结束: {progress}")
+                else:
+                    logging.info(f"批处理任务{job_id}进行中: {progress['completed']}/{progress['total']}")
+            if not pending:
+                break
+            if time.monotonic() - started > self.timeout:
+                logging.warning(f"等待批处理任务超时，未完成的任务: {list(pending.values())}")
+                break
+            time.sleep(self.poll_interval)
+        elapsed = time.monotonic() - started
+
+        results = {}
+        for key, job_id in job_ids:
+            if key in pending:
+                continue
+            for line in self.backend.fetch_results(job_id):
+                if line.get('custom_id') not in images:
+                    continue
+                content = self._record(line, task, elapsed, images[line['custom_id']], key in finished_before)
+                if content is not None:
+                    results[line['custom_id']] = content
+        logging.info(f"批处理完成{len(results)}/{len(images)}个请求")
+        return results
+
+    def _record(self, line: dict, task: str, elapsed: float, images: int, cached: bool) -> Optional[str]:
+        """解析一行结果并记录到运行统计中，请求失败时返回None"""
+        response = line.get('response') or {}
+        body = response.get('body') or {}
+        choices = body.get('choices') or []
+        content = choices[0].get('message', {}).get('content') if choices else None
+        success = line.get('error') is None and response.get('status_code') == 200 and content is not None
+        usage = body.get('usage') or {}
+        details = usage.get('completion_tokens_details') or {}
+        RunMetrics.current().record(
+            f"{self.llm_client.provider_name}({self.backend.name}_batch)", self.llm_client.models[task], task,
+            elapsed, prompt_tokens=usage.get('prompt_tokens'), completion_tokens=usage.get('completion_tokens'),
+            reasoning_tokens=details.get('reasoning_tokens'), success=success, cached=cached,
+            images=images or None, batch=True,
+        )
+        if not success:
+            logging.warning(f"批处理请求{line.get('custom_id')}失败: {line.get('error') or response.get('status_code')}")
+            return None
+        return content
@@ -0,0 +1,142 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import logging
+import threading
+from typing import Optional
+
+# 设置日志记录
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+# 默认缓存数据库路径
+DEFAULT_CACHE_PATH = os.path.join(os.path.expanduser('~'), '.acp_summary_tool', 'llm_cache.sqlite3')
+
+
+def _canonicalize(value):
+    """把消息中的图片data URL替换为其内容摘要，避免用完整的base64参与键计算和存储"""
+    if isinstance(value, dict):
+        return {key: _canonicalize(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_canonicalize(item) for item in value]
+    if isinstance(value, str) and value.startswith('data:') and ';base64,' in value:
+        header, payload = value.split(',', 1)
+        return f"{header},sha256:{hashlib.sha256(payload.encode('ascii', errors='ignore')).hexdigest()}"
+    return value
+
+
+def messages_digest(messages: list[dict]) -> str:
+    """计算消息列表的规范化摘要"""
+    canonical = json.dumps(_canonicalize(messages), ensure_ascii=False, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+
+class LLMResponseCache:
+    """基于SQLite的LLM响应缓存，按(服务, 模型, 任务, 消息摘要)缓存响应
+
+    支持按过期时间和总大小淘汰，多线程共享同一个连接。
+    """
+    _shared = {}
+    _shared_lock = threading.Lock()
+
+    def __init__(self, db_path: str = DEFAULT_CACHE_PATH, ttl_seconds: float = 7 * 24 * 3600,
+                 max_bytes: int = 256 * 1024 * 1024):
+        self.db_path = db_path
+        # 超过ttl_seconds秒的响应视为过期，为0时永不过期
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        directory = os.path.dirname(db_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS responses ('
+            'key TEXT PRIMARY KEY, provider TEXT, model TEXT, task TEXT, '
+            'response TEXT, size INTEGER, created REAL, accessed REAL)'
+        )
+        self._conn.execute('CREATE INDEX IF NOT EXISTS idx_responses_accessed ON responses (accessed)')
+        self._conn.commit()
+
+    @classmethod
+    def from_config(cls, config: dict) -> Optional['LLMResponseCache']:
+        """根据配置文件中的response_cache项获取共享的缓存实例，未启用时返回None"""
+        cache_config = config.get('response_cache', {})
+        if not cache_config.get('enabled', False):
+            return None
+        db_path = cache_config.get('path', DEFAULT_CACHE_PATH)
+        with cls._shared_lock:
+            cache = cls._shared.get(db_path)
+            if cache is None:
+                try:
+                    cache = cls(
+                        db_path,
+                        ttl_seconds=float(cache_config.get('ttl_hours', 7 * 24)) * 3600,
+                        max_bytes=int(cache_config.get('max_mb', 256)) * 1024 * 1024,
+                    )
+                except sqlite3.Error as e:
+                    logging.error(f"打开LLM响应缓存{db_path}失败: {str(e)}")
+                    return None
+                cls._shared[db_path] = cache
+            return cache
+
+    @staticmethod
+    def make_key(provider: str, model: str, task: str, messages: list[dict]) -> str:
+        """生成缓存键"""
+        raw = f"{provider}|{model}|{task}|{messages_digest(messages)}"
+        return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        """查找未过期的缓存响应"""
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute('SELECT response, created FROM responses WHERE key = ?', (key,)).fetchone()
+            if row is None:
+                return None
+            response, created = row
+            if self.ttl_seconds and now - created > self.ttl_seconds:
+                self._conn.execute('DELETE FROM responses WHERE key = ?', (key,))
+                self._conn.commit()
+                return None
+            self._conn.execute('UPDATE responses SET accessed = ? WHERE key = ?', (now, key))
+            self._conn.commit()
+            return response
+
+    def put(self, key: str, provider: str, model: str, task: str, response: str):
+        """写入响应并按需淘汰"""
+        now = time.time()
+        size = len(response.encode('utf-8'))
+        with self._lock:
+            self._conn.execute(
+                'INSERT OR REPLACE INTO responses (key, provider, model, task, response, size, created, accessed) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                (key, provider, model, task, response, size, now, now),
+            )
+            self._evict(now)
+            self._conn.commit()
+
+    def _evict(self, now: float):
+        """删除过期响应，总大小超过上限时按最近使用时间从旧到新删除"""
+        if self.ttl_seconds:
+            self._conn.execute('DELETE FROM responses WHERE created < ?', (now - self.ttl_seconds,))
+        total = self._conn.execute('SELECT COALESCE(SUM(size), 0) FROM responses').fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        excess = total - self.max_bytes
+        removed = 0
+        keys = []
+        for key, size in self._conn.execute('SELECT key, size FROM responses ORDER BY accessed'):
+            if removed >= excess:
+                break
+            keys.append((key,))
+            removed += size
+        self._conn.executemany('DELETE FROM responses WHERE key = ?', keys)
+        logging.info(f"LLM响应缓存超出上限，淘汰了{len(keys)}条响应")
+
+    def clear(self):
+        """清空缓存"""
+        with self._lock:
+            self._conn.execute('DELETE FROM responses')
+            self._conn.commit()
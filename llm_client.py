@@ -1,8 +1,23 @@
 import os
 import json
+import time
+import asyncio
 import logging
+import threading
+import concurrent.futures
 from abc import ABC, abstractmethod
-from openai import OpenAI
+from contextlib import contextmanager, asynccontextmanager
+from typing import Callable, Iterator
+import httpx
+from openai import OpenAI, AsyncOpenAI, DefaultHttpxClient, DefaultAsyncHttpxClient
+
+from llm_cache import LLMResponseCache
+from llm_retry import RetryPolicy, RetryStats, classify_error
+from llm_concurrency import AIMDConcurrencyController
+from llm_ratelimit import ProviderRateLimiter, estimate_text_tokens
+from llm_stream import ThinkStripper, StreamStats
+from llm_hedge import HedgePolicy, HedgeStats, RequestDispatch, AsyncRequestDispatch, hedge_executor
+from llm_metrics import RunMetrics, usage_breakdown
 
 # 设置日志记录
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -21,6 +36,17 @@ def load_config():
     else:
         return {}
 
+def count_images(messages: list[dict]) -> int:
+    """统计消息中的图片数"""
+    return sum(1 for message in messages if isinstance(message.get('content'), list)
+               for part in message['content'] if part.get('type') == 'image_url')
+
+
+def usage_tokens(response):
+    """返回响应中服务端统计的总token数，服务端未返回用量时返回None"""
+    usage = getattr(response, 'usage', None)
+    return getattr(usage, 'total_tokens', None) if usage is not None else None
+
 # 客户端注册中心
 class LLMClientRegistry:
     """LLM客户端注册中心，用于管理和获取不同类型的LLM客户端"""
@@ -47,7 +73,7 @@ class LLMClientRegistry:
             raise ValueError(f"不支持的客户端类型: {client_type}")
             
         # 对于本地大模型客户端，需要传递额外的配置参数
-        if client_type == 'local_llm' and config:
+        if config and getattr(cls._clients[client_type], 'accepts_config', False):
             return cls._clients[client_type](api_key, config)
         
         # 对于其他客户端，只传递api_key
@@ -58,29 +84,423 @@ class LLMClientRegistry:
         """获取所有支持的客户端类型"""
         return list(cls._clients.keys())
 
+class LLMHttpClientPool:
+    """长连接HTTP客户端池，按(base_url, api_key, task)复用OpenAI客户端
+
+    同一进程内的所有线程共享客户端，避免每次请求重新建立TCP/TLS连接。
+    """
+    _clients = {}
+    _stats = {}
+    _lock = threading.Lock()
+    # 连接数上限，应与流水线的并发数匹配
+    max_connections = 32
+    max_keepalive_connections = 32
+
+    @classmethod
+    def configure(cls, max_connections: int = None, max_keepalive_connections: int = None):
+        """设置连接数上限，只对之后新建的客户端生效"""
+        with cls._lock:
+            if max_connections is not None:
+                cls.max_connections = max_connections
+            if max_keepalive_connections is not None:
+                cls.max_keepalive_connections = max_keepalive_connections
+
+    @classmethod
+    def get_client(cls, base_url: str, api_key: str, task: str = 'llm') -> OpenAI:
+        """获取共享的OpenAI客户端，不存在时创建"""
+        key = (base_url, api_key, task)
+        stats_key = f"{task}@{base_url}"
+        with cls._lock:
+            client = cls._clients.get(key)
+            stats = cls._stats.setdefault(stats_key, {'created': 0, 'reused': 0})
+            if client is not None:
+                stats['reused'] += 1
+                return client
+            http_client = DefaultHttpxClient(limits=httpx.Limits(
+                max_connections=cls.max_connections,
+                max_keepalive_connections=cls.max_keepalive_connections,
+            ))
+            # 重试由LLMClient的重试策略统一负责，关闭SDK内置的重试
+            client = OpenAI(api_key=api_key, base_url=base_url, http_client=http_client, max_retries=0)
+            cls._clients[key] = client
+            stats['created'] += 1
+            return client
+
+    @classmethod
+    def stats(cls) -> dict:
+        """返回每个(task, base_url)的客户端创建和复用次数"""
+        with cls._lock:
+            return {key: dict(value) for key, value in cls._stats.items()}
+
+    @classmethod
+    def reset_stats(cls):
+        with cls._lock:
+            cls._stats.clear()
+
+    @classmethod
+    def close_all(cls):
+        """关闭所有客户端并释放连接"""
+        with cls._lock:
+            clients = list(cls._clients.values())
+            cls._clients.clear()
+        for client in clients:
+            try:
+                client.close()
+            except Exception as e:
+                logging.error(f"关闭LLM客户端失败: {str(e)}")
+
+
 class LLMClient(ABC):
     """LLM客户端抽象基类，定义与大语言模型API通信的接口"""
+    # 不同任务使用的基础URL，未配置的任务使用self.url
+    base_urls: dict = {}
+    # 服务名，与注册中心中的类型一致，用于读取按服务区分的配置
+    provider_name = 'llm'
+    # 服务的默认重试参数，可被配置文件中的retry项覆盖
+    retry_defaults: dict = {}
+    # 服务的默认自适应并发参数，可被配置文件中的concurrency项覆盖
+    concurrency_defaults: dict = {}
 
     def __init__(self, models: dict, url: str, api_key: str) -> None:
         self.models = models
         self.url: str = url
-        self.client = OpenAI(api_key=api_key, base_url=url)
+        self.api_key = api_key
+        config = load_config()
+        # 响应缓存，未启用时为None
+        self.response_cache = LLMResponseCache.from_config(config)
+        self.retry_policy = RetryPolicy.from_config(config, self.provider_name, self.retry_defaults)
+        # 请求对冲策略，未启用时为None
+        self.hedge_policy = HedgePolicy.from_config(config, self.provider_name)
+        self._hedge_client = None
+        self._config = config
+
+    @property
+    def client(self) -> OpenAI:
+        """默认任务使用的共享客户端"""
+        return self.get_client('llm')
+
+    def get_client(self, task: str = 'llm') -> OpenAI:
+        """从连接池获取指定任务使用的共享客户端"""
+        return LLMHttpClientPool.get_client(self.base_urls.get(task, self.url), self.api_key, task)
+
+    def cache_key(self, messages: list[dict], task: str) -> str:
+        """生成响应缓存键，由服务、模型、任务和消息摘要决定"""
+        provider = f"{type(self).__name__}@{self.base_urls.get(task, self.url)}"
+        return LLMResponseCache.make_key(provider, self.models[task], task, messages)
+
+    def rate_limiter(self, task: str = 'llm'):
+        """获取服务和任务共享的RPM/TPM限流器，未配置配额时返回None"""
+        return ProviderRateLimiter.for_provider(self._config, self.provider_name, task)
+
+    def concurrency_controller(self, task: str = 'llm'):
+        """获取服务和任务共享的自适应并发控制器，未启用时返回None"""
+        return AIMDConcurrencyController.for_provider(self._config, self.provider_name, task,
+                                                      self.concurrency_defaults, self.concurrency_scope(task))
 
-    def get_response(self, messages: list[dict[str, str]], task='llm', max_retry=3) -> str:
-        """发送消息给LLM并获取响应"""
-        for _ in range(max_retry):
+    def concurrency_scope(self, task: str = 'llm') -> str:
+        """共享并发控制器的范围，同一范围内的请求由同一个控制器调节"""
+        return self.provider_name
+
+    def service_types(self) -> list[str]:
+        """客户端使用的服务类型，组合客户端返回各服务的类型，用于查找按服务类型区分的能力限制"""
+        return [self.provider_name]
+
+    def concurrency_ceiling(self, task: str = 'llm', default: int = 8) -> int:
+        """任务可以同时进行的最大请求数，用于确定线程池和连接池的大小"""
+        controller = self.concurrency_controller(task)
+        return controller.max_limit if controller is not None else default
+
+    def concurrency_limit(self, task: str = 'llm', default: int = 8) -> int:
+        """任务当前允许同时进行的请求数，启用自适应并发时随控制器调整"""
+        controller = self.concurrency_controller(task)
+        return int(controller.limit) if controller is not None else default
+
+    @contextmanager
+    def concurrency_slot(self, task: str):
+        """占用一个并发名额执行请求，并把请求的延迟或错误类型反馈给控制器"""
+        controller = self.concurrency_controller(task)
+        if controller is None:
+            yield
+            return
+        token = controller.acquire()
+        started = time.monotonic()
+        try:
+            yield
+        except Exception as e:
+            controller.release(token, error_class=classify_error(e))
+            raise
+        except BaseException:
+            # 被取消或中断的请求只归还名额，不影响并发上限
+            controller.release(token)
+            raise
+        controller.release(token, latency=time.monotonic() - started)
+
+    def retry_delay(self, attempt: int, max_attempts: int, task: str, error: Exception):
+        """记录第attempt次（从0开始）请求的失败，返回重试前的等待秒数，不应重试时返回None"""
+        error_class = classify_error(error)
+        logging.error(f"Failed to get response from {task} model ({error_class}): {str(error)}")
+        if attempt + 1 >= max_attempts or not self.retry_policy.should_retry(error_class):
+            RetryStats.record(self.provider_name, task, error_class, retried=False)
+            return None
+        delay = self.retry_policy.delay(attempt, error)
+        RetryStats.record(self.provider_name, task, error_class, delay)
+        return delay
+
+    def get_response(self, messages: list[dict[str, str]], task='llm', max_retry=None, use_cache=True,
+                     hedge=True) -> str:
+        """发送消息给LLM并获取响应
+
+        启用响应缓存时，相同的请求直接返回缓存的响应；use_cache为False时跳过缓存。
+        失败时按重试策略退避重试，max_retry为包括首次请求在内的最大尝试次数，默认由重试策略决定。
+        启用请求对冲时，耗时超过历史延迟分位数的请求会再发出一个相同的请求，先返回者胜出；hedge为False时不对冲。
+        """
+        policy = self.hedge_policy
+        if not hedge or policy is None or not policy.applies_to(task):
+            return self._get_response(messages, task, max_retry, use_cache)
+        return self._hedged_response(messages, task, max_retry, use_cache)
+
+    def hedge_client(self) -> 'LLMClient':
+        """对冲请求使用的客户端，未指定其他服务时使用自身"""
+        provider = self.hedge_policy.provider
+        if not provider or provider == self.provider_name:
+            return self
+        if self._hedge_client is None:
+            self._hedge_client = LLMClientRegistry.get_client(provider)
+        return self._hedge_client
+
+    def _hedged_response(self, messages: list[dict], task: str, max_retry, use_cache) -> str:
+        """发送可对冲的请求
+
+        同步请求无法中断，落败的请求在后台线程中完成后丢弃结果，其耗时用于统计对冲节省的时间。
+        对冲计时从主请求取得配额和并发名额、实际发出时开始，主请求仍在本地等待时不对冲。
+        """
+        policy = self.hedge_policy
+        policy.count_request(task)
+        HedgeStats.record_request(self.provider_name, task)
+        delay = policy.delay(task)
+        started = time.monotonic()
+        dispatch = RequestDispatch()
+        if delay is None:
+            response = self._get_response(messages, task, max_retry, use_cache, dispatch)
+            if dispatch.latency() is not None:
+                policy.record(task, dispatch.latency())
+            return response
+
+        def record_primary(future):
+            latency = dispatch.latency()
+            dispatch.mark_finished()
+            if not future.cancelled() and future.exception() is None and latency is not None:
+                policy.record(task, latency)
+
+        executor = hedge_executor()
+        primary = executor.submit(self._get_response, messages, task, max_retry, use_cache, dispatch)
+        primary.add_done_callback(record_primary)
+        while True:
+            dispatch.wait_sent()
+            if primary.done():
+                return primary.result()
+            try:
+                return primary.result(timeout=max(0.0, delay - dispatch.latency()))
+            except concurrent.futures.TimeoutError:
+                pass
+            # 超时时主请求已转入重试退避的，等它再次发出后重新计时
+            if dispatch.in_flight:
+                break
+        if not policy.try_hedge(task):
+            return primary.result()
+        logging.info(f"{task}请求{delay:.1f}秒未返回，发出对冲请求")
+        hedged = executor.submit(self.hedge_client().get_response, messages, task, max_retry, use_cache,
+                                 hedge=False)
+        first_error = None
+        for future in concurrent.futures.as_completed([primary, hedged]):
+            if future.exception() is not None:
+                first_error = first_error or future.exception()
+                continue
+            hedge_won = future is hedged
+            HedgeStats.record_hedge(self.provider_name, task, hedge_won)
+            if hedge_won:
+                won_at = time.monotonic() - started
+                primary.add_done_callback(lambda f: HedgeStats.record_saving(
+                    self.provider_name, task, time.monotonic() - started - won_at))
+            return future.result()
+        raise first_error
+
+    def _get_response(self, messages: list[dict[str, str]], task='llm', max_retry=None, use_cache=True,
+                      dispatch: RequestDispatch = None) -> str:
+        """发送单个请求，包括缓存、限流、并发控制和重试，dispatch记录请求何时实际发出"""
+        started = time.monotonic()
+        cache_key = None
+        if use_cache and self.response_cache is not None:
+            cache_key = self.cache_key(messages, task)
+            cached = self.response_cache.get(cache_key)
+            if cached is not None:
+                self.record_call(task, messages, started, content=cached, cached=True)
+                return cached
+        client = self.get_client(task)
+        limiter = self.rate_limiter(task)
+        estimated_tokens = limiter.estimate(messages) if limiter is not None else 0
+        max_attempts = max(1, max_retry or self.retry_policy.max_attempts)
+        last_error = None
+        attempt = 0
+        # 在本地等待配额、并发名额和重试退避的总秒数，不计入请求耗时
+        waited = 0.0
+        for attempt in range(max_attempts):
             try:
-                response = self.client.chat.completions.create(
+                # 每次尝试都计入服务端的配额，先在本地等待配额再占用并发名额
+                wait_started = time.monotonic()
+                if limiter is not None:
+                    limiter.acquire(estimated_tokens)
+                with self.concurrency_slot(task):
+                    waited += time.monotonic() - wait_started
+                    if dispatch is not None:
+                        dispatch.mark_sent()
+                    response = client.chat.completions.create(
+                        model=self.models[task],
+                        messages=messages,
+                        stream=False,
+                        timeout=1000,  # 设置超时时间为1000秒
+                    )
+                if limiter is not None:
+                    limiter.reconcile(estimated_tokens, usage_tokens(response))
+                content = response.choices[0].message.content
+                if cache_key is not None and content is not None:
+                    self.response_cache.put(cache_key, type(self).__name__, self.models[task], task, content)
+                self.record_call(task, messages, started, usage=response.usage, content=content, retries=attempt,
+                                 waited=waited)
+                return content
+            except Exception as e:
+                last_error = e
+                if dispatch is not None:
+                    dispatch.mark_waiting()
+                delay = self.retry_delay(attempt, max_attempts, task, e)
+                if delay is None:
+                    break
+                time.sleep(delay)
+                waited += delay
+        self.record_call(task, messages, started, retries=attempt, success=False, waited=waited)
+        raise RuntimeError(f"Failed to get response from {task} model.") from last_error
+
+    def record_call(self, task: str, messages: list[dict], started: float, usage=None, content: str = None,
+                    retries: int = 0, success: bool = True, cached: bool = False, stream: bool = False,
+                    ttft: float = None, reasoning_text: str = '', waited: float = 0.0):
+        """把一次调用记录到当前运行的统计中
+
+        waited为在本地等待配额、并发名额和重试退避的秒数，单独记录，请求耗时为总耗时减去waited。
+        服务端没有返回推理token数时，按</think>之前的文本和单独返回的思考过程估计。
+        """
+        prompt_tokens, completion_tokens, reasoning_tokens = usage_breakdown(usage)
+        if reasoning_tokens is None and success and not cached:
+            if content and '</think>' in content:
+                reasoning_text += content.split('</think>')[0]
+            reasoning_tokens = estimate_text_tokens(reasoning_text) if reasoning_text else None
+        RunMetrics.current().record(
+            self.provider_name, self.models[task], task, time.monotonic() - started - waited, wait=waited,
+            prompt_tokens=prompt_tokens, completion_tokens=completion_tokens, reasoning_tokens=reasoning_tokens,
+            retries=retries, success=success, cached=cached, stream=stream, ttft=ttft,
+            images=count_images(messages) or None,
+        )
+
+    def stream_response(self, messages: list[dict[str, str]], task='llm', max_retry=None, use_cache=True,
+                        on_reset: Callable[[], None] = None) -> Iterator[str]:
+        """以流式方式发送消息给LLM，逐段返回去除思考过程后的正文
+
+        建立请求失败时按重试策略重试，开始输出后出错直接抛出异常。
+        模型输出的思考过程没有开始标签、直到</think>才能识别时调用on_reset，调用方应丢弃已经显示的内容。
+        完整的原始响应与get_response共用响应缓存。
+        """
+        stripper = ThinkStripper()
+        call_started = time.monotonic()
+        cache_key = None
+        if use_cache and self.response_cache is not None:
+            cache_key = self.cache_key(messages, task)
+            cached = self.response_cache.get(cache_key)
+            if cached is not None:
+                self.record_call(task, messages, call_started, content=cached, cached=True, stream=True)
+                visible, _ = stripper.feed(cached)
+                visible += stripper.flush()
+                if visible:
+                    yield visible
+                return
+        client = self.get_client(task)
+        limiter = self.rate_limiter(task)
+        estimated_tokens = limiter.estimate(messages) if limiter is not None else 0
+        max_attempts = max(1, max_retry or self.retry_policy.max_attempts)
+        waited = 0.0
+        for attempt in range(max_attempts):
+            try:
+                wait_started = time.monotonic()
+                if limiter is not None:
+                    limiter.acquire(estimated_tokens)
+                started = time.monotonic()
+                waited += started - wait_started
+                stream = client.chat.completions.create(
                     model=self.models[task],
                     messages=messages,
-                    stream=False,
+                    stream=True,
+                    stream_options={'include_usage': True},
                     timeout=1000,  # 设置超时时间为1000秒
                 )
-                return response.choices[0].message.content
+                break
             except Exception as e:
-                logging.error(f"Failed to get response from LLM: {str(e)}")
-                continue
-        raise RuntimeError("Failed to get response from LLM.")
+                delay = self.retry_delay(attempt, max_attempts, task, e)
+                if delay is None:
+                    self.record_call(task, messages, call_started, retries=attempt, success=False, stream=True,
+                                     waited=waited)
+                    raise RuntimeError(f"Failed to get response from {task} model.") from e
+                time.sleep(delay)
+                waited += delay
+
+        raw_parts = []
+        reasoning_parts = []
+        usage = None
+        first_token = None
+        first_answer = None
+        with stream:
+            for chunk in stream:
+                if getattr(chunk, 'usage', None) is not None:
+                    usage = chunk.usage
+                if not chunk.choices:
+                    continue
+                delta = chunk.choices[0].delta
+                content = delta.content or ''
+                # 部分服务把思考过程放在单独的reasoning_content字段中，不输出，只计入统计
+                reasoning = getattr(delta, 'reasoning_content', None)
+                if reasoning:
+                    reasoning_parts.append(reasoning)
+                if first_token is None and (content or reasoning):
+                    first_token = time.monotonic()
+                if not content:
+                    continue
+                raw_parts.append(content)
+                visible, reset = stripper.feed(content)
+                if reset and on_reset is not None:
+                    on_reset()
+                if visible:
+                    if first_answer is None:
+                        first_answer = time.monotonic()
+                    yield visible
+        tail = stripper.flush()
+        if tail:
+            yield tail
+
+        finished = time.monotonic()
+        raw = ''.join(raw_parts)
+        completion_tokens = usage.completion_tokens if usage is not None else estimate_text_tokens(raw)
+        ttft = first_token - started if first_token is not None else None
+        generation_seconds = finished - first_token if first_token is not None else 0
+        tokens_per_second = completion_tokens / generation_seconds if generation_seconds > 0 else None
+        StreamStats.record(self.provider_name, task, ttft,
+                           first_answer - started if first_answer is not None else None,
+                           tokens_per_second, completion_tokens)
+        if ttft is not None and tokens_per_second is not None:
+            logging.info(f"{task}流式输出: 首token耗时{ttft:.2f}秒，{completion_tokens}个token，"
+                         f"{tokens_per_second:.1f} tokens/s")
+        if limiter is not None:
+            limiter.reconcile(estimated_tokens, usage.total_tokens if usage is not None else None)
+        if cache_key is not None and raw:
+            self.response_cache.put(cache_key, type(self).__name__, self.models[task], task, raw)
+        self.record_call(task, messages, call_started, usage=usage, content=raw, retries=attempt, stream=True,
+                         ttft=ttft, reasoning_text=''.join(reasoning_parts), waited=waited)
 
     @abstractmethod
     def test_connection(self) -> tuple[bool, str]:
@@ -91,6 +511,8 @@ class LLMClient(ABC):
 
 class ArkClient(LLMClient):
     base_url = 'https://ark.cn-beijing.volces.com/api/v3'
+    provider_name = 'ark'
+    concurrency_defaults = {'max_limit': 32}
     models = {
         'llm': 'doubao-1-5-thinking-pro-250415',
         'vlm': 'doubao-vision-pro-32k-241028',
@@ -109,7 +531,8 @@ class ArkClient(LLMClient):
             # 发送测试请求
             response = self.get_response(
                 messages=[{"role": "user", "content": "测试连接"}],
-                task='llm'
+                task='llm',
+                use_cache=False
             )
             return True, "连接成功"
         except Exception as e:
@@ -119,6 +542,10 @@ class ArkClient(LLMClient):
 class SiliconFlowClient(LLMClient):
     """SiliconFlow客户端，继承自LLMClient，专门用于处理DeepSeek平台的请求"""
     base_url = 'https://api.siliconflow.cn/v1'
+    provider_name = 'silicon_flow'
+    # SiliconFlow的限流较严格，退避时间更长
+    retry_defaults = {'base_delay': 2.0}
+    concurrency_defaults = {'initial': 4, 'max_limit': 16}
     models = {
         'llm': 'Pro/deepseek-ai/DeepSeek-R1',
         'vlm': 'Qwen/Qwen2.5-VL-32B-Instruct',
@@ -136,7 +563,8 @@ class SiliconFlowClient(LLMClient):
             # 发送测试请求
             response = self.get_response(
                 messages=[{"role": "user", "content": "测试连接"}],
-                task='llm'
+                task='llm',
+                use_cache=False
             )
             return True, "连接成功"
         except Exception as e:
@@ -145,6 +573,14 @@ class SiliconFlowClient(LLMClient):
 
 class LocalLLMClient(LLMClient):
     """本地大模型客户端，继承自LLMClient，用于处理本地部署的大模型服务"""
+    # 注册中心创建实例时传递额外的配置参数
+    accepts_config = True
+    provider_name = 'local_llm'
+    # 本地服务不存在配额限制，失败多为服务重启等短暂故障，快速重试
+    retry_defaults = {'base_delay': 0.5, 'max_delay': 10.0}
+    # 本地服务的吞吐量取决于部署的硬件，允许增长到较高的并发
+    concurrency_defaults = {'max_limit': 128}
+
     def __init__(self, api_key=None, config=None) -> None:
         # 如果没有提供参数，则从配置文件中加载
         default_config = load_config()
@@ -182,27 +618,10 @@ class LocalLLMClient(LLMClient):
         # 对于基类，我们使用LLM的基础URL
         super().__init__(models, llm_base_url, api_key)
 
-    def get_response(self, messages: list[dict[str, str]], task='llm', max_retry=3) -> str:
-        """发送消息给LLM并获取响应"""
-        # 根据任务类型选择不同的基础URL
+    def concurrency_scope(self, task: str = 'llm') -> str:
+        """不同地址的本地服务负载互不相关，按任务使用的地址分别控制并发"""
         base_url = self.base_urls.get(task, self.url)
-        
-        # 创建对应的客户端
-        client = OpenAI(api_key=self.client.api_key, base_url=base_url)
-        
-        for _ in range(max_retry):
-            try:
-                response = client.chat.completions.create(
-                    model=self.models[task],
-                    messages=messages,
-                    stream=False,
-                    timeout=1000,  # 设置超时时间为1000秒
-                )
-                return response.choices[0].message.content
-            except Exception as e:
-                logging.error(f"Failed to get response from {task} model: {str(e)}")
-                continue
-        raise RuntimeError(f"Failed to get response from {task} model.")
+        return f"{self.provider_name}({base_url.split('//', 1)[-1].split('/', 1)[0]})"
 
     def test_connection(self) -> tuple[bool, str]:
         """测试本地大模型API连接"""
@@ -210,14 +629,271 @@ class LocalLLMClient(LLMClient):
             # 发送测试请求
             response = self.get_response(
                 messages=[{"role": "user", "content": "测试连接"}],
-                task='llm'
+                task='llm',
+                use_cache=False
             )
             return True, "连接成功"
         except Exception as e:
             return False, f"连接失败: {str(e)}"
 
 
+class AsyncLLMClient(ABC):
+    """异步LLM客户端抽象基类，基于AsyncOpenAI，使用信号量限制同时进行的请求数
+
+    模型、地址和密钥沿用对应同步客户端的配置，子类通过sync_client_class指定同步客户端。
+    """
+    sync_client_class = None
+    # 默认最大并发请求数
+    default_max_concurrency = 64
+
+    def __init__(self, api_key=None, config=None, max_concurrency: int = None) -> None:
+        if config is not None and getattr(self.sync_client_class, 'accepts_config', False):
+            sync_client = self.sync_client_class(api_key, config)
+        else:
+            sync_client = self.sync_client_class(api_key)
+        if max_concurrency is None:
+            max_concurrency = load_config().get('async', {}).get('max_concurrency', self.default_max_concurrency)
+        self.sync_client = sync_client
+        self.models = sync_client.models
+        self.url = sync_client.url
+        self.base_urls = sync_client.base_urls
+        self.api_key = sync_client.api_key
+        self.response_cache = sync_client.response_cache
+        self.provider_name = sync_client.provider_name
+        self.service_types = sync_client.service_types
+        self.retry_policy = sync_client.retry_policy
+        self.concurrency_controller = sync_client.concurrency_controller
+        self.rate_limiter = sync_client.rate_limiter
+        self.concurrency_ceiling = sync_client.concurrency_ceiling
+        self.hedge_policy = sync_client.hedge_policy
+        self._hedge_client = None
+        self.max_concurrency = max_concurrency
+        # 异步客户端和信号量都绑定事件循环，按(任务, 事件循环)分别创建
+        self._clients = {}
+        self._semaphores = {}
+
+    def get_client(self, task: str = 'llm') -> AsyncOpenAI:
+        """获取当前事件循环中指定任务使用的异步客户端"""
+        key = (task, id(asyncio.get_running_loop()))
+        client = self._clients.get(key)
+        if client is None:
+            http_client = DefaultAsyncHttpxClient(limits=httpx.Limits(
+                max_connections=self.max_concurrency,
+                max_keepalive_connections=self.max_concurrency,
+            ))
+            client = AsyncOpenAI(api_key=self.api_key, base_url=self.base_urls.get(task, self.url),
+                                 http_client=http_client, max_retries=0)
+            self._clients[key] = client
+        return client
+
+    def _semaphore(self) -> asyncio.Semaphore:
+        """获取当前事件循环的并发信号量"""
+        key = id(asyncio.get_running_loop())
+        semaphore = self._semaphores.get(key)
+        if semaphore is None:
+            semaphore = asyncio.Semaphore(self.max_concurrency)
+            self._semaphores[key] = semaphore
+        return semaphore
+
+    def concurrency_limit(self, task: str = 'llm') -> int:
+        """任务当前允许同时进行的请求数，不超过客户端信号量的大小"""
+        return min(self.max_concurrency, self.sync_client.concurrency_limit(task, self.max_concurrency))
+
+    @asynccontextmanager
+    async def concurrency_slot(self, task: str):
+        """concurrency_slot的异步版本，与同步客户端共享同一个控制器"""
+        controller = self.concurrency_controller(task)
+        if controller is None:
+            yield
+            return
+        token = await controller.acquire_async()
+        started = time.monotonic()
+        try:
+            yield
+        except Exception as e:
+            controller.release(token, error_class=classify_error(e))
+            raise
+        except BaseException:
+            # 被取消或中断的请求只归还名额，不影响并发上限
+            controller.release(token)
+            raise
+        controller.release(token, latency=time.monotonic() - started)
+
+    async def get_response(self, messages: list[dict[str, str]], task='llm', max_retry=None, use_cache=True,
+                           hedge=True) -> str:
+        """发送消息给LLM并获取响应，与同步客户端共享响应缓存、重试策略和对冲策略
+
+        启用请求对冲时，先返回的请求胜出，落败的请求被取消。对冲计时从主请求实际发出时开始，本地等待不计时。
+        """
+        policy = self.hedge_policy
+        if not hedge or policy is None or not policy.applies_to(task):
+            return await self._get_response(messages, task, max_retry, use_cache)
+        policy.count_request(task)
+        HedgeStats.record_request(self.provider_name, task)
+        delay = policy.delay(task)
+        dispatch = AsyncRequestDispatch()
+        if delay is None:
+            response = await self._get_response(messages, task, max_retry, use_cache, dispatch)
+            if dispatch.latency() is not None:
+                policy.record(task, dispatch.latency())
+            return response
+        primary = asyncio.ensure_future(self._get_response(messages, task, max_retry, use_cache, dispatch))
+        primary.add_done_callback(lambda _: dispatch.mark_finished())
+        slow = False
+        while not primary.done():
+            await dispatch.wait_sent_async()
+            if primary.done():
+                break
+            await asyncio.wait({primary}, timeout=max(0.0, delay - dispatch.latency()))
+            # 超时时主请求已转入重试退避的，等它再次发出后重新计时
+            if not primary.done() and dispatch.in_flight:
+                slow = True
+                break
+        if not slow or not policy.try_hedge(task):
+            latency = dispatch.latency()
+            response = await primary
+            if latency is not None:
+                policy.record(task, latency)
+            return response
+        logging.info(f"{task}请求{delay:.1f}秒未返回，发出对冲请求")
+        hedged = asyncio.ensure_future(self.hedge_client().get_response(messages, task, max_retry, use_cache,
+                                                                       hedge=False))
+        pending = {primary, hedged}
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                # 同时完成时主请求优先
+                for future in (primary, hedged):
+                    if future in done and future.exception() is None:
+                        # 主请求发出后经过的时间，与延迟样本的口径一致
+                        elapsed = dispatch.latency()
+                        hedge_won = future is hedged
+                        HedgeStats.record_hedge(self.provider_name, task, hedge_won)
+                        if hedge_won:
+                            # 主请求被取消，无法得知其实际耗时，按历史上同样慢的请求估计节省的时间
+                            HedgeStats.record_saving(self.provider_name, task,
+                                                     policy.expected_remaining(task, elapsed))
+                        policy.record(task, elapsed)
+                        return future.result()
+            raise primary.exception()
+        finally:
+            for future in (primary, hedged):
+                if not future.done():
+                    future.cancel()
+
+    def hedge_client(self) -> 'AsyncLLMClient':
+        """对冲请求使用的异步客户端，未指定其他服务时使用自身"""
+        provider = self.hedge_policy.provider
+        if not provider or provider == self.provider_name:
+            return self
+        if self._hedge_client is None:
+            self._hedge_client = LLMClientRegistry.get_client(f"{provider}_async")
+        return self._hedge_client
+
+    async def _get_response(self, messages: list[dict[str, str]], task='llm', max_retry=None, use_cache=True,
+                            dispatch: AsyncRequestDispatch = None) -> str:
+        """发送单个请求，退避等待期间释放信号量，不占用并发名额，dispatch记录请求何时实际发出"""
+        started = time.monotonic()
+        cache_key = None
+        if use_cache and self.response_cache is not None:
+            cache_key = self.sync_client.cache_key(messages, task)
+            cached = await asyncio.to_thread(self.response_cache.get, cache_key)
+            if cached is not None:
+                self.sync_client.record_call(task, messages, started, content=cached, cached=True)
+                return cached
+        client = self.get_client(task)
+        limiter = self.rate_limiter(task)
+        estimated_tokens = limiter.estimate(messages) if limiter is not None else 0
+        max_attempts = max(1, max_retry or self.retry_policy.max_attempts)
+        last_error = None
+        attempt = 0
+        # 在本地等待配额、并发名额和重试退避的总秒数，不计入请求耗时
+        waited = 0.0
+        for attempt in range(max_attempts):
+            try:
+                wait_started = time.monotonic()
+                if limiter is not None:
+                    await limiter.acquire_async(estimated_tokens)
+                async with self._semaphore(), self.concurrency_slot(task):
+                    waited += time.monotonic() - wait_started
+                    if dispatch is not None:
+                        dispatch.mark_sent()
+                    response = await client.chat.completions.create(
+                        model=self.models[task],
+                        messages=messages,
+                        stream=False,
+                        timeout=1000,  # 设置超时时间为1000秒
+                    )
+                if limiter is not None:
+                    limiter.reconcile(estimated_tokens, usage_tokens(response))
+                content = response.choices[0].message.content
+                if cache_key is not None and content is not None:
+                    await asyncio.to_thread(self.response_cache.put, cache_key, type(self.sync_client).__name__,
+                                            self.models[task], task, content)
+                self.sync_client.record_call(task, messages, started, usage=response.usage, content=content,
+                                             retries=attempt, waited=waited)
+                return content
+            except Exception as e:
+                last_error = e
+                if dispatch is not None:
+                    dispatch.mark_waiting()
+                delay = self.sync_client.retry_delay(attempt, max_attempts, task, e)
+                if delay is None:
+                    break
+                await asyncio.sleep(delay)
+                waited += delay
+        self.sync_client.record_call(task, messages, started, retries=attempt, success=False, waited=waited)
+        raise RuntimeError(f"Failed to get response from {task} model.") from last_error
+
+    async def aclose(self):
+        """关闭当前事件循环中创建的客户端"""
+        loop_id = id(asyncio.get_running_loop())
+        for key in [key for key in self._clients if key[1] == loop_id]:
+            await self._clients.pop(key).close()
+        self._semaphores.pop(loop_id, None)
+        if self._hedge_client is not None:
+            await self._hedge_client.aclose()
+
+    async def test_connection(self) -> tuple[bool, str]:
+        """测试API连接
+        返回: (是否成功, 消息)
+        """
+        try:
+            await self.get_response(messages=[{"role": "user", "content": "测试连接"}], task='llm', use_cache=False)
+            return True, "连接成功"
+        except Exception as e:
+            return False, f"连接失败: {str(e)}"
+
+
+class AsyncArkClient(AsyncLLMClient):
+    """火山引擎平台的异步客户端"""
+    sync_client_class = ArkClient
+
+
+class AsyncSiliconFlowClient(AsyncLLMClient):
+    """SiliconFlow平台的异步客户端"""
+    sync_client_class = SiliconFlowClient
+
+
+class AsyncLocalLLMClient(AsyncLLMClient):
+    """本地大模型服务的异步客户端"""
+    sync_client_class = LocalLLMClient
+    accepts_config = True
+
+
 # 注册客户端
 LLMClientRegistry.register_client('ark', ArkClient)
 LLMClientRegistry.register_client('silicon_flow', SiliconFlowClient)
-LLMClientRegistry.register_client('local_llm', LocalLLMClient)
\ No newline at end of file
+LLMClientRegistry.register_client('local_llm', LocalLLMClient)
+# 异步客户端以同步客户端类型加上_async后缀注册
+LLMClientRegistry.register_client('ark_async', AsyncArkClient)
+LLMClientRegistry.register_client('silicon_flow_async', AsyncSiliconFlowClient)
+LLMClientRegistry.register_client('local_llm_async', AsyncLocalLLMClient)
+
+# 图形界面在同一进程中多次运行，每次运行开始时清空进程内的统计
+RunMetrics.register_reset(RetryStats.reset)
+RunMetrics.register_reset(HedgeStats.reset)
+RunMetrics.register_reset(StreamStats.reset)
+RunMetrics.register_reset(LLMHttpClientPool.reset_stats)
+RunMetrics.register_reset(ProviderRateLimiter.reset_all_stats)
+RunMetrics.register_reset(AIMDConcurrencyController.reset_all_trajectories)
\ No newline at end of file
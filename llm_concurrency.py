@@ -0,0 +1,228 @@
+import time
+import asyncio
+import logging
+import threading
+import collections
+from typing import Callable, Optional
+
+from llm_retry import RATE_LIMIT, TIMEOUT, CONNECTION, SERVER_ERROR
+
+# 设置日志记录
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+# 表示服务端过载的错误类型，出现时降低并发数
+OVERLOAD_ERRORS = (RATE_LIMIT, TIMEOUT, CONNECTION, SERVER_ERROR)
+
+
+class AIMDConcurrencyController:
+    """加性增、乘性减（AIMD）的自适应并发控制器
+
+    每完成与当前并发数相同数量的健康请求，并发上限加increase；遇到限流、超时、服务端错误
+    或延迟突增时，并发上限乘以decrease。同一服务的所有线程和协程共享一个控制器。
+    """
+    _controllers = {}
+    _registry_lock = threading.Lock()
+
+    def __init__(self, name: str, initial: int = 8, min_limit: int = 1, max_limit: int = 64,
+                 increase: float = 1.0, decrease: float = 0.5, latency_factor: float = 3.0, min_samples: int = 5):
+        self.name = name
+        self.min_limit = min_limit
+        self.max_limit = max(max_limit, min_limit)
+        self.limit = float(min(max(initial, min_limit), self.max_limit))
+        self.increase = increase
+        self.decrease = decrease
+        # 延迟超过平均延迟latency_factor倍时视为延迟突增，至少观察min_samples个请求后才判断
+        self.latency_factor = latency_factor
+        self.min_samples = min_samples
+        self.in_flight = 0
+        self._cond = threading.Condition()
+        # 每次降低并发数后递增，降低之前发出的请求再失败不会重复降低
+        self._epoch = 0
+        self._successes = 0
+        self._latency = None
+        self._samples = 0
+        self._async_waiters = collections.deque()
+        self._started = time.monotonic()
+        # 并发上限的变化轨迹：(距创建的秒数, 并发上限, 原因)
+        self.trajectory = [(0.0, int(self.limit), 'start')]
+
+    @classmethod
+    def for_provider(cls, config: dict, provider: str, task: str, defaults: dict = None,
+                     scope: str = None) -> Optional['AIMDConcurrencyController']:
+        """获取服务和任务共享的控制器，不存在时根据配置文件中的concurrency项创建，未启用时返回None
+
+        scope区分同一服务的不同部署（例如多台本地大模型服务器），默认与服务名相同。
+        concurrency项中的数值为全部服务的默认值，以服务名为键的子项覆盖对应服务的设置，例如
+        {"concurrency": {"initial": 8, "silicon_flow": {"max_limit": 16}}}
+        """
+        concurrency_config = config.get('concurrency', {})
+        if not concurrency_config.get('enabled', True):
+            return None
+        name = f"{task}@{scope or provider}"
+        with cls._registry_lock:
+            controller = cls._controllers.get(name)
+            if controller is None:
+                settings = dict(defaults or {})
+                settings.update({key: value for key, value in concurrency_config.items()
+                                 if not isinstance(value, dict)})
+                settings.update(concurrency_config.get(provider, {}))
+                controller = cls(
+                    name,
+                    initial=int(settings.get('initial', 8)),
+                    min_limit=int(settings.get('min_limit', 1)),
+                    max_limit=int(settings.get('max_limit', 64)),
+                    increase=float(settings.get('increase', 1.0)),
+                    decrease=float(settings.get('decrease', 0.5)),
+                    latency_factor=float(settings.get('latency_factor', 3.0)),
+                )
+                cls._controllers[name] = controller
+            return controller
+
+    @classmethod
+    def all_controllers(cls) -> list['AIMDConcurrencyController']:
+        with cls._registry_lock:
+            return list(cls._controllers.values())
+
+    @classmethod
+    def reset_all_trajectories(cls):
+        """从当前并发上限重新开始记录所有控制器的变化轨迹，已经学到的并发上限保持不变"""
+        for controller in cls.all_controllers():
+            controller.reset_trajectory()
+
+    def reset_trajectory(self):
+        with self._cond:
+            self._started = time.monotonic()
+            self.trajectory = [(0.0, int(self.limit), 'start')]
+
+    def acquire(self) -> int:
+        """阻塞直到有空闲的并发名额，返回调用release时需要传回的令牌"""
+        with self._cond:
+            while self.in_flight >= int(self.limit):
+                self._cond.wait()
+            self.in_flight += 1
+            return self._epoch
+
+    async def acquire_async(self) -> int:
+        """acquire的异步版本，等待期间不阻塞事件循环"""
+        loop = asyncio.get_running_loop()
+        while True:
+            with self._cond:
+                if self.in_flight < int(self.limit):
+                    self.in_flight += 1
+                    return self._epoch
+                waiter = loop.create_future()
+                self._async_waiters.append((loop, waiter))
+            try:
+                await waiter
+            except asyncio.CancelledError:
+                # 已被唤醒的协程取消时，把名额让给下一个等待者
+                with self._cond:
+                    self._notify()
+                raise
+
+    def release(self, token: int, latency: float = None, error_class: str = None):
+        """归还并发名额，并根据请求结果调整并发上限
+
+        Args:
+            token: acquire返回的令牌
+            latency: 成功请求的耗时（秒）
+            error_class: 失败请求的错误类型，成功时为None
+        """
+        with self._cond:
+            self.in_flight -= 1
+            if error_class in OVERLOAD_ERRORS:
+                self._decrease(token, error_class)
+            elif error_class is None and latency is not None:
+                self._on_success(token, latency)
+            self._notify()
+
+    def _on_success(self, token: int, latency: float):
+        spike = (self._samples >= self.min_samples and self._latency
+                 and latency > self.latency_factor * self._latency)
+        # 平均延迟使用指数滑动平均，突增的样本按上限计入，避免单个慢请求拉高基线
+        sample = min(latency, self.latency_factor * self._latency) if spike else latency
+        self._latency = sample if self._latency is None else 0.9 * self._latency + 0.1 * sample
+        self._samples += 1
+        if spike:
+            self._decrease(token, 'latency')
+            return
+        self._successes += 1
+        if self._successes >= int(self.limit) and self.limit < self.max_limit:
+            self._successes = 0
+            self.limit = min(self.max_limit, self.limit + self.increase)
+            self._record('increase')
+
+    def _decrease(self, token: int, reason: str):
+        if token != self._epoch:
+            return
+        self._epoch += 1
+        self._successes = 0
+        old_limit = int(self.limit)
+        self.limit = max(self.min_limit, self.limit * self.decrease)
+        if int(self.limit) != old_limit:
+            self._record(reason)
+
+    def _record(self, reason: str):
+        elapsed = round(time.monotonic() - self._started, 3)
+        self.trajectory.append((elapsed, int(self.limit), reason))
+        logging.info(f"{self.name}并发上限调整为{int(self.limit)}（{reason}）")
+
+    def _notify(self):
+        """唤醒等待中的线程，并按空闲名额数唤醒异步等待者"""
+        self._cond.notify_all()
+        available = int(self.limit) - self.in_flight
+        while available > 0 and self._async_waiters:
+            loop, waiter = self._async_waiters.popleft()
+            if waiter.done():
+                continue
+            loop.call_soon_threadsafe(_wake, waiter)
+            available -= 1
+
+    def summary(self) -> dict:
+        """返回并发上限的变化情况"""
+        with self._cond:
+            limits = [limit for _, limit, _ in self.trajectory]
+            return {
+                'current': int(self.limit),
+                'peak': max(limits),
+                'changes': len(self.trajectory) - 1,
+                'avg_latency': round(self._latency, 3) if self._latency is not None else None,
+                'trajectory': list(self.trajectory),
+            }
+
+    def log_trajectory(self):
+        """输出并发上限的变化轨迹"""
+        summary = self.summary()
+        points = ' -> '.join(f"{limit}@{elapsed:.0f}s" for elapsed, limit, _ in summary['trajectory'])
+        logging.info(f"{self.name}并发轨迹（峰值{summary['peak']}，调整{summary['changes']}次）: {points}")
+
+
+class AdmissionGate:
+    """按控制器当前的并发上限放行任务，未放行的任务不生成请求内容
+
+    提取任务在占用并发名额之前就要读取并编码图片。如果按并发上限的最大值一次提交全部任务，
+    所有线程都会提前生成请求内容并在名额前排队，占用大量内存。调用方只在try_enter成功时提交任务，
+    任务结束时调用leave，同时进行的任务数不超过客户端当前的并发上限。
+    """
+    def __init__(self, capacity: Callable[[], int]):
+        # 返回当前并发上限的函数，例如客户端的concurrency_limit
+        self.capacity = lambda: max(1, capacity())
+        self.active = 0
+        self._lock = threading.Lock()
+
+    def try_enter(self) -> bool:
+        """有空闲名额时占用一个并返回True"""
+        with self._lock:
+            if self.active >= self.capacity():
+                return False
+            self.active += 1
+            return True
+
+    def leave(self):
+        with self._lock:
+            self.active -= 1
+
+
+def _wake(waiter: asyncio.Future):
+    if not waiter.done():
+        waiter.set_result(None)
@@ -0,0 +1,212 @@
+import time
+import asyncio
+import logging
+import threading
+import collections
+import concurrent.futures
+from typing import Optional
+
+# 设置日志记录
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def hedge_executor(max_workers: int = 256) -> concurrent.futures.ThreadPoolExecutor:
+    """对冲请求使用的共享线程池，主请求和对冲请求都在其中执行，调用线程只负责等待"""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = concurrent.futures.ThreadPoolExecutor(max_workers=max_workers,
+                                                              thread_name_prefix='llm-hedge')
+        return _executor
+
+
+class RequestDispatch:
+    """记录主请求是否已经发出
+
+    限流等待、并发名额排队和重试退避都发生在本地，不能通过对冲加速，对冲计时和延迟样本都从请求实际发出时开始。
+    """
+    def __init__(self):
+        # 当前这次尝试发出的时间
+        self.sent_at = None
+        self.in_flight = False
+        self.finished = False
+        self._cond = threading.Condition()
+
+    def mark_sent(self):
+        """已取得配额和并发名额，请求即将发出"""
+        with self._cond:
+            self.sent_at = time.monotonic()
+            self.in_flight = True
+            self._cond.notify_all()
+        self._notify()
+
+    def mark_waiting(self):
+        """请求失败，进入重试退避或重新排队"""
+        with self._cond:
+            self.in_flight = False
+        self._reset()
+
+    def mark_finished(self):
+        with self._cond:
+            self.finished = True
+            self.in_flight = False
+            self._cond.notify_all()
+        self._notify()
+
+    def latency(self) -> Optional[float]:
+        """当前这次尝试发出后经过的秒数，尚未发出（例如命中缓存）时返回None"""
+        sent_at = self.sent_at
+        return time.monotonic() - sent_at if sent_at is not None else None
+
+    def wait_sent(self):
+        """阻塞直到请求发出或结束"""
+        with self._cond:
+            self._cond.wait_for(lambda: self.in_flight or self.finished)
+
+    def _notify(self):
+        pass
+
+    def _reset(self):
+        pass
+
+
+class AsyncRequestDispatch(RequestDispatch):
+    """RequestDispatch的异步版本，只能在创建它的事件循环中使用"""
+    def __init__(self):
+        super().__init__()
+        self._event = asyncio.Event()
+
+    def _notify(self):
+        self._event.set()
+
+    def _reset(self):
+        self._event.clear()
+
+    async def wait_sent_async(self):
+        await self._event.wait()
+
+
+class HedgePolicy:
+    """请求对冲策略：请求耗时超过历史延迟的指定分位数仍未返回时，再发出一个相同的请求，先返回者胜出
+
+    对冲请求会额外消耗配额，max_ratio限制对冲请求占全部请求的比例，避免服务整体变慢时请求量翻倍。
+    """
+    def __init__(self, tasks=('vlm',), percentile: float = 95, min_samples: int = 20, min_delay: float = 1.0,
+                 max_ratio: float = 0.1, window: int = 500, provider: str = None):
+        self.tasks = set(tasks)
+        self.percentile = percentile
+        # 观察到min_samples个请求之前不对冲
+        self.min_samples = min_samples
+        self.min_delay = min_delay
+        self.max_ratio = max_ratio
+        # 对冲请求发往的服务，为None时发往同一服务
+        self.provider = provider
+        self._latencies = collections.defaultdict(lambda: collections.deque(maxlen=window))
+        self._counts = collections.defaultdict(lambda: [0, 0])
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, config: dict, provider: str) -> Optional['HedgePolicy']:
+        """根据配置文件中的hedging项创建对冲策略，未启用时返回None
+
+        hedging项中的设置对全部服务生效，以服务名为键的子项覆盖对应服务的设置，例如
+        {"hedging": {"enabled": true, "tasks": ["vlm"], "percentile": 95, "ark": {"provider": "local_llm"}}}
+        """
+        hedge_config = config.get('hedging', {})
+        settings = {key: value for key, value in hedge_config.items() if not isinstance(value, dict)}
+        settings.update(hedge_config.get(provider, {}))
+        if not settings.get('enabled', False):
+            return None
+        return cls(
+            tasks=settings.get('tasks', ['vlm']),
+            percentile=float(settings.get('percentile', 95)),
+            min_samples=int(settings.get('min_samples', 20)),
+            min_delay=float(settings.get('min_delay', 1.0)),
+            max_ratio=float(settings.get('max_ratio', 0.1)),
+            provider=settings.get('provider'),
+        )
+
+    def applies_to(self, task: str) -> bool:
+        return task in self.tasks
+
+    def record(self, task: str, latency: float):
+        """记录主请求的耗时"""
+        with self._lock:
+            self._latencies[task].append(latency)
+
+    def delay(self, task: str) -> Optional[float]:
+        """返回发出对冲请求前的等待秒数，样本不足时返回None"""
+        with self._lock:
+            samples = sorted(self._latencies[task])
+        if len(samples) < self.min_samples:
+            return None
+        idx = min(len(samples) - 1, int(len(samples) * self.percentile / 100))
+        return max(self.min_delay, samples[idx])
+
+    def count_request(self, task: str):
+        with self._lock:
+            self._counts[task][0] += 1
+
+    def try_hedge(self, task: str) -> bool:
+        """对冲请求数未超过比例上限时占用一个对冲名额并返回True"""
+        with self._lock:
+            requests, hedged = self._counts[task]
+            if hedged + 1 > self.max_ratio * max(requests, 1):
+                return False
+            self._counts[task][1] += 1
+            return True
+
+    def expected_remaining(self, task: str, elapsed: float) -> float:
+        """估计已耗时elapsed秒的请求还需要多久完成：历史上耗时超过elapsed的请求的平均耗时减去elapsed"""
+        with self._lock:
+            slower = [latency for latency in self._latencies[task] if latency > elapsed]
+        if not slower:
+            return 0.0
+        return sum(slower) / len(slower) - elapsed
+
+
+class HedgeStats:
+    """进程内的对冲统计，按(任务, 服务)记录对冲次数、对冲胜出次数和节省的时间"""
+    _stats = {}
+    _lock = threading.Lock()
+
+    @classmethod
+    def _entry(cls, provider: str, task: str) -> dict:
+        return cls._stats.setdefault(f"{task}@{provider}",
+                                     {'requests': 0, 'hedged': 0, 'hedge_wins': 0, 'saved_seconds': 0.0})
+
+    @classmethod
+    def record_request(cls, provider: str, task: str):
+        with cls._lock:
+            cls._entry(provider, task)['requests'] += 1
+
+    @classmethod
+    def record_hedge(cls, provider: str, task: str, hedge_won: bool):
+        with cls._lock:
+            stats = cls._entry(provider, task)
+            stats['hedged'] += 1
+            stats['hedge_wins'] += int(hedge_won)
+
+    @classmethod
+    def record_saving(cls, provider: str, task: str, saved: float):
+        """记录对冲胜出时节省的时间：主请求的耗时（或其估计值）减去对冲请求胜出时的耗时"""
+        with cls._lock:
+            stats = cls._entry(provider, task)
+            stats['saved_seconds'] = round(stats['saved_seconds'] + max(0.0, saved), 3)
+
+    @classmethod
+    def stats(cls) -> dict:
+        """返回每个(任务, 服务)的对冲统计，包括对冲比例"""
+        with cls._lock:
+            result = {key: dict(value) for key, value in cls._stats.items()}
+        for stats in result.values():
+            stats['hedge_rate'] = round(stats['hedged'] / stats['requests'], 3) if stats['requests'] else 0.0
+        return result
+
+    @classmethod
+    def reset(cls):
+        with cls._lock:
+            cls._stats.clear()
@@ -0,0 +1,210 @@
+import json
+import time
+import logging
+import threading
+from typing import Callable, Optional
+
+# 设置日志记录
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+
+def usage_breakdown(response) -> tuple[Optional[int], Optional[int], Optional[int]]:
+    """从响应或流式输出的usage中取出(输入token数, 输出token数, 推理token数)，服务端未返回时为None"""
+    usage = getattr(response, 'usage', response)
+    if usage is None:
+        return None, None, None
+    details = getattr(usage, 'completion_tokens_details', None)
+    reasoning = getattr(details, 'reasoning_tokens', None) if details is not None else None
+    return getattr(usage, 'prompt_tokens', None), getattr(usage, 'completion_tokens', None), reasoning
+
+
+def percentile(values: list[float], percentile: float) -> Optional[float]:
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * percentile / 100))]
+
+
+class RunMetrics:
+    """单次运行的LLM调用记录：每次调用的token数、耗时、重试次数、服务和任务
+
+    LLMClient的每次调用都记录到当前运行的实例中，运行结束时输出汇总表并导出JSON。
+    费用按配置文件中pricing项的模型单价计算，单价为每百万token的价格，例如
+    {"pricing": {"currency": "CNY", "doubao-vision-pro-32k-241028": {"input": 3, "output": 9}}}
+    推理token按输出token计价，命中响应缓存的调用不计费用。离线批处理的请求按batch_discount折扣计价（默认0.5），
+    也可以在模型单价中单独设置batch_input和batch_output。
+    """
+    _current = None
+    _current_lock = threading.Lock()
+    # 运行开始时调用的函数，用于清空重试、限流等进程内的统计，使导出的统计只包含本次运行
+    _resetters = []
+
+    def __init__(self, pricing: dict = None):
+        pricing = dict(pricing or {})
+        self.currency = pricing.pop('currency', 'CNY')
+        self.batch_discount = float(pricing.pop('batch_discount', 0.5))
+        self.pricing = pricing
+        self.started = time.time()
+        self.calls = []
+        self._lock = threading.Lock()
+
+    @classmethod
+    def start(cls, config: dict) -> 'RunMetrics':
+        """开始新的运行，之后的调用都记录到返回的实例中，并清空上一次运行留下的进程内统计"""
+        metrics = cls(config.get('pricing', {}))
+        with cls._current_lock:
+            cls._current = metrics
+            resetters = list(cls._resetters)
+        for reset in resetters:
+            reset()
+        return metrics
+
+    @classmethod
+    def register_reset(cls, reset: Callable[[], None]):
+        """注册运行开始时清空统计的函数"""
+        with cls._current_lock:
+            cls._resetters.append(reset)
+
+    @classmethod
+    def current(cls) -> 'RunMetrics':
+        """返回当前运行的实例，尚未开始运行时创建一个"""
+        with cls._current_lock:
+            if cls._current is None:
+                cls._current = cls()
+            return cls._current
+
+    def record(self, provider: str, model: str, task: str, latency: float, prompt_tokens: int = None,
+               completion_tokens: int = None, reasoning_tokens: int = None, retries: int = 0,
+               success: bool = True, cached: bool = False, stream: bool = False, ttft: float = None,
+               images: int = None, batch: bool = False, wait: float = None):
+        """记录一次调用
+
+        Args:
+            latency: 请求耗时，包括失败重试的请求，不包括本地等待
+            wait: 在本地等待限流配额、并发名额和重试退避的秒数
+            retries: 重试次数，首次请求不计入
+            ttft: 流式调用收到第一个token的耗时
+            images: 请求中包含的图片数
+            batch: 是否为离线批处理请求
+        """
+        call = {
+            'time': round(time.time() - self.started, 3),
+            'provider': provider,
+            'model': model,
+            'task': task,
+            'latency': round(latency, 3),
+            'prompt_tokens': prompt_tokens,
+            'completion_tokens': completion_tokens,
+            'reasoning_tokens': reasoning_tokens,
+            'retries': retries,
+            'success': success,
+            'cached': cached,
+            'stream': stream,
+        }
+        if wait is not None:
+            call['wait'] = round(wait, 3)
+        if ttft is not None:
+            call['ttft'] = round(ttft, 3)
+        if images is not None:
+            call['images'] = images
+        if batch:
+            call['batch'] = True
+        call['cost'] = self.cost(call)
+        with self._lock:
+            self.calls.append(call)
+
+    def cost(self, call: dict) -> Optional[float]:
+        """按模型单价计算一次调用的费用，未配置单价时返回None"""
+        price = self.pricing.get(call['model'])
+        if price is None:
+            return None
+        if call['cached']:
+            return 0.0
+        input_price, output_price = float(price.get('input', 0)), float(price.get('output', 0))
+        if call.get('batch'):
+            input_price = float(price.get('batch_input', input_price * self.batch_discount))
+            output_price = float(price.get('batch_output', output_price * self.batch_discount))
+        return ((call['prompt_tokens'] or 0) * input_price + (call['completion_tokens'] or 0) * output_price) / 1e6
+
+    def summary(self) -> list[dict]:
+        """按(服务, 模型, 任务)汇总调用记录，包含多张图片的合并请求单独汇总，便于与逐张请求比较吞吐量"""
+        with self._lock:
+            calls = list(self.calls)
+        groups = {}
+        for call in calls:
+            key = (call['provider'], call['model'], call['task'], (call.get('images') or 0) > 1)
+            groups.setdefault(key, []).append(call)
+        rows = []
+        for (provider, model, task, batched), group in groups.items():
+            latencies = [call['latency'] for call in group if call['success'] and not call['cached']]
+            waits = [call.get('wait') or 0.0 for call in group if call['success'] and not call['cached']]
+            costs = [call['cost'] for call in group if call['cost'] is not None]
+            images = sum(call.get('images') or 0 for call in group if call['success'])
+            rows.append({
+                'provider': provider,
+                'model': model,
+                'task': task,
+                'batched': batched,
+                'calls': len(group),
+                'failures': sum(1 for call in group if not call['success']),
+                'cached': sum(1 for call in group if call['cached']),
+                'retries': sum(call['retries'] for call in group),
+                'images': images,
+                # 每张图片分摊的请求耗时，合并请求与逐张请求按此比较
+                'seconds_per_image': round(sum(latencies) / images, 3) if images and latencies else None,
+                'prompt_tokens': sum(call['prompt_tokens'] or 0 for call in group),
+                'completion_tokens': sum(call['completion_tokens'] or 0 for call in group),
+                'reasoning_tokens': sum(call['reasoning_tokens'] or 0 for call in group),
+                'latency_p50': percentile(latencies, 50),
+                'latency_p95': percentile(latencies, 95),
+                # 本地排队、限流和退避等待，与请求耗时分开统计，避免本地积压被误判为服务变慢
+                'wait_p50': percentile(waits, 50),
+                'wait_p95': percentile(waits, 95),
+                'busy_seconds': round(sum(latencies), 3),
+                'cost': round(sum(costs), 4) if costs else None,
+            })
+        return rows
+
+    def format_table(self) -> str:
+        """把汇总结果格式化为文本表格"""
+        columns = [
+            ('provider', '服务'), ('model', '模型'), ('task', '任务'), ('calls', '调用'), ('failures', '失败'),
+            ('cached', '缓存'), ('retries', '重试'), ('images', '图片'), ('prompt_tokens', '输入'),
+            ('completion_tokens', '输出'), ('reasoning_tokens', '推理'), ('latency_p50', 'p50(秒)'),
+            ('latency_p95', 'p95(秒)'), ('wait_p50', '等待p50'), ('wait_p95', '等待p95'), ('seconds_per_image', '秒/图'), ('cost', f'费用({self.currency})'),
+        ]
+        rows = self.summary()
+        table = [[title for _, title in columns]]
+        for row in rows:
+            cells = ['-' if row[key] is None else str(row[key]) for key, _ in columns]
+            if row['batched']:
+                cells[2] += '(合并)'
+            table.append(cells)
+        total_cost = [row['cost'] for row in rows if row['cost'] is not None]
+        widths = [max(len(line[i]) for line in table) for i in range(len(columns))]
+        lines = ['  '.join(cell.ljust(width) for cell, width in zip(line, widths)) for line in table]
+        lines.append(f"总耗时{time.time() - self.started:.1f}秒"
+                     + (f"，总费用{sum(total_cost):.4f} {self.currency}" if total_cost else ''))
+        return '\n'.join(lines)
+
+    def log_summary(self):
+        """输出汇总表"""
+        logging.info("LLM调用统计:\n" + self.format_table())
+
+    def export_json(self, path: str, extra: dict = None):
+        """导出汇总结果和全部调用记录，extra中的内容（例如重试、限流统计）一并写入"""
+        with self._lock:
+            calls = list(self.calls)
+        report = {
+            'started': self.started,
+            'elapsed': round(time.time() - self.started, 3),
+            'currency': self.currency,
+            'summary': self.summary(),
+            'calls': calls,
+        }
+        report.update(extra or {})
+        try:
+            with open(path, 'w', encoding='utf-8') as f:
+                json.dump(report, f, ensure_ascii=False, indent=2, default=str)
+        except OSError as e:
+            logging.error(f"写入运行统计{path}失败: {e}")
@@ -0,0 +1,200 @@
+import io
+import math
+import time
+import base64
+import asyncio
+import logging
+import threading
+from typing import Optional
+
+from PIL import Image
+
+# 设置日志记录
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+# 无法读取图片尺寸时按该值估计单张图片的token数
+DEFAULT_IMAGE_TOKENS = 1024
+# 读取图片尺寸时解码的base64前缀长度，预处理后的图片不含EXIF，文件头都在开头
+IMAGE_HEADER_CHARS = 64 * 1024
+
+
+def estimate_text_tokens(text: str) -> int:
+    """粗略估计文本的token数：中日韩文字约每字1个token，其他字符约每4个字符1个token"""
+    cjk = sum(1 for char in text if '\u2e80' <= char <= '\u9fff' or '\uf900' <= char <= '\ufaff')
+    return cjk + math.ceil((len(text) - cjk) / 4)
+
+
+def estimate_image_tokens(image_url: str, patch_size: int = 28, max_tokens: int = 16384) -> int:
+    """根据图片尺寸估计视觉token数，按patch_size像素见方的图块计数（Qwen-VL等模型为28）"""
+    if not image_url.startswith('data:') or ',' not in image_url:
+        return DEFAULT_IMAGE_TOKENS
+    payload = image_url.split(',', 1)[1][:IMAGE_HEADER_CHARS]
+    try:
+        header = base64.b64decode(payload[:len(payload) // 4 * 4])
+        with Image.open(io.BytesIO(header)) as image:
+            width, height = image.size
+    except Exception:
+        return DEFAULT_IMAGE_TOKENS
+    return min(max_tokens, math.ceil(width / patch_size) * math.ceil(height / patch_size))
+
+
+def estimate_tokens(messages: list[dict], patch_size: int = 28, completion_tokens: int = 0) -> int:
+    """估计一次请求消耗的token数，包括文本、图片和预计的输出token"""
+    total = completion_tokens
+    for message in messages:
+        content = message.get('content')
+        if isinstance(content, str):
+            total += estimate_text_tokens(content)
+            continue
+        for part in content or []:
+            if part.get('type') == 'text':
+                total += estimate_text_tokens(part.get('text', ''))
+            elif part.get('type') == 'image_url':
+                total += estimate_image_tokens(part.get('image_url', {}).get('url', ''), patch_size)
+    return total
+
+
+class TokenBucket:
+    """令牌桶，按每分钟的速率补充令牌
+
+    采用预约方式：令牌不足时先扣减为负数，返回需要等待的时间，
+    使并发的调用者按到达顺序依次错开，而不是同时醒来再争抢。
+    """
+    def __init__(self, per_minute: float, capacity: float = None):
+        self.rate = per_minute / 60.0
+        self.capacity = capacity if capacity is not None else per_minute
+        self.tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def reserve(self, amount: float) -> float:
+        """预约amount个令牌，返回获得令牌前需要等待的秒数"""
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            self.tokens -= amount
+            if self.tokens >= 0:
+                return 0.0
+            return -self.tokens / self.rate
+
+    def adjust(self, amount: float):
+        """按实际消耗修正预约的令牌数，amount为正时补扣，为负时退还"""
+        with self._lock:
+            self._refill(time.monotonic())
+            self.tokens = min(self.capacity, self.tokens - amount)
+
+
+class ProviderRateLimiter:
+    """按服务配额限制请求速率的客户端限流器，同时限制每分钟请求数（RPM）和每分钟token数（TPM）
+
+    同一进程中使用同一服务和任务的所有线程、协程共享一个限流器。
+    """
+    _limiters = {}
+    _registry_lock = threading.Lock()
+
+    def __init__(self, name: str, rpm: float = None, tpm: float = None, patch_size: int = 28,
+                 completion_tokens: int = 512):
+        self.name = name
+        self.requests = TokenBucket(rpm) if rpm else None
+        self.tokens = TokenBucket(tpm) if tpm else None
+        # 估计图片token数使用的图块边长
+        self.patch_size = patch_size
+        # 请求前无法得知输出长度，先按completion_tokens预估，收到响应后按实际用量修正
+        self.completion_tokens = completion_tokens
+        self._lock = threading.Lock()
+        self._stats = {}
+        self.reset_stats()
+
+    @classmethod
+    def for_provider(cls, config: dict, provider: str, task: str) -> Optional['ProviderRateLimiter']:
+        """获取服务和任务共享的限流器，不存在时根据配置文件中的rate_limits项创建，未配置配额时返回None
+
+        Ark、SiliconFlow等平台的配额按模型计算，因此每个任务使用独立的令牌桶。
+        服务级别的设置对所有任务生效，以任务名为键的子项覆盖对应任务的设置，例如
+        {"rate_limits": {"silicon_flow": {"rpm": 1000, "tpm": 50000, "vlm": {"tpm": 80000}}}}
+        实际使用的速率为配额乘以headroom（默认0.95），留出余量避免触发服务端限流。
+        """
+        provider_config = config.get('rate_limits', {}).get(provider, {})
+        settings = {key: value for key, value in provider_config.items() if not isinstance(value, dict)}
+        settings.update(provider_config.get(task, {}))
+        if not settings.get('rpm') and not settings.get('tpm'):
+            return None
+        name = f"{task}@{provider}"
+        with cls._registry_lock:
+            limiter = cls._limiters.get(name)
+            if limiter is None:
+                headroom = float(settings.get('headroom', 0.95))
+                limiter = cls(
+                    name,
+                    rpm=float(settings['rpm']) * headroom if settings.get('rpm') else None,
+                    tpm=float(settings['tpm']) * headroom if settings.get('tpm') else None,
+                    patch_size=int(settings.get('image_patch_size', 28)),
+                    completion_tokens=int(settings.get('completion_tokens', 512)),
+                )
+                cls._limiters[name] = limiter
+            return limiter
+
+    @classmethod
+    def all_limiters(cls) -> list['ProviderRateLimiter']:
+        with cls._registry_lock:
+            return list(cls._limiters.values())
+
+    @classmethod
+    def reset_all_stats(cls):
+        """清空所有限流器的统计，令牌桶中的配额状态保持不变"""
+        for limiter in cls.all_limiters():
+            limiter.reset_stats()
+
+    def reset_stats(self):
+        with self._lock:
+            self._stats = {'requests': 0, 'estimated_tokens': 0, 'actual_tokens': 0, 'throttled': 0,
+                           'wait_seconds': 0.0}
+
+    def estimate(self, messages: list[dict]) -> int:
+        """估计请求消耗的token数"""
+        return estimate_tokens(messages, self.patch_size, self.completion_tokens)
+
+    def reserve(self, tokens: int) -> float:
+        """为一次请求预约配额，返回需要等待的秒数"""
+        wait = 0.0
+        if self.requests is not None:
+            wait = max(wait, self.requests.reserve(1))
+        if self.tokens is not None:
+            wait = max(wait, self.tokens.reserve(tokens))
+        with self._lock:
+            self._stats['requests'] += 1
+            self._stats['estimated_tokens'] += tokens
+            if wait > 0:
+                self._stats['throttled'] += 1
+                self._stats['wait_seconds'] = round(self._stats['wait_seconds'] + wait, 3)
+        return wait
+
+    def acquire(self, tokens: int):
+        """阻塞直到配额允许发出请求"""
+        wait = self.reserve(tokens)
+        if wait > 0:
+            time.sleep(wait)
+
+    async def acquire_async(self, tokens: int):
+        """acquire的异步版本"""
+        wait = self.reserve(tokens)
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+    def reconcile(self, estimated: int, actual: Optional[int]):
+        """收到响应后按服务端返回的实际用量修正token桶"""
+        if actual is None:
+            return
+        with self._lock:
+            self._stats['actual_tokens'] += actual
+        if self.tokens is not None:
+            self.tokens.adjust(actual - estimated)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return dict(self._stats)
+
@@ -0,0 +1,147 @@
+import time
+import random
+import logging
+import threading
+from email.utils import parsedate_to_datetime
+from typing import Optional
+
+import openai
+
+# 设置日志记录
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+# 错误分类
+RATE_LIMIT = 'rate_limit'
+TIMEOUT = 'timeout'
+CONNECTION = 'connection'
+SERVER_ERROR = 'server_error'
+CLIENT_ERROR = 'client_error'
+UNKNOWN = 'unknown'
+
+# 默认可重试的错误类型，4xx客户端错误（参数错误、鉴权失败等）重试也不会成功
+RETRYABLE_ERRORS = (RATE_LIMIT, TIMEOUT, CONNECTION, SERVER_ERROR, UNKNOWN)
+# 虽然是4xx，但通常是暂时性的错误
+RETRYABLE_STATUS_CODES = {408, 409}
+
+
+def classify_error(error: Exception) -> str:
+    """把请求异常归类为限流、超时、连接错误、服务端错误、客户端错误或未知错误"""
+    if isinstance(error, openai.APITimeoutError):
+        return TIMEOUT
+    if isinstance(error, openai.APIConnectionError):
+        return CONNECTION
+    if isinstance(error, openai.APIStatusError):
+        status = error.status_code
+        if status == 429:
+            return RATE_LIMIT
+        if status >= 500 or status in RETRYABLE_STATUS_CODES:
+            return SERVER_ERROR
+        return CLIENT_ERROR
+    return UNKNOWN
+
+
+def parse_retry_after(error: Exception) -> Optional[float]:
+    """从响应头中读取服务端建议的等待秒数，支持retry-after-ms、秒数和HTTP日期三种形式"""
+    response = getattr(error, 'response', None)
+    headers = getattr(response, 'headers', None)
+    if not headers:
+        return None
+    value = headers.get('retry-after-ms')
+    if value:
+        try:
+            return max(0.0, float(value) / 1000)
+        except ValueError:
+            pass
+    value = headers.get('retry-after')
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class RetryPolicy:
+    """请求重试策略：按错误类型决定是否重试，指数退避并加入随机抖动
+
+    多个线程同时遇到限流时，随机抖动使它们的重试时间错开，避免同步冲击服务端。
+    """
+    def __init__(self, max_attempts: int = 3, base_delay: float = 1.0, max_delay: float = 60.0,
+                 multiplier: float = 2.0, max_retry_after: float = 120.0, retry_on=RETRYABLE_ERRORS):
+        # 包括首次请求在内的最大尝试次数
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.multiplier = multiplier
+        # 服务端建议的等待时间超过max_retry_after秒时按该值等待
+        self.max_retry_after = max_retry_after
+        self.retry_on = tuple(retry_on)
+
+    @classmethod
+    def from_config(cls, config: dict, provider: str, defaults: dict = None) -> 'RetryPolicy':
+        """根据配置文件中的retry项创建重试策略
+
+        retry项中的数值为全部服务的默认值，以服务名为键的子项覆盖对应服务的设置，例如
+        {"retry": {"max_attempts": 4, "silicon_flow": {"base_delay": 2}}}
+        """
+        retry_config = config.get('retry', {})
+        settings = dict(defaults or {})
+        settings.update({key: value for key, value in retry_config.items() if not isinstance(value, dict)})
+        settings.update(retry_config.get(provider, {}))
+        return cls(
+            # 至少发出一次请求
+            max_attempts=max(1, int(settings.get('max_attempts', 3))),
+            base_delay=float(settings.get('base_delay', 1.0)),
+            max_delay=float(settings.get('max_delay', 60.0)),
+            multiplier=float(settings.get('multiplier', 2.0)),
+            max_retry_after=float(settings.get('max_retry_after', 120.0)),
+            retry_on=settings.get('retry_on', RETRYABLE_ERRORS),
+        )
+
+    def should_retry(self, error_class: str) -> bool:
+        return error_class in self.retry_on
+
+    def backoff(self, attempt: int) -> float:
+        """第attempt次（从0开始）失败后的退避时间，在0到指数上限之间均匀随机"""
+        ceiling = min(self.max_delay, self.base_delay * self.multiplier ** attempt)
+        return random.uniform(0, ceiling)
+
+    def delay(self, attempt: int, error: Exception) -> float:
+        """计算下一次重试前的等待时间，优先遵循服务端的Retry-After"""
+        retry_after = parse_retry_after(error)
+        if retry_after is not None:
+            return min(retry_after, self.max_retry_after) + random.uniform(0, self.base_delay)
+        return self.backoff(attempt)
+
+
+class RetryStats:
+    """进程内的重试统计，按(服务, 任务)记录各类错误的重试次数和等待时间"""
+    _stats = {}
+    _lock = threading.Lock()
+
+    @classmethod
+    def record(cls, provider: str, task: str, error_class: str, delay: float = 0.0, retried: bool = True):
+        """记录一次失败的请求"""
+        with cls._lock:
+            stats = cls._stats.setdefault(f"{task}@{provider}", {'retries': 0, 'failures': 0, 'wait_seconds': 0.0})
+            stats[error_class] = stats.get(error_class, 0) + 1
+            if retried:
+                stats['retries'] += 1
+                stats['wait_seconds'] = round(stats['wait_seconds'] + delay, 3)
+            else:
+                stats['failures'] += 1
+
+    @classmethod
+    def stats(cls) -> dict:
+        """返回每个(任务, 服务)的重试统计"""
+        with cls._lock:
+            return {key: dict(value) for key, value in cls._stats.items()}
+
+    @classmethod
+    def reset(cls):
+        with cls._lock:
+            cls._stats.clear()
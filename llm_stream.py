@@ -0,0 +1,113 @@
+import logging
+import threading
+
+# 设置日志记录
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+THINK_OPEN = '<think>'
+THINK_CLOSE = '</think>'
+
+
+def _partial_tag_length(text: str) -> int:
+    """返回text末尾可能是标签开头的字符数，这部分需要等待后续文本才能判断"""
+    for length in range(min(len(text), len(THINK_CLOSE) - 1), 0, -1):
+        suffix = text[-length:]
+        if THINK_OPEN.startswith(suffix) or THINK_CLOSE.startswith(suffix):
+            return length
+    return 0
+
+
+class ThinkStripper:
+    """在流式输出中实时去除<think>...</think>思考过程
+
+    部分推理模型的输出省略了开头的<think>，此时直到遇到</think>才知道之前的内容都是思考过程，
+    feed会返回reset=True，调用方需要丢弃已经显示的内容。
+    """
+    def __init__(self):
+        self._buffer = ''
+        self._in_think = False
+        # 是否已经输出过正文，正文开头的空白不输出
+        self._started = False
+
+    def feed(self, text: str) -> tuple[str, bool]:
+        """处理一段增量文本，返回(可以显示的正文, 是否需要丢弃之前显示的内容)"""
+        self._buffer += text
+        visible = ''
+        reset = False
+        while self._buffer:
+            if self._in_think:
+                idx = self._buffer.find(THINK_CLOSE)
+                if idx < 0:
+                    # 思考内容直接丢弃，只保留可能是结束标签开头的部分
+                    self._buffer = self._buffer[-(len(THINK_CLOSE) - 1):]
+                    break
+                self._buffer = self._buffer[idx + len(THINK_CLOSE):]
+                self._in_think = False
+                continue
+            open_idx = self._buffer.find(THINK_OPEN)
+            close_idx = self._buffer.find(THINK_CLOSE)
+            if close_idx >= 0 and (open_idx < 0 or close_idx < open_idx):
+                # 没有开始标签的结束标签：之前输出的都是思考过程
+                self._buffer = self._buffer[close_idx + len(THINK_CLOSE):]
+                visible = ''
+                reset = True
+                self._started = False
+                continue
+            if open_idx >= 0:
+                visible += self._emit(self._buffer[:open_idx])
+                self._buffer = self._buffer[open_idx + len(THINK_OPEN):]
+                self._in_think = True
+                continue
+            pending = _partial_tag_length(self._buffer)
+            visible += self._emit(self._buffer[:len(self._buffer) - pending])
+            self._buffer = self._buffer[len(self._buffer) - pending:]
+            break
+        return visible, reset
+
+    def flush(self) -> str:
+        """输出结束时返回缓冲区中剩余的正文"""
+        remaining = '' if self._in_think else self._emit(self._buffer)
+        self._buffer = ''
+        return remaining
+
+    def _emit(self, text: str) -> str:
+        if not self._started:
+            text = text.lstrip()
+            self._started = bool(text)
+        return text
+
+
+class StreamStats:
+    """进程内的流式输出统计，按(任务, 服务)记录首token时间和生成速度"""
+    _stats = {}
+    _lock = threading.Lock()
+
+    @classmethod
+    def record(cls, provider: str, task: str, ttft: float, first_answer: float, tokens_per_second: float,
+               completion_tokens: int):
+        """记录一次流式请求
+
+        Args:
+            ttft: 从发出请求到收到第一个token（包括思考过程）的秒数
+            first_answer: 从发出请求到收到第一个正文token的秒数
+            tokens_per_second: 收到第一个token之后的生成速度
+            completion_tokens: 输出的token数
+        """
+        with cls._lock:
+            cls._stats.setdefault(f"{task}@{provider}", []).append({
+                'ttft': round(ttft, 3) if ttft is not None else None,
+                'first_answer': round(first_answer, 3) if first_answer is not None else None,
+                'tokens_per_second': round(tokens_per_second, 1) if tokens_per_second is not None else None,
+                'completion_tokens': completion_tokens,
+            })
+
+    @classmethod
+    def stats(cls) -> dict:
+        """返回每个(任务, 服务)的流式请求记录"""
+        with cls._lock:
+            return {key: list(value) for key, value in cls._stats.items()}
+
+    @classmethod
+    def reset(cls):
+        with cls._lock:
+            cls._stats.clear()
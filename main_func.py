@@ -3,10 +3,12 @@ import time
 import sys
 import os
 import logging
-import re
 import base64
+import asyncio
 import concurrent.futures
+from collections import deque
 from multiprocessing import Pool, cpu_count
+from typing import AsyncIterator, Iterator, Optional
 
 from PIL import Image
 from fastmcp import Client
@@ -14,32 +16,112 @@ import tqdm
 
 # 导入新的图像处理模块
 from image_processor import ImageProcessor
+from image_cache import ConvertedImageCache
+from image_payload import ImagePayloadPreparer
+from image_dedup import SlideDeduplicator
+from image_filter import SlidePhotoFilter
+from image_sessions import SessionSegmenter, SegmentTracker
+from image_batching import ImageBatcher
 # 导入LLM客户端相关类
-from llm_client import LLMClientRegistry, load_config
+from llm_client import LLMClientRegistry, LLMHttpClientPool, load_config
+# 导入时注册多服务组合客户端
+import llm_balancer
+from llm_retry import RetryStats
+from llm_concurrency import AIMDConcurrencyController, AdmissionGate
+from llm_ratelimit import ProviderRateLimiter
+from llm_hedge import HedgeStats
+from llm_stream import StreamStats
+from llm_metrics import RunMetrics
+from llm_batch import BatchInferenceRunner
 import threading
 
 # 设置日志记录
 logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(levelname)s - %(message)s')
 
 
-def encode_image(image_path):
+def encode_image(image_path, image_processor=None):
+    """将图片编码为base64字符串，传入图像处理器时非JPEG图片会先在内存中转换为JPEG"""
+    if image_processor is not None:
+        data = image_processor.load_image_bytes(image_path)
+        if data is None:
+            raise ValueError(f"无法读取图片: {image_path}")
+        return base64.b64encode(data).decode('utf-8')
     with open(image_path, "rb") as image_file:
         return base64.b64encode(image_file.read()).decode('utf-8')
 
 
-def main(service=None, images=None):
-    # 如果没有指定service，则从配置文件中加载
-    if service is None:
-        config = load_config()
-        api_type = config.get('api_type', '火山引擎')
-        if api_type == 'DeepSeek':
-            service = 'silicon_flow'
-        elif api_type == '本地大模型':
-            service = 'local_llm'
-        else:
-            service = 'ark'
-    
-    # 通过注册中心获取客户端实例
+# 从幻灯片照片中提取内容的提示词
+EXTRACTION_PROMPT = "你是一个专业学者，从当前输入的图片中找到slide内容，并且提取其中的信息。"
+
+
+def build_extraction_message(image_url: str) -> list[dict]:
+    """构造单张图片的内容提取请求"""
+    return [
+        {
+            "role": "user",
+            "content": [
+                {
+                    "type": "image_url",
+                    "image_url": {
+                        "url": image_url,
+                    },
+                },
+                {"type": "text", "text": EXTRACTION_PROMPT},
+            ],
+        }
+    ]
+
+
+def build_segment_prompt(idx: int, segment: str) -> str:
+    """构造第idx段（从0开始）内容的分段总结提示词"""
+    return f"""
+        你是一个学术会议参会报告总结专家，请根据以下图片内容，分专题进行总结，并输出一个总结报告。
+        总结时需要注意：
+        1. 每个专题可能关联多张图片，需对每个专题的内容进行精准归纳与提炼。
+        2. 总结内容应做到逻辑清晰、言简意赅，着重突出关键要点。
+        【原始内容】
+        第{idx + 1}段内容：
+        {segment}
+        """
+
+
+def build_final_prompt(segments_desc_combined: str) -> str:
+    """构造基于全部分段总结的最终总结提示词"""
+    return f"""
+    【任务描述】
+        你作为一名专业的学术会议参会报告总结专家，需依据以下分段总结内容进行归纳，生成一份条理清晰、重点突出的简要会议总结。
+    【总结要求】
+        1. 总结内容需具备高度的逻辑性和专业性，精准提炼关键要点，避免冗余表述。
+        2. 确保内容简洁明了，杜绝重复信息和多余语句。
+    【原始分段总结内容】
+        {segments_desc_combined}
+    """
+
+
+def format_segment_summary(idx: int, response: str) -> str:
+    """去除思考过程，生成第idx段（从0开始）的总结文本"""
+    return f"第{idx + 1}段总结：\n{response.split('</think>')[-1]}"
+
+
+def resolve_service(service=None) -> str:
+    """确定使用的服务类型，未指定时从配置文件中加载"""
+    if service is not None:
+        return service
+    config = load_config()
+    # 启用负载均衡时，在配置的多个服务之间分摊请求
+    if config.get('load_balancing', {}).get('enabled', False):
+        return 'balanced'
+    api_type = config.get('api_type', '火山引擎')
+    if api_type == 'DeepSeek':
+        return 'silicon_flow'
+    elif api_type == '本地大模型':
+        return 'local_llm'
+    return 'ark'
+
+
+def create_llm_client(service: str, async_client: bool = False):
+    """通过注册中心获取客户端实例，async_client为True时返回对应的异步客户端"""
+    client_type = f"{service}_async" if async_client else service
     if service == 'local_llm':
         # 对于本地大模型，获取配置
         config = load_config()
@@ -47,11 +129,341 @@ def main(service=None, images=None):
         # 获取API密钥
         api_key = config.get('api_keys', {}).get('本地大模型', '')
         # 直接传递local_llm_config作为配置参数
-        llm_client = LLMClientRegistry.get_client(service, api_key, local_llm_config)
+        return LLMClientRegistry.get_client(client_type, api_key, local_llm_config)
+    return LLMClientRegistry.get_client(client_type)
+
+
+def extract_images(llm_client, tasks: list[tuple[int, str]], image_data_url, max_threads: int = 8,
+                   batcher: ImageBatcher = None) -> list[tuple[int, str]]:
+    """使用线程池并发提取图片内容
+
+    :param llm_client: LLM客户端实例
+    :param tasks: (图片索引, 图片路径)列表
+    :param image_data_url: 将图片路径转换为data URL的函数
+    :param max_threads: 线程数上限，启用自适应并发时取并发上限的最大值，实际提交的任务数不超过控制器当前的上限
+    :param batcher: 提供时把相邻图片合并为一个请求，合并结果无法拆分的图片再逐张请求
+    :return: (索引, 提取结果)列表，按完成顺序排列
+    """
+    return list(iter_extract_images(llm_client, tasks, image_data_url, max_threads, batcher))
+
+
+def iter_extract_images(llm_client, tasks: list[tuple[int, str]], image_data_url, max_threads: int = 8,
+                        batcher: ImageBatcher = None) -> Iterator[tuple[int, str]]:
+    """extract_images的流式版本，每张图片提取完成时立即产出(索引, 提取结果)"""
+    def process_image(image_url, idx):
+        response = llm_client.get_response(messages=build_extraction_message(image_url), task='vlm')
+        return [(idx, response.split('wyaf')[-1])], []
+
+    def process_single(image, idx):
+        return process_image(image_data_url(image), idx)
+
+    def process_batch(group):
+        image_urls = [image_data_url(image) for _, image in group]
+        results, failed = [], []
+        for batch in batcher.split(image_urls):
+            if len(batch) == 1:
+                results.extend(process_image(image_urls[batch[0]], group[batch[0]][0])[0])
+                continue
+            parts = extract_batch(llm_client, batcher, [image_urls[i] for i in batch])
+            if parts is None:
+                failed.extend((image_urls[i], group[i][0]) for i in batch)
+            else:
+                results.extend((group[i][0], part) for i, part in zip(batch, parts))
+        return results, failed
+
+    def run(func, *args):
+        try:
+            return func(*args)
+        finally:
+            gate.leave()
+
+    # 任务只在并发名额允许时提交，排队的任务不提前读取和编码图片；
+    # 线程池按需创建线程，实际线程数随控制器当前的并发上限变化
+    gate = AdmissionGate(lambda: llm_client.concurrency_limit('vlm'))
+    if batcher is None:
+        queue = deque((process_single, image, idx) for idx, image in tasks)
     else:
-        llm_client = LLMClientRegistry.get_client(service)
-    # 创建图像处理器实例
-    image_processor = ImageProcessor()
+        queue = deque((process_batch, group) for group in batcher.group(tasks))
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_threads) as executor, \
+            tqdm.tqdm(desc="Processing images", total=len(tasks)) as progress:
+        pending = set()
+        while queue or pending:
+            while queue and gate.try_enter():
+                pending.add(executor.submit(run, *queue.popleft()))
+            done, pending = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                finished, failed = future.result()
+                progress.update(len(finished))
+                # 合并请求无法拆分的图片改为逐张请求，排在队首优先提交
+                queue.extendleft((process_image, image_url, idx) for image_url, idx in reversed(failed))
+                yield from finished
+
+
+def extract_batch(llm_client, batcher: ImageBatcher, image_urls: list[str]) -> Optional[list[str]]:
+    """发送多张图片的合并请求，返回每张图片的提取结果，请求失败或无法拆分时返回None"""
+    try:
+        response = llm_client.get_response(messages=batcher.build_message(image_urls), task='vlm')
+    except Exception as e:
+        logging.warning(f"{len(image_urls)}张图片的合并请求失败，改为逐张请求: {str(e)}")
+        batcher.record(len(image_urls), fallback=True)
+        return None
+    parts = batcher.parse(response, len(image_urls))
+    if parts is None:
+        logging.warning(f"{len(image_urls)}张图片的合并请求结果无法按图片拆分，改为逐张请求")
+    batcher.record(len(image_urls), fallback=parts is None)
+    return parts
+
+
+def extract_images_offline(batch_runner: BatchInferenceRunner, tasks: list[tuple[int, str]],
+                           image_data_url) -> tuple[list[tuple[int, str]], list[tuple[int, str]]]:
+    """通过离线批处理提取图片内容
+
+    :return: (已提取的(索引, 提取结果)列表, 批处理未返回结果的(索引, 图片路径)列表)
+    """
+    # 逐张生成请求并写入任务文件，避免全部图片的base64数据同时驻留内存
+    requests = ((f"image-{idx}", build_extraction_message(image_data_url(image)))
+                for idx, image in tqdm.tqdm(tasks, desc="生成批处理任务"))
+    responses = batch_runner.run(requests, task='vlm')
+    results, remaining = [], []
+    for idx, image in tasks:
+        response = responses.get(f"image-{idx}")
+        if response is None:
+            remaining.append((idx, image))
+        else:
+            results.append((idx, response.split('wyaf')[-1]))
+    return results, remaining
+
+
+def summarize_segment(llm_client, idx: int, segment: str) -> str:
+    """总结第idx段（从0开始）提取的slides信息"""
+    message = [{"role": "user", "content": build_segment_prompt(idx, segment)}]
+    response = llm_client.get_response(messages=message)
+    return format_segment_summary(idx, response)
+
+
+def summarize_segments(llm_client, merged_segments: list[str]) -> list[str]:
+    """逐段总结提取的slides信息"""
+    return [summarize_segment(llm_client, idx, segment)
+            for idx, segment in tqdm.tqdm(enumerate(merged_segments), desc="处理分段总结")]
+
+
+def extract_and_summarize(llm_client, tasks: list[tuple[int, str]], image_data_url, tracker: SegmentTracker,
+                          max_threads: int = 8, batcher: ImageBatcher = None,
+                          completed: list[tuple[int, str]] = ()) -> tuple[list[tuple[int, str]], list[str]]:
+    """提取图片内容的同时总结已经提取完成的报告，提取和分段总结重叠进行
+
+    :param tracker: 跟踪各场报告提取进度的SegmentTracker
+    :param completed: 已经提取完成的(索引, 提取结果)，例如离线批处理的结果
+    :return: ((索引, 提取结果)列表, 按分段顺序排列的分段总结)
+    """
+    results = list(completed)
+    futures = {}
+    # 分段总结同样按当前的并发上限提交
+    gate = AdmissionGate(lambda: llm_client.concurrency_limit('llm'))
+    queue = deque()
+
+    def summarize(segment_idx, segment):
+        try:
+            return summarize_segment(llm_client, segment_idx, segment)
+        finally:
+            gate.leave()
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=llm_client.concurrency_ceiling('llm')) as executor:
+        def launch(ready=()):
+            for segment_idx, segment in ready:
+                logging.info(f"第{segment_idx + 1}段的图片已全部提取，开始分段总结")
+                queue.append((segment_idx, segment))
+            while queue and gate.try_enter():
+                segment_idx, segment = queue.popleft()
+                futures[segment_idx] = executor.submit(summarize, segment_idx, segment)
+
+        launch(tracker.ready())
+        for idx, result in completed:
+            launch(tracker.add(idx - 1, result))
+        for idx, result in iter_extract_images(llm_client, tasks, image_data_url, max_threads, batcher):
+            results.append((idx, result))
+            launch(tracker.add(idx - 1, result))
+        while queue:
+            concurrent.futures.wait([future for future in futures.values() if not future.done()],
+                                    return_when=concurrent.futures.FIRST_COMPLETED)
+            launch()
+        segments_desc = [futures[segment_idx].result() for segment_idx in sorted(futures)]
+    return results, segments_desc
+
+
+async def extract_images_async(llm_client, tasks: list[tuple[int, str]], image_data_url,
+                               batcher: ImageBatcher = None) -> list[tuple[int, str]]:
+    """使用异步客户端并发提取图片内容，并发数由客户端的信号量限制
+
+    图片缩放和编码属于CPU和磁盘操作，放到线程中执行，避免阻塞事件循环。
+    提供batcher时把相邻图片合并为一个请求，合并结果无法拆分的图片再逐张请求。
+    """
+    return [result async for result in iter_extract_images_async(llm_client, tasks, image_data_url, batcher)]
+
+
+async def iter_extract_images_async(llm_client, tasks: list[tuple[int, str]], image_data_url,
+                                    batcher: ImageBatcher = None) -> AsyncIterator[tuple[int, str]]:
+    """extract_images_async的流式版本，每张图片提取完成时立即产出(索引, 提取结果)"""
+    async def process_image(image_url, idx):
+        response = await llm_client.get_response(messages=build_extraction_message(image_url), task='vlm')
+        return [(idx, response.split('wyaf')[-1])]
+
+    async def process_batch(group):
+        image_urls = await asyncio.gather(*(asyncio.to_thread(image_data_url, image) for _, image in group))
+        results = []
+        for batch in batcher.split(image_urls):
+            parts = None
+            if len(batch) > 1:
+                parts = await extract_batch_async(llm_client, batcher, [image_urls[i] for i in batch])
+            if parts is None:
+                for finished in await asyncio.gather(*(process_image(image_urls[i], group[i][0]) for i in batch)):
+                    results.extend(finished)
+            else:
+                results.extend((group[i][0], part) for i, part in zip(batch, parts))
+        return results
+
+    async def process_single(image, idx):
+        return await process_image(await asyncio.to_thread(image_data_url, image), idx)
+
+    async def run(func, *args):
+        try:
+            return await func(*args)
+        finally:
+            gate.leave()
+
+    # 任务只在并发名额允许时创建，排队的任务不提前读取和编码图片
+    gate = AdmissionGate(lambda: llm_client.concurrency_limit('vlm'))
+    if batcher is None:
+        queue = deque((process_single, image, idx) for idx, image in tasks)
+    else:
+        queue = deque((process_batch, group) for group in batcher.group(tasks))
+    pending = set()
+    try:
+        with tqdm.tqdm(desc="Processing images", total=len(tasks)) as progress:
+            while queue or pending:
+                while queue and gate.try_enter():
+                    pending.add(asyncio.ensure_future(run(*queue.popleft())))
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    finished = task.result()
+                    progress.update(len(finished))
+                    for result in finished:
+                        yield result
+    finally:
+        for task in pending:
+            task.cancel()
+
+
+async def extract_batch_async(llm_client, batcher: ImageBatcher, image_urls: list[str]) -> Optional[list[str]]:
+    """extract_batch的异步版本"""
+    try:
+        response = await llm_client.get_response(messages=batcher.build_message(image_urls), task='vlm')
+    except Exception as e:
+        logging.warning(f"{len(image_urls)}张图片的合并请求失败，改为逐张请求: {str(e)}")
+        batcher.record(len(image_urls), fallback=True)
+        return None
+    parts = batcher.parse(response, len(image_urls))
+    if parts is None:
+        logging.warning(f"{len(image_urls)}张图片的合并请求结果无法按图片拆分，改为逐张请求")
+    batcher.record(len(image_urls), fallback=parts is None)
+    return parts
+
+
+async def summarize_segment_async(llm_client, idx: int, segment: str) -> str:
+    """summarize_segment的异步版本"""
+    message = [{"role": "user", "content": build_segment_prompt(idx, segment)}]
+    response = await llm_client.get_response(messages=message)
+    return format_segment_summary(idx, response)
+
+
+async def summarize_segments_async(llm_client, merged_segments: list[str]) -> list[str]:
+    """使用异步客户端并发总结各段内容，结果顺序与分段顺序一致"""
+    return await asyncio.gather(*(summarize_segment_async(llm_client, idx, segment)
+                                  for idx, segment in enumerate(merged_segments)))
+
+
+async def extract_and_summarize_async(llm_client, tasks: list[tuple[int, str]], image_data_url,
+                                      tracker: SegmentTracker, batcher: ImageBatcher = None,
+                                      completed: list[tuple[int, str]] = ()) -> tuple[list[tuple[int, str]], list[str]]:
+    """extract_and_summarize的异步版本"""
+    results = list(completed)
+    futures = {}
+
+    def launch(ready):
+        for segment_idx, segment in ready:
+            logging.info(f"第{segment_idx + 1}段的图片已全部提取，开始分段总结")
+            futures[segment_idx] = asyncio.ensure_future(summarize_segment_async(llm_client, segment_idx, segment))
+
+    try:
+        launch(tracker.ready())
+        for idx, result in completed:
+            launch(tracker.add(idx - 1, result))
+        async for idx, result in iter_extract_images_async(llm_client, tasks, image_data_url, batcher):
+            results.append((idx, result))
+            launch(tracker.add(idx - 1, result))
+        segments_desc = await asyncio.gather(*(futures[segment_idx] for segment_idx in sorted(futures)))
+    except BaseException:
+        # 提取失败时取消已经开始的分段总结
+        for future in futures.values():
+            future.cancel()
+        raise
+    return results, list(segments_desc)
+
+
+def run_async(llm_client, coroutine):
+    """在新的事件循环中运行协程，结束后关闭该事件循环中创建的客户端"""
+    async def runner():
+        try:
+            return await coroutine
+        finally:
+            await llm_client.aclose()
+    return asyncio.run(runner())
+
+
+def stream_final_summary(llm_client, message: list[dict], on_delta=None, on_reset=None) -> str:
+    """流式生成最终总结，返回去除思考过程后的完整正文
+
+    :param on_delta: 收到正文增量时的回调，未提供时输出到标准输出
+    :param on_reset: 模型的思考过程在输出后才被识别时的回调，调用方应清空已显示的内容
+    """
+    to_stdout = on_delta is None
+    if to_stdout:
+        print("最终总结：", end='', flush=True)
+        on_delta = lambda delta: print(delta, end='', flush=True)
+    parts = []
+
+    def reset():
+        parts.clear()
+        if on_reset is not None:
+            on_reset()
+
+    for delta in llm_client.stream_response(messages=message, on_reset=reset):
+        parts.append(delta)
+        on_delta(delta)
+    if to_stdout:
+        print()
+    return ''.join(parts)
+
+
+def main(service=None, images=None, on_summary_delta=None, on_summary_reset=None):
+    """生成参会报告
+
+    :param service: 使用的服务类型，未指定时从配置文件中加载
+    :param images: 按拍摄时间排序的图片列表，未指定时处理默认目录
+    :param on_summary_delta: 提供时以流式方式生成最终总结，每收到一段正文调用一次
+    :param on_summary_reset: 流式输出的内容需要丢弃时调用
+    """
+    config = load_config()
+    # 记录本次运行中每次LLM调用的token数、耗时和费用
+    metrics = RunMetrics.start(config)
+    # 如果没有指定service，则从配置文件中加载
+    service = resolve_service(service)
+    # 启用异步模式时，VLM提取和分段总结通过asyncio并发执行
+    use_async = config.get('async', {}).get('enabled', False)
+    # 通过注册中心获取客户端实例
+    llm_client = create_llm_client(service, async_client=use_async)
+    # 创建图像处理器实例，转换结果缓存在本地，重复运行时无需再次转换
+    image_processor = ImageProcessor(cache=ConvertedImageCache.from_config(config))
 
     # 如果没有提供图片列表，则使用默认逻辑
     if images is None:
@@ -67,9 +479,13 @@ def main(service=None, images=None):
 
         for postfix in postfixes:
             photo_dir = 'images' + '_' + postfix
-            # 使用图像处理器处理目录下的所有图片
-            processed_files = image_processor.process_directory(photo_dir)
-            logging.info(f"在{photo_dir}处理了{len(processed_files)}张照片文件")
+            # 直接读取原始图片，非JPEG图片在发送前于内存中转换，不在照片目录中写入中间文件
+            # 旧版本在源文件旁写入的转换结果（例如IMG_0001.heic.jpeg）会被跳过，避免重复处理
+            processed_files = [
+                file_path for file_path in image_processor.scan_images(photo_dir)
+                if image_processor.is_supported(file_path) and not image_processor.is_converted_copy(file_path)
+            ]
+            logging.info(f"在{photo_dir}找到{len(processed_files)}张照片文件")
             images.extend(processed_files)
 
         # 使用图像处理器按照拍摄时间排序图片（从远到近）
@@ -84,55 +500,89 @@ def main(service=None, images=None):
         timestamp = int(time.time())
         images_desc_file = f"images_desc_custom_{timestamp}.md"
         final_summary_file = f"final_summary_custom_{timestamp}.md"
+        filter_report_file = f"filter_report_custom_{timestamp}.json"
+        metrics_file = f"metrics_custom_{timestamp}.json"
     else:
         # 使用原来的逻辑
         images_desc_file = f"images_desc_{'_'.join(postfixes)}.md"
         final_summary_file = f"final_summary_{'_'.join(postfixes)}.md"
+        filter_report_file = f"filter_report_{'_'.join(postfixes)}.json"
+        metrics_file = f"metrics_{'_'.join(postfixes)}.json"
 
     if not os.path.exists(images_desc_file):
         idx = 1
-    # 定义一个函数用于处理单张图片并返回结果
-    def process_image(image, idx, llm_client):
-        """
-        处理单张图片并返回结果
-        
-        :param image: 图片文件路径
-        :param idx: 图片索引
-        :param llm_client: LLM客户端实例
-        :return: (索引, 处理结果)元组
-        """
-        message = [
-            {
-                "role": "user",
-                "content": [
-                    {
-                        "type": "image_url",
-                        "image_url": {
-                            "url": f"data:image/jpeg;base64,{encode_image(image)}",
-                        },
-                    },
-                    {"type": "text", "text": "你是一个专业学者，从当前输入的图片中找到slide内容，并且提取其中的信息。"},
-                ],
-            }
-        ]
-        response = llm_client.get_response(messages=message, task='vlm')
-        return (idx, response.split('wyaf')[-1])
+    # 发送给VLM前先缩放并重新压缩图片，减少上传体积
+    payload_preparer = ImagePayloadPreparer.from_config(config, image_processor)
+
+    def image_data_url(image):
+        """生成图片的data URL，未启用预处理时直接编码原图"""
+        if payload_preparer is None:
+            mime_type = 'image/png' if image.lower().endswith('.png') else 'image/jpeg'
+            return f"data:{mime_type};base64,{encode_image(image, image_processor)}"
+        return payload_preparer.to_data_url(image)
+
+    # 在本地过滤模糊照片和非幻灯片照片，避免浪费VLM调用
+    photo_filter = SlidePhotoFilter.from_config(config)
+    if photo_filter is not None:
+        sorted_images, filter_records = photo_filter.filter(sorted_images)
+        photo_filter.write_report(filter_records, filter_report_file)
+
+    # 同一张幻灯片的多次拍摄只保留最清晰的一张送入VLM
+    deduplicator = SlideDeduplicator.from_config(config)
+    duplicate_of = {}
+    if deduplicator is not None:
+        duplicate_of = deduplicator.find_duplicates(sorted_images, image_processor.get_image_timestamp)
+    image_index = {image: idx + 1 for idx, image in enumerate(sorted_images)}
 
     # 使用线程池处理图片，并保持结果顺序
-    max_threads = 8
-    results = []
-
-    with concurrent.futures.ThreadPoolExecutor(max_workers=max_threads) as executor:
-        # 提交所有任务
-        future_to_idx = {
-            executor.submit(process_image, sorted_images[idx], idx + 1, llm_client): idx
-            for idx in range(len(sorted_images))
-        }
+    # 启用自适应并发时，同时进行的请求数由VLM服务的AIMD控制器动态调整，线程数只作为上限
+    max_threads = llm_client.concurrency_ceiling('vlm')
+    # 连接池上限与并发数匹配，所有线程共享长连接
+    pool_config = config.get('http_pool', {})
+    LLMHttpClientPool.configure(
+        max_connections=pool_config.get('max_connections', max_threads),
+        max_keepalive_connections=pool_config.get('max_keepalive_connections', max_threads),
+    )
 
-        # 收集结果，确保按顺序处理
-        for future in tqdm.tqdm(concurrent.futures.as_completed(future_to_idx), desc="Processing images", total=len(sorted_images)):
-            idx, result = future.result()
-            results.append((idx, result))
+    # 近重复图片无需提交
+    tasks = [(idx + 1, image) for idx, image in enumerate(sorted_images) if image not in duplicate_of]
+    # 启用合并请求时，相邻的多张图片在一个请求中提取
+    batcher = ImageBatcher.from_config(config, llm_client.service_types())
+    # 启用离线批处理时，提取请求写入JSONL任务文件，通过批处理接口提交，未返回结果的图片再在线请求
+    batch_runner = BatchInferenceRunner.from_config(config, llm_client)
+    offline_results = []
+    if batch_runner is not None:
+        offline_results, tasks = extract_images_offline(batch_runner, tasks, image_data_url)
+    # 按拍摄时间间隔把图片划分为一场场报告，以报告作为分段总结的单位，近重复图片的提示不参与总结
+    segmenter = SessionSegmenter.from_config(config)
+    sessions = segmenter.segment(sorted_images, image_processor.get_image_timestamp)
+    # 启用重叠时，一场报告及其之前的报告提取完成后立即开始总结，不等待全部图片提取完成
+    overlap = config.get('pipeline', {}).get('overlap', True)
+    if overlap:
+        tracker = SegmentTracker(segmenter, sessions, [idx - 1 for idx, _ in offline_results + tasks])
+        if use_async:
+            results, segments_desc = run_async(llm_client, extract_and_summarize_async(
+                llm_client, tasks, image_data_url, tracker, batcher, offline_results))
+        else:
+            results, segments_desc = extract_and_summarize(
+                llm_client, tasks, image_data_url, tracker, max_threads, batcher, offline_results)
+    else:
+        if not tasks:
+            results = []
+        elif use_async:
+            results = run_async(llm_client, extract_images_async(llm_client, tasks, image_data_url, batcher))
+        else:
+            results = extract_images(llm_client, tasks, image_data_url, max_threads, batcher)
+        results.extend(offline_results)
+
+    if payload_preparer is not None:
+        payload_preparer.log_stats()
+    if batcher is not None:
+        batcher.log_stats()
+
+    # 近重复图片指向其代表图片的提取结果
+    for image, representative in duplicate_of.items():
+        results.append((image_index[image], f"（与第{image_index[representative]}张图片为同一张幻灯片，内容见第{image_index[representative]}张图片）"))
 
     # 按索引顺序排序结果
     results.sort(key=lambda x: x[0])
@@ -141,60 +591,59 @@ def main(service=None, images=None):
     with open(images_desc_file, 'w') as f:
         for idx, result in results:
             f.write(f'第{idx}张图片\n{result}\n')
-    # 读取images_desc文件内容，并进行总结
-    with open(images_desc_file, 'r', encoding='utf-8') as f:
-        images_desc = f.read()
-    # 如果images_desc内容过长，可以分段处理，单个段落不超过102400个字符，分段时必须以“第x张图片”作为分隔符
-    # 首先基于正则表达式，按照"第x张图片"作为分隔符，将images_desc进行分段
-    segments = re.split(r'第\d+张图片\s*\n', images_desc)
-    logging.info(f"分割后的段落数量: {len(segments)}")
-    # 去除空段落
-    segments = [segment.strip() for segment in segments if segment.strip()]
-    logging.info(f"去除空段落后的段落数量: {len(segments)}")
-    # 对分割后的段落进行合并，每个段落不超过max_length个字符
-    max_length = 10 * 1024  # 50k字符
-    merged_segments = []
-    current_segment = ""
-    for segment in tqdm.tqdm(segments, desc="合并段落"):
-        if len(current_segment) + len(segment) + 1 <= max_length:
-            if current_segment:
-                current_segment += "\n"  # 添加换行符
-            current_segment += segment
+    if overlap:
+        logging.info(f"分段数：{len(segments_desc)}")
+    else:
+        extractions = {idx - 1: result for idx, result in results if sorted_images[idx - 1] not in duplicate_of}
+        merged_segments = segmenter.build_segments(sessions, extractions)
+        logging.info(f"分段数：{len(merged_segments)}")
+        # 对提取的slides信息进行总结
+        if use_async:
+            segments_desc = run_async(llm_client, summarize_segments_async(llm_client, merged_segments))
         else:
-            merged_segments.append(current_segment)
-            current_segment = segment
-    merged_segments.append(current_segment)
-    logging.info(f"分段数：{len(merged_segments)}")
-    # 对提取的slides信息进行总结
-    segments_desc = []
-    for idx, segment in tqdm.tqdm(enumerate(merged_segments), desc="处理分段总结"):
-        prompt = f"""
-        你是一个学术会议参会报告总结专家，请根据以下图片内容，分专题进行总结，并输出一个总结报告。
-        总结时需要注意：
-        1. 每个专题可能关联多张图片，需对每个专题的内容进行精准归纳与提炼。
-        2. 总结内容应做到逻辑清晰、言简意赅，着重突出关键要点。
-        【原始内容】
-        第{idx + 1}段内容：
-        {segment}
-        """
-        message = [{"role": "user", "content": prompt}]
-        response = llm_client.get_response(messages=message)
-        segments_desc.append(f"第{idx + 1}段总结：\n{response.split('</think>')[-1]}")
+            segments_desc = summarize_segments(llm_client, merged_segments)
     logging.info(f"进行语义分割后的主题数量为：{len(segments_desc)}")
     # 对多段总结描述进行最终总结
     segments_desc_combined = "\n".join(segments_desc)
-    prompt = f"""
-    【任务描述】
-        你作为一名专业的学术会议参会报告总结专家，需依据以下分段总结内容进行归纳，生成一份条理清晰、重点突出的简要会议总结。
-    【总结要求】
-        1. 总结内容需具备高度的逻辑性和专业性，精准提炼关键要点，避免冗余表述。
-        2. 确保内容简洁明了，杜绝重复信息和多余语句。
-    【原始分段总结内容】
-        {segments_desc_combined}
-    """
-    message = [{"role": "user", "content": prompt}]
-    response = llm_client.get_response(messages=message)
-    print(f"最终总结：{response.split('</think>')[-1]}")
+    message = [{"role": "user", "content": build_final_prompt(segments_desc_combined)}]
+    # 思考模型的最终总结耗时较长，流式输出让用户尽早看到内容
+    if on_summary_delta is not None or config.get('stream', {}).get('enabled', False):
+        # 异步客户端使用其对应的同步客户端进行流式请求
+        stream_client = getattr(llm_client, 'sync_client', llm_client)
+        response = stream_final_summary(stream_client, message, on_summary_delta, on_summary_reset)
+    else:
+        if use_async:
+            response = run_async(llm_client, llm_client.get_response(messages=message))
+        else:
+            response = llm_client.get_response(messages=message)
+        print(f"最终总结：{response.split('</think>')[-1]}")
+    logging.info(f"LLM连接池复用情况: {LLMHttpClientPool.stats()}")
+    logging.info(f"LLM请求重试情况: {RetryStats.stats()}")
+    hedge_stats = HedgeStats.stats()
+    if hedge_stats:
+        logging.info(f"LLM请求对冲情况: {hedge_stats}")
+    if isinstance(llm_client, llm_balancer.LoadBalancedClientBase):
+        llm_client.log_stats()
+    for controller in AIMDConcurrencyController.all_controllers():
+        controller.log_trajectory()
+    for limiter in ProviderRateLimiter.all_limiters():
+        logging.info(f"{limiter.name}限流情况: {limiter.stats()}")
+    metrics.log_summary()
+    extra = {
+        'service': service,
+        'retries': RetryStats.stats(),
+        'hedging': hedge_stats,
+        'http_pool': LLMHttpClientPool.stats(),
+        'concurrency': {controller.name: controller.summary()
+                        for controller in AIMDConcurrencyController.all_controllers()},
+        'rate_limits': {limiter.name: limiter.stats() for limiter in ProviderRateLimiter.all_limiters()},
+        'streams': StreamStats.stats(),
+    }
+    if batcher is not None:
+        extra['vlm_batching'] = batcher.stats()
+    if isinstance(llm_client, llm_balancer.LoadBalancedClientBase):
+        extra['load_balancing'] = llm_client.stats()
+    metrics.export_json(metrics_file, extra)
     with open(final_summary_file, "w") as f:
         f.write(response.split("[SPEAK]")[-1])
 
@@ -0,0 +1,382 @@
+import json
+import math
+import time
+import random
+import logging
+import argparse
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from typing import Optional
+
+from llm_ratelimit import TokenBucket, estimate_tokens, estimate_text_tokens
+
+# 设置日志记录
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+# 生成合成回复使用的句子
+SYNTHETIC_SENTENCES = [
+    "本页幻灯片介绍了研究背景与动机，指出现有方法在大规模场景下存在效率瓶颈。",
+    "作者提出了一种新的模型结构，通过分层注意力机制降低计算开销。",
+    "实验部分在三个公开数据集上进行了评测，结果优于现有基线方法。",
+    "消融实验表明各模块均对最终性能有明显贡献。",
+    "报告最后讨论了方法的局限性以及未来的研究方向。",
+]
+IMAGE_MARKER = '【图片{}】'
+
+
+class LatencyModel:
+    """请求延迟分布，描述格式为"分布:参数1,参数2"
+
+    fixed:秒数、uniform:下限,上限、normal:均值,标准差、lognormal:中位数,sigma、exponential:均值。
+    tail_ratio比例的请求额外增加tail_delay秒，用于模拟长尾。
+    """
+    def __init__(self, spec: str = 'fixed:0', tail_ratio: float = 0.0, tail_delay: float = 0.0):
+        kind, _, params = spec.partition(':')
+        self.kind = kind
+        self.params = [float(value) for value in params.split(',') if value.strip()]
+        if kind not in ('fixed', 'uniform', 'normal', 'lognormal', 'exponential'):
+            raise ValueError(f"不支持的延迟分布: {spec}")
+        self.spec = spec
+        self.tail_ratio = tail_ratio
+        self.tail_delay = tail_delay
+
+    def sample(self, rng: random.Random) -> float:
+        p = self.params
+        if self.kind == 'fixed':
+            value = p[0] if p else 0.0
+        elif self.kind == 'uniform':
+            value = rng.uniform(p[0], p[1])
+        elif self.kind == 'normal':
+            value = rng.gauss(p[0], p[1])
+        elif self.kind == 'lognormal':
+            value = rng.lognormvariate(math.log(p[0]), p[1])
+        else:
+            value = rng.expovariate(1.0 / p[0])
+        if self.tail_ratio and rng.random() < self.tail_ratio:
+            value += self.tail_delay
+        return max(0.0, value)
+
+
+class MockLLMServer:
+    """本地模拟的OpenAI兼容服务，支持/v1/chat/completions（含流式输出）和/v1/models
+
+    用于在不消耗API配额的情况下压测LLMClient和main_func的流水线：延迟分布、错误和429注入、
+    服务端RPM/TPM限流和并发上限都可以配置，固定随机种子时结果可复现。
+    LocalLLMClient指向该服务的配置示例：{"api_type": "本地大模型", "local_llm": {"llm_address": "127.0.0.1", "llm_port": 8000}}
+    """
+    def __init__(self, host: str = '127.0.0.1', port: int = 8000, latency: str = 'fixed:0', tail_ratio: float = 0.0,
+                 tail_delay: float = 0.0, tokens_per_second: float = 0.0, error_rate: float = 0.0,
+                 rate_limit_rate: float = 0.0, timeout_rate: float = 0.0, hang_seconds: float = 600.0,
+                 rpm: float = None, tpm: float = None, max_concurrency: int = None, mode: str = 'synthetic',
+                 responses: list[str] = None, completion_tokens: int = 200, think: bool = False, seed: int = None):
+        self.host = host
+        self.port = port
+        # 首token之前的延迟
+        self.latency = LatencyModel(latency, tail_ratio, tail_delay)
+        # 生成速度，为0时回复一次性返回
+        self.tokens_per_second = tokens_per_second
+        # 随机返回500、429的比例，以及不返回任何内容直到hang_seconds秒后断开的比例
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.timeout_rate = timeout_rate
+        self.hang_seconds = hang_seconds
+        # 服务端配额，超出时返回429和Retry-After
+        self.requests = TokenBucket(rpm) if rpm else None
+        self.tokens = TokenBucket(tpm) if tpm else None
+        self.max_concurrency = max_concurrency
+        # synthetic：按请求中的图片数生成合成内容；echo：返回最后一条用户消息的文本；canned：依次返回responses中的回复
+        if mode not in ('synthetic', 'echo', 'canned'):
+            raise ValueError(f"不支持的回复模式: {mode}")
+        self.mode = mode
+        self.responses = responses or ['这是一条预设的回复。']
+        self.completion_tokens = completion_tokens
+        # 在回复前加上<think>思考过程，模拟推理模型
+        self.think = think
+        self._rng = random.Random(seed)
+        self._rng_lock = threading.Lock()
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._canned_index = 0
+        self._stats = {'requests': 0, 'ok': 0, 'errors': 0, 'rate_limited': 0, 'quota_limited': 0,
+                       'concurrency_limited': 0, 'timeouts': 0, 'streams': 0, 'peak_in_flight': 0,
+                       'prompt_tokens': 0, 'completion_tokens': 0}
+        self._server = None
+        self._thread = None
+
+    @classmethod
+    def from_config(cls, settings: dict) -> 'MockLLMServer':
+        """根据配置字典创建服务，键与构造函数参数一致"""
+        return cls(**settings)
+
+    @property
+    def url(self) -> str:
+        return f"http://{self.host}:{self.port}/v1"
+
+    def _random(self) -> float:
+        with self._rng_lock:
+            return self._rng.random()
+
+    def _sample_latency(self) -> float:
+        with self._rng_lock:
+            return self.latency.sample(self._rng)
+
+    def _count(self, key: str, amount: int = 1):
+        with self._lock:
+            self._stats[key] += amount
+
+    def stats(self) -> dict:
+        with self._lock:
+            return dict(self._stats)
+
+    def start(self) -> 'MockLLMServer':
+        """在后台线程中启动服务，port为0时使用系统分配的端口"""
+        self._server = ThreadingHTTPServer((self.host, self.port), self._handler_class())
+        self._server.daemon_threads = True
+        self.port = self._server.server_address[1]
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        logging.info(f"模拟LLM服务已启动: {self.url}")
+        return self
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def serve_forever(self):
+        self.start()
+        try:
+            self._thread.join()
+        except KeyboardInterrupt:
+            self.stop()
+
+    def admit(self, body: dict) -> Optional[tuple[int, str, float]]:
+        """判断是否受理请求，拒绝时返回(状态码, 错误信息, Retry-After秒数)"""
+        if self._random() < self.rate_limit_rate:
+            self._count('rate_limited')
+            return 429, '模拟的限流错误', 1.0
+        if self._random() < self.error_rate:
+            self._count('errors')
+            return 500, '模拟的服务端错误', 0.0
+        if self.requests is not None:
+            wait = self.requests.reserve(1)
+            if wait > 0:
+                self.requests.adjust(-1)
+                self._count('quota_limited')
+                return 429, '超出每分钟请求数配额', wait
+        if self.tokens is not None:
+            tokens = estimate_tokens(body.get('messages', []), completion_tokens=self.completion_tokens)
+            wait = self.tokens.reserve(tokens)
+            if wait > 0:
+                self.tokens.adjust(-tokens)
+                self._count('quota_limited')
+                return 429, '超出每分钟token数配额', wait
+        return None
+
+    def enter(self) -> bool:
+        """占用一个并发名额，超出并发上限时返回False"""
+        with self._lock:
+            if self.max_concurrency is not None and self._in_flight >= self.max_concurrency:
+                self._stats['concurrency_limited'] += 1
+                return False
+            self._in_flight += 1
+            self._stats['peak_in_flight'] = max(self._stats['peak_in_flight'], self._in_flight)
+            return True
+
+    def leave(self):
+        with self._lock:
+            self._in_flight -= 1
+
+    def generate(self, messages: list[dict]) -> str:
+        """生成回复内容"""
+        if self.mode == 'canned':
+            with self._lock:
+                text = self.responses[self._canned_index % len(self.responses)]
+                self._canned_index += 1
+        elif self.mode == 'echo':
+            text = _last_user_text(messages)
+        else:
+            images = sum(1 for message in messages if isinstance(message.get('content'), list)
+                         for part in message['content'] if part.get('type') == 'image_url')
+            if images > 1:
+                # 合并请求按图片序号分段输出
+                text = '\n'.join(IMAGE_MARKER.format(k) + '\n' + self._synthetic(self.completion_tokens)
+                                 for k in range(1, images + 1))
+            else:
+                text = self._synthetic(self.completion_tokens)
+        if self.think:
+            text = f"<think>\n{self._synthetic(self.completion_tokens // 2)}\n</think>\n\n{text}"
+        return text
+
+    def _synthetic(self, tokens: int) -> str:
+        parts = []
+        with self._rng_lock:
+            while estimate_text_tokens(''.join(parts)) < tokens:
+                parts.append(self._rng.choice(SYNTHETIC_SENTENCES))
+        return ''.join(parts)
+
+    def _handler_class(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, format, *args):
+                pass
+
+            def _send_json(self, status: int, payload: dict, headers: dict = None):
+                data = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                for key, value in (headers or {}).items():
+                    self.send_header(key, value)
+                self.end_headers()
+                self.wfile.write(data)
+
+            def _send_chunk(self, data: bytes):
+                self.wfile.write(b'%x\r\n%s\r\n' % (len(data), data))
+                self.wfile.flush()
+
+            def do_GET(self):
+                if self.path.rstrip('/') == '/v1/models':
+                    self._send_json(200, {'object': 'list', 'data': [{'id': 'mock', 'object': 'model'}]})
+                elif self.path.rstrip('/') == '/stats':
+                    self._send_json(200, server.stats())
+                else:
+                    self._send_json(404, {'error': {'message': 'not found'}})
+
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+                if self.path.rstrip('/') != '/v1/chat/completions':
+                    self._send_json(404, {'error': {'message': 'not found'}})
+                    return
+                server._count('requests')
+                rejection = server.admit(body)
+                if rejection is not None:
+                    status, message, retry_after = rejection
+                    headers = {'Retry-After': str(math.ceil(retry_after))} if status == 429 else {}
+                    self._send_json(status, {'error': {'message': message, 'type': 'mock_error'}}, headers)
+                    return
+                if not server.enter():
+                    self._send_json(429, {'error': {'message': '超出并发上限', 'type': 'mock_error'}},
+                                    {'Retry-After': '1'})
+                    return
+                try:
+                    if server._random() < server.timeout_rate:
+                        server._count('timeouts')
+                        time.sleep(server.hang_seconds)
+                        self.close_connection = True
+                        return
+                    time.sleep(server._sample_latency())
+                    self._complete(body)
+                finally:
+                    server.leave()
+
+            def _complete(self, body: dict):
+                messages = body.get('messages', [])
+                text = server.generate(messages)
+                prompt_tokens = estimate_tokens(messages)
+                completion_tokens = estimate_text_tokens(text)
+                server._count('prompt_tokens', prompt_tokens)
+                server._count('completion_tokens', completion_tokens)
+                if server.tokens is not None:
+                    # 按实际生成长度修正token配额
+                    server.tokens.adjust(completion_tokens - server.completion_tokens)
+                usage = {'prompt_tokens': prompt_tokens, 'completion_tokens': completion_tokens,
+                         'total_tokens': prompt_tokens + completion_tokens}
+                model = body.get('model', 'mock')
+                created = int(time.time())
+                if not body.get('stream'):
+                    if server.tokens_per_second > 0:
+                        time.sleep(completion_tokens / server.tokens_per_second)
+                    server._count('ok')
+                    self._send_json(200, {
+                        'id': f'chatcmpl-mock-{created}', 'object': 'chat.completion', 'created': created,
+                        'model': model, 'usage': usage,
+                        'choices': [{'index': 0, 'finish_reason': 'stop',
+                                     'message': {'role': 'assistant', 'content': text}}],
+                    })
+                    return
+                server._count('streams')
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/event-stream')
+                self.send_header('Transfer-Encoding', 'chunked')
+                self.end_headers()
+
+                def event(delta: dict, finish_reason=None, extra: dict = None):
+                    chunk = {'id': f'chatcmpl-mock-{created}', 'object': 'chat.completion.chunk',
+                             'created': created, 'model': model,
+                             'choices': [{'index': 0, 'delta': delta, 'finish_reason': finish_reason}]}
+                    chunk.update(extra or {})
+                    self._send_chunk(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode('utf-8'))
+
+                event({'role': 'assistant', 'content': ''})
+                # 每个事件约4个token
+                step = 4
+                for start in range(0, len(text), step):
+                    piece = text[start:start + step]
+                    if server.tokens_per_second > 0:
+                        time.sleep(estimate_text_tokens(piece) / server.tokens_per_second)
+                    event({'content': piece})
+                include_usage = (body.get('stream_options') or {}).get('include_usage', False)
+                event({}, 'stop')
+                if include_usage:
+                    chunk = {'id': f'chatcmpl-mock-{created}', 'object': 'chat.completion.chunk',
+                             'created': created, 'model': model, 'choices': [], 'usage': usage}
+                    self._send_chunk(f"data: {json.dumps(chunk)}\n\n".encode('utf-8'))
+                self._send_chunk(b'data: [DONE]\n\n')
+                self.wfile.write(b'0\r\n\r\n')
+                server._count('ok')
+
+        return Handler
+
+
+def _last_user_text(messages: list[dict]) -> str:
+    """返回最后一条用户消息中的文本"""
+    for message in reversed(messages):
+        if message.get('role') != 'user':
+            continue
+        content = message.get('content')
+        if isinstance(content, str):
+            return content
+        return '\n'.join(part.get('text', '') for part in content or [] if part.get('type') == 'text')
+    return ''
+
+
+def main():
+    parser = argparse.ArgumentParser(description='本地模拟的OpenAI兼容LLM服务，用于压测')
+    parser.add_argument('--config', help='JSON配置文件，键与MockLLMServer的参数一致，命令行参数优先')
+    parser.add_argument('--settings', help='JSON字符串形式的配置，优先于--config')
+    parser.add_argument('--host', default=None)
+    parser.add_argument('--port', type=int, default=None)
+    parser.add_argument('--latency', help='首token延迟分布，例如lognormal:0.8,0.4')
+    parser.add_argument('--tail-ratio', type=float)
+    parser.add_argument('--tail-delay', type=float)
+    parser.add_argument('--tokens-per-second', type=float)
+    parser.add_argument('--error-rate', type=float)
+    parser.add_argument('--rate-limit-rate', type=float)
+    parser.add_argument('--timeout-rate', type=float)
+    parser.add_argument('--rpm', type=float)
+    parser.add_argument('--tpm', type=float)
+    parser.add_argument('--max-concurrency', type=int)
+    parser.add_argument('--mode', choices=['synthetic', 'echo', 'canned'])
+    parser.add_argument('--completion-tokens', type=int)
+    parser.add_argument('--think', action='store_true', default=None)
+    parser.add_argument('--seed', type=int)
+    args = parser.parse_args()
+
+    settings = {}
+    if args.config:
+        with open(args.config, 'r', encoding='utf-8') as f:
+            settings = json.load(f)
+    if args.settings:
+        settings.update(json.loads(args.settings))
+    settings.update({key: value for key, value in vars(args).items()
+                     if key not in ('config', 'settings') and value is not None})
+    MockLLMServer.from_config(settings).serve_forever()
+
+
+if __name__ == "__main__":
+    main()